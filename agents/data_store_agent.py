@@ -15,6 +15,7 @@ from supabase import create_client, Client
 from datetime import date, datetime, timedelta
 import os
 from dotenv import load_dotenv
+from data_versions import bump_data_version
 
 # Load environment variables
 load_dotenv()
@@ -89,6 +90,7 @@ def check_and_log_complete_data(ctx: Context):
 
             # Upsert all records (insert or update if farm_id + date exists)
             result = supabase.table("weather_data").upsert(weather_records).execute()
+            bump_data_version(supabase, "weather_data")
 
             ctx.logger.info(f"✅ Weather data inserted to Supabase for farm: {FARM_ID}")
             ctx.logger.info(f"Inserted {len(weather_records)} daily forecast records")
@@ -116,6 +118,7 @@ def check_and_log_complete_data(ctx: Context):
                     .upsert(price_records, on_conflict="date,crop_name")
                     .execute()
                 )
+                bump_data_version(supabase, "market_prices")
 
                 ctx.logger.info(
                     f"✅ Market data inserted to Supabase for crop: {market['crop_name']}"
@@ -0,0 +1,24 @@
+from supabase import Client
+
+
+def bump_data_version(client: Client, table_name: str):
+    """
+    Bump the version stamp for a Supabase table after writing to it.
+
+    The server caches realtime farm data per table and compares these stamps
+    to decide when a cached section is stale, so every agent write to a table
+    the server reads should be followed by a bump.
+
+    Args:
+        client: Supabase client used for the write
+        table_name: Name of the table that was written
+
+    Returns:
+        The new version number, or None if the bump failed
+    """
+    try:
+        result = client.rpc("bump_data_version", {"p_table_name": table_name}).execute()
+        return result.data
+    except Exception as e:
+        print(f"Error bumping data version for {table_name}: {e}")
+        return None
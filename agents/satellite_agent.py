@@ -4,6 +4,7 @@ import os
 from supabase import create_client, Client
 import ee
 from dotenv import load_dotenv
+from data_versions import bump_data_version
 
 load_dotenv()
 
@@ -250,6 +251,7 @@ def fetch_satellite_data(farm_id: str):
         .eq("id", 1)
         .execute()
     )
+    bump_data_version(supabase_client, "satellite_data_table")
     print(f"Satellite data block updated into database: {result.data}")
 
     return aggregate_block
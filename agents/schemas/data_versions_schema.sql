@@ -0,0 +1,17 @@
+create table public.data_versions (
+  table_name text not null,
+  version bigint not null default 0,
+  updated_at timestamp with time zone not null default now(),
+  constraint data_versions_pkey primary key (table_name)
+) TABLESPACE pg_default;
+
+create or replace function public.bump_data_version(p_table_name text)
+returns bigint
+language sql
+as $$
+  insert into public.data_versions (table_name, version, updated_at)
+  values (p_table_name, 1, now())
+  on conflict (table_name)
+  do update set version = public.data_versions.version + 1, updated_at = now()
+  returning version;
+$$;
@@ -4,6 +4,7 @@ import ee
 from supabase import create_client, Client
 import os
 from dotenv import load_dotenv
+from data_versions import bump_data_version
 
 load_dotenv()
 
@@ -216,6 +217,7 @@ def get_soil_ph(latitude: float, longitude: float) -> tuple[ee.Image, dict]:
         .eq("farm_id", "FARM01")
         .execute()
     )
+    bump_data_version(supabase_client, "environmental_data")
 
     return soil_pH, stats  # return the actual stats dictionary
 
@@ -0,0 +1,228 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted or queued for an upstream slot."""
+
+    def __init__(self, message: str, reason: str, retry_after: int):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """A request's place in the admission queue, or its upstream slot once admitted."""
+
+    def __init__(self, controller, client_id):
+        self.controller = controller
+        self.client_id = client_id
+        self.enqueued_at = time.monotonic()
+        self.admitted_at = None
+        self.finished = False
+        self._event = threading.Event()
+        self._wakeups = []
+
+    @property
+    def admitted(self) -> bool:
+        return self._event.is_set()
+
+    def wait_seconds(self) -> float:
+        """Seconds spent waiting in the queue (so far, if still queued)."""
+        end = self.admitted_at if self.admitted_at is not None else time.monotonic()
+        return end - self.enqueued_at
+
+    def position(self) -> int:
+        """Estimated 1-based place in the queue, or 0 once admitted."""
+        return self.controller.position(self)
+
+    def wait(self, timeout: float) -> bool:
+        """Block until admitted or timeout; returns whether admitted."""
+        return self._event.wait(timeout)
+
+    async def wait_async(self, timeout: float) -> bool:
+        """Wait without blocking the event loop; returns whether admitted."""
+        if self._event.is_set():
+            return True
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+        self.controller._on_admit(self, wake)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # Do not wake a loop that stopped waiting (it may even be closed)
+            self.controller._cancel_wake(self, wake)
+        return self._event.is_set()
+
+    def _admit(self):
+        # Called with the controller lock held
+        self.admitted_at = time.monotonic()
+        self._event.set()
+        wakeups, self._wakeups = self._wakeups, []
+        for wake in wakeups:
+            wake()
+
+
+class AdmissionController:
+    """
+    Bound the number of concurrent upstream LLM calls in this process.
+
+    Requests beyond max_concurrent wait in a bounded queue. Waiting requests are
+    admitted round-robin across clients, so one client sending many prompts
+    cannot starve the others. When the queue (or the client's share of it) is
+    full, enter() fails fast with AdmissionRejected instead of queueing.
+
+    Every ticket returned by enter() must be passed to leave() exactly once,
+    whether it was admitted, timed out in the queue or its client went away.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 16,
+        max_queued: int = 64,
+        max_queued_per_client: int = 4,
+        queue_timeout: float = 30.0,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_queued_per_client = max_queued_per_client
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        # client id -> deque of waiting tickets, in round-robin order
+        self._queues = OrderedDict()
+        self._queued = 0
+        # Moving average of how long a slot is held, for Retry-After
+        self._avg_hold = 5.0
+        self._admitted = 0
+        self._rejected = 0
+        self._abandoned = 0
+
+    def retry_after(self) -> int:
+        """Seconds a rejected client should wait before retrying."""
+        waves = (self._queued + 1) / max(self.max_concurrent, 1)
+        return max(1, math.ceil(self._avg_hold * waves))
+
+    def enter(self, client_id) -> AdmissionTicket:
+        """
+        Take an upstream slot if one is free, otherwise join the queue.
+
+        Raises:
+            AdmissionRejected: The queue or this client's share of it is full
+        """
+        ticket = AdmissionTicket(self, client_id)
+        with self._lock:
+            if self._active < self.max_concurrent and not self._queued:
+                self._active += 1
+                self._admitted += 1
+                ticket._admit()
+                return ticket
+
+            queue = self._queues.get(client_id)
+            if self._queued >= self.max_queued:
+                self._rejected += 1
+                raise AdmissionRejected(
+                    "Server is busy, please try again shortly",
+                    "queue_full",
+                    self.retry_after(),
+                )
+            if queue is not None and len(queue) >= self.max_queued_per_client:
+                self._rejected += 1
+                raise AdmissionRejected(
+                    "Too many requests in progress for this client",
+                    "client_queue_full",
+                    self.retry_after(),
+                )
+
+            if queue is None:
+                queue = self._queues[client_id] = deque()
+            queue.append(ticket)
+            self._queued += 1
+        return ticket
+
+    def leave(self, ticket: AdmissionTicket):
+        """Release the ticket's slot, or remove it from the queue if still waiting."""
+        with self._lock:
+            if ticket.finished:
+                return
+            ticket.finished = True
+
+            if ticket.admitted:
+                self._active -= 1
+                held = time.monotonic() - ticket.admitted_at
+                self._avg_hold = 0.9 * self._avg_hold + 0.1 * held
+                self._admit_next()
+                return
+
+            self._abandoned += 1
+            queue = self._queues.get(ticket.client_id)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                self._queued -= 1
+                if not queue:
+                    del self._queues[ticket.client_id]
+
+    def _admit_next(self):
+        # Called with the lock held: hand free slots to waiting clients in turn
+        while self._active < self.max_concurrent and self._queues:
+            client_id, queue = self._queues.popitem(last=False)
+            ticket = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._queues[client_id] = queue
+            self._active += 1
+            self._admitted += 1
+            ticket._admit()
+
+    def _on_admit(self, ticket: AdmissionTicket, wake):
+        with self._lock:
+            if ticket.admitted:
+                wake()
+            else:
+                ticket._wakeups.append(wake)
+
+    def _cancel_wake(self, ticket: AdmissionTicket, wake):
+        with self._lock:
+            if wake in ticket._wakeups:
+                ticket._wakeups.remove(wake)
+
+    def position(self, ticket: AdmissionTicket) -> int:
+        with self._lock:
+            queue = self._queues.get(ticket.client_id)
+            if ticket.admitted or queue is None or ticket not in queue:
+                return 0
+            # Clients take turns, so each other client gets up to index turns
+            # first, plus one more if it is ahead in the rotation
+            index = queue.index(ticket)
+            ahead = index
+            before = True
+            for client_id, other in self._queues.items():
+                if client_id == ticket.client_id:
+                    before = False
+                    continue
+                ahead += min(len(other), index + 1 if before else index)
+            return ahead + 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": self._active,
+                "queued": self._queued,
+                "queued_clients": len(self._queues),
+                "max_concurrent": self.max_concurrent,
+                "max_queued": self.max_queued,
+                "max_queued_per_client": self.max_queued_per_client,
+                "queue_timeout_seconds": self.queue_timeout,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "abandoned": self._abandoned,
+            }
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def context_fingerprint(realtime_text: str, chunk_ids, history) -> str:
+    """
+    Fingerprint everything besides the latest prompt that shapes an answer.
+
+    Args:
+        realtime_text: Formatted realtime farm data sent to the LLM
+        chunk_ids: IDs of the retrieved knowledge base chunks
+        history: Conversation turns preceding the latest user message
+
+    Returns:
+        Hex digest identifying the answer context
+    """
+    digest = hashlib.sha1()
+    digest.update(realtime_text.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update("\0".join(chunk_ids).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(json.dumps(history, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class SemanticAnswerCache:
+    """
+    Cache LLM answers by prompt embedding within an exact context fingerprint.
+
+    A lookup hits when a cached prompt with the same context fingerprint has a
+    cosine similarity to the new prompt of at least the threshold. Entries are
+    evicted least-recently-used beyond max_entries and expire after ttl seconds.
+    """
+
+    def __init__(
+        self, threshold: float = 0.95, max_entries: int = 1024, ttl: float = 3600.0
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        # entry id -> entry dict, in LRU order
+        self._entries = OrderedDict()
+        # context fingerprint -> set of entry ids
+        self._by_context = {}
+        self._next_id = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        ids = self._by_context.get(entry["context"])
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids:
+                del self._by_context[entry["context"]]
+
+    def lookup(self, embedding, context: str):
+        """
+        Find a cached answer for a prompt embedding and context fingerprint.
+
+        Returns:
+            Dictionary with "response", "model" and "similarity", or None
+        """
+        query = self._normalize(embedding)
+        now = time.monotonic()
+
+        with self._lock:
+            ids = [
+                entry_id
+                for entry_id in self._by_context.get(context, ())
+                if now - self._entries[entry_id]["created_at"] <= self.ttl
+            ]
+            best_id = None
+            best_similarity = -1.0
+            if ids:
+                matrix = np.stack(
+                    [self._entries[entry_id]["vector"] for entry_id in ids]
+                )
+                similarities = matrix @ query
+                best = int(np.argmax(similarities))
+                best_id, best_similarity = ids[best], float(similarities[best])
+
+            if best_id is None or best_similarity < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(best_id)
+            entry = self._entries[best_id]
+            return {
+                "response": entry["response"],
+                "model": entry["model"],
+                "similarity": best_similarity,
+            }
+
+    def store(self, embedding, context: str, response: str, model: str):
+        """Cache an answer for a prompt embedding and context fingerprint."""
+        now = time.monotonic()
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "vector": self._normalize(embedding),
+                "context": context,
+                "response": response,
+                "model": model,
+                "created_at": now,
+            }
+            self._by_context.setdefault(context, set()).add(entry_id)
+
+            # Drop expired entries first, then least recently used
+            expired = [
+                entry_id
+                for entry_id, entry in self._entries.items()
+                if now - entry["created_at"] > self.ttl
+            ]
+            for expired_id in expired:
+                self._remove(expired_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "evictions": self.evictions,
+                "threshold": self.threshold,
+            }
+
+
+def replay_as_sse(response_text: str, model: str, chunk_size: int = 32):
+    """
+    Yield a cached answer as OpenAI-style chat completion SSE frames.
+
+    The frames match what the streaming /rag-query path relays from the
+    upstream, so the frontend handles a cache hit like a live answer.
+    """
+    for start in range(0, len(response_text), chunk_size):
+        frame = {
+            "object": "chat.completion.chunk",
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": {"content": response_text[start : start + chunk_size]},
+                    "finish_reason": None,
+                }
+            ],
+        }
+        yield f"data: {json.dumps(frame)}\n\n"
@@ -0,0 +1,315 @@
+# Async (ASGI) serving mode with the same routes as server.py. Upstream LLM
+# streams are relayed with an async HTTP client, so an open /rag-query stream
+# costs a coroutine instead of a worker thread. Blocking work (retrieval,
+# Supabase reads, prompt assembly) runs in the threadpool before streaming.
+#
+# Run with: uvicorn asgi_server:app --port 8081
+
+import contextlib
+import json
+import time
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import server
+from admission import AdmissionRejected
+from llm_client import LAVA_FORWARD_URL, chat_completion_request
+from llm_client import create_async_http_client
+from sse_relay import SSERelay
+from metrics import METRICS_CONTENT_TYPE, http_request_seconds, registry
+
+
+async def get_farm_data(request: Request):
+    """Async counterpart of server.get_farm_data."""
+    try:
+        crop_list = server.parse_crop_list(request.query_params.get("crops"))
+        farm_id = request.query_params.get("farm_id")
+        realtime_data = await run_in_threadpool(
+            server.get_realtime_farm_data, crop_list, farm_id
+        )
+        return JSONResponse(realtime_data)
+
+    except Exception as e:
+        print(f"Error in /api/farm-data endpoint: {e}")
+        return JSONResponse(
+            {
+                "error": str(e),
+                "weather": [],
+                "market": [],
+                "environmental": [],
+                "satellite": [],
+            },
+            status_code=500,
+        )
+
+
+async def get_farm_data_cache_stats(request: Request):
+    return JSONResponse(server.farm_data_cache.stats())
+
+
+async def get_answer_cache_stats(request: Request):
+    return JSONResponse(server.answer_cache.stats())
+
+
+async def get_llm_admission_stats(request: Request):
+    return JSONResponse(server.llm_admission.stats())
+
+
+async def get_readiness(request: Request):
+    """Async counterpart of server.get_readiness."""
+    server.readiness.start()
+    status = server.readiness.stats()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+async def get_satellite_data(request: Request):
+    """Async counterpart of server.get_satellite_data."""
+    try:
+        record = await run_in_threadpool(server.fetch_latest_satellite_record)
+        return JSONResponse(record)
+
+    except Exception as e:
+        print(f"Error in /api/satellite-data endpoint: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def get_environmental_data(request: Request):
+    """Async counterpart of server.get_environmental_data."""
+    try:
+        farm_id = request.query_params.get("farm_id", "FARM01")
+        record = await run_in_threadpool(server.fetch_environmental_record, farm_id)
+        return JSONResponse(record)
+
+    except Exception as e:
+        print(f"Error in /api/environmental-data endpoint: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def wait_for_admission(chat, ticket):
+    """Async counterpart of server.wait_for_admission."""
+    deadline = ticket.enqueued_at + server.llm_admission.queue_timeout
+    while not ticket.admitted:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise server.queue_timeout_error()
+        yield server.queued_status_event(ticket)
+        await ticket.wait_async(min(server.LLM_QUEUE_STATUS_INTERVAL, remaining))
+    chat["timings"].record("queue_wait", ticket.wait_seconds())
+
+
+def admission_rejected_response(chat, e: AdmissionRejected):
+    server.observe_chat_request(chat)
+    body, headers = server.admission_rejection(e)
+    return JSONResponse(body, status_code=429, headers=headers)
+
+
+async def stream_answer(http_client, chat, ticket):
+    """Relay the upstream LLM stream chunk by chunk as it arrives."""
+    relay = SSERelay(server.LLM_MODEL, server.SSE_FLUSH_INTERVAL)
+    try:
+        # Send single status with context sources if available
+        if chat["context_items"]:
+            yield server.sources_status_event(chat["context_items"])
+
+        async for event in wait_for_admission(chat, ticket):
+            yield event
+
+        headers, payload = chat_completion_request(chat["llm_messages"], stream=True)
+        llm_started = time.perf_counter()
+        first_token = True
+        async with http_client.stream(
+            "POST", LAVA_FORWARD_URL, headers=headers, json=payload
+        ) as lava_response:
+            async for line in lava_response.aiter_lines():
+                if line:
+                    frame = relay.relay(line)
+                    if frame is not None:
+                        if first_token:
+                            chat["timings"].record(
+                                "llm_ttft", time.perf_counter() - llm_started
+                            )
+                            first_token = False
+                        yield frame
+
+        chat["timings"].record("llm_total", time.perf_counter() - llm_started)
+
+        # Send any content still batched if the upstream ended early
+        frame = relay.flush()
+        if frame is not None:
+            yield frame
+
+        server.store_streamed_answer(chat, relay)
+
+        yield server.timing_event(chat)
+
+        # Send completion marker
+        yield "data: [DONE]\n\n"
+
+    except Exception as e:
+        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    finally:
+        server.llm_admission.leave(ticket)
+        server.observe_chat_request(chat)
+
+
+async def rag_query(request: Request):
+    """Async counterpart of server.rag_query."""
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+
+        try:
+            chat = await run_in_threadpool(server.prepare_chat, data)
+        except server.ChatRequestError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+
+        if chat["cached_answer"] is not None:
+            server.observe_chat_request(chat)
+            if chat["stream"]:
+                return StreamingResponse(
+                    server.replay_cached_answer(chat),
+                    media_type="text/event-stream",
+                    headers=server.server_timing_headers(chat),
+                )
+            return JSONResponse(
+                server.cached_answer_payload(chat),
+                headers=server.server_timing_headers(chat),
+            )
+
+        # Take an upstream slot or join the wait queue; reject fast when full
+        try:
+            ticket = server.llm_admission.enter(
+                server.chat_client_id(
+                    request.headers.get("X-Forwarded-For"),
+                    request.client.host if request.client else None,
+                )
+            )
+        except AdmissionRejected as e:
+            return admission_rejected_response(chat, e)
+
+        http_client = request.app.state.http_client
+        if chat["stream"]:
+            return StreamingResponse(
+                stream_answer(http_client, chat, ticket),
+                media_type="text/event-stream",
+                headers=server.server_timing_headers(chat),
+                # Also frees the slot if the client left before the stream started
+                background=BackgroundTask(server.llm_admission.leave, ticket),
+            )
+
+        # Non-streaming response (legacy)
+        try:
+            if not await ticket.wait_async(server.llm_admission.queue_timeout):
+                raise server.queue_timeout_error()
+            chat["timings"].record("queue_wait", ticket.wait_seconds())
+
+            headers, payload = chat_completion_request(chat["llm_messages"])
+            with chat["timings"].stage("llm_total"):
+                lava_response = await http_client.post(
+                    LAVA_FORWARD_URL, headers=headers, json=payload
+                )
+                lava_data = lava_response.json()
+        except AdmissionRejected as e:
+            return admission_rejected_response(chat, e)
+        finally:
+            server.llm_admission.leave(ticket)
+
+        response_payload = server.completed_answer_payload(chat, lava_data)
+        server.observe_chat_request(chat)
+        return JSONResponse(
+            response_payload, headers=server.server_timing_headers(chat)
+        )
+
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def get_metrics(request: Request):
+    return Response(registry.render(), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+
+# Routes observed by APITimingMiddleware, so unknown paths add no series
+API_ROUTES = {
+    "/api/farm-data",
+    "/api/farm-data/cache-stats",
+    "/api/answer-cache/stats",
+    "/api/llm-admission/stats",
+    "/api/satellite-data",
+    "/api/environmental-data",
+}
+
+
+class APITimingMiddleware:
+    """Observe /api/* request latency (/rag-query is observed by its handler)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in API_ROUTES:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            http_request_seconds.observe(
+                time.perf_counter() - started, route=scope["path"]
+            )
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Load the model and open the clients before the first request
+    server.readiness.start()
+    registry.start_sync()
+    # Shared async client so upstream connections are reused across requests
+    async with create_async_http_client() as http_client:
+        app.state.http_client = http_client
+        yield
+
+
+app = Starlette(
+    routes=[
+        Route("/api/farm-data", get_farm_data, methods=["GET"]),
+        Route("/api/farm-data/cache-stats", get_farm_data_cache_stats, methods=["GET"]),
+        Route("/api/answer-cache/stats", get_answer_cache_stats, methods=["GET"]),
+        Route("/api/llm-admission/stats", get_llm_admission_stats, methods=["GET"]),
+        Route("/api/satellite-data", get_satellite_data, methods=["GET"]),
+        Route("/api/environmental-data", get_environmental_data, methods=["GET"]),
+        Route("/rag-query", rag_query, methods=["POST"]),
+        Route("/metrics", get_metrics, methods=["GET"]),
+        Route("/ready", get_readiness, methods=["GET"]),
+    ],
+    middleware=[
+        Middleware(
+            CORSMiddleware,
+            allow_origins=["*"],
+            allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+            allow_headers=[
+                "Content-Type",
+                "Authorization",
+                "ngrok-skip-browser-warning",
+            ],
+            allow_credentials=False,
+        ),
+        Middleware(APITimingMiddleware),
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, port=8081)
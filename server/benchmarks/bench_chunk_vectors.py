@@ -0,0 +1,146 @@
+# Chunk vectors made by encoding each chunk's text ("encode") against the mean
+# of the chunk's sentence embeddings ("pooled", INGEST_CHUNK_VECTORS=pooled):
+# time to make them once the sentences are embedded, how close the two are,
+# and retrieval quality.
+#
+# Quality is measured without labelled queries: a sentence is taken out of a
+# chunk and used as the query, with the chunk's vector rebuilt without it, and
+# the rank of that chunk among all chunks is recorded. The benchmark also
+# reports how often both modes return the same top chunks for farmer questions.
+#
+# Uses the configured EMBEDDING_BACKEND. Run from the server directory:
+#     python benchmarks/bench_chunk_vectors.py --queries 300
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVER_DIR))
+
+from embedding_backends import create_embedding_function, encode_texts  # noqa: E402
+from populate_vector_db import (  # noqa: E402
+    CHUNKING,
+    pool_sentence_embeddings,
+    semantic_chunk_spans,
+    split_sentences,
+)
+
+QUESTIONS = [
+    "How should I adjust irrigation for corn this week?",
+    "What is the best time to sell my wheat?",
+    "My soil pH is low, what should I apply?",
+    "How do I reduce erosion on a sloped field?",
+    "When should I plant soybeans after this rain?",
+    "What fungicide controls Fusarium head blight?",
+    "How much nitrogen should I sidedress on maize?",
+    "How do I control weeds without herbicides?",
+    "What are the rules for selling at a farmers market?",
+    "How do I get certified organic?",
+]
+
+
+def ranks(query_vectors, chunk_vectors, targets):
+    """1-based rank of each target chunk for its query (cosine)."""
+    scores = query_vectors @ chunk_vectors.T
+    target_scores = scores[np.arange(len(targets)), targets]
+    return 1 + (scores > target_scores[:, None]).sum(axis=1)
+
+
+def report(name, rank):
+    print(
+        f"{name:8s} recall@1 {np.mean(rank <= 1):5.1%}  "
+        f"recall@3 {np.mean(rank <= 3):5.1%}  "
+        f"recall@5 {np.mean(rank <= 5):5.1%}  MRR {np.mean(1 / rank):.3f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pooled chunk vectors")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--top-k", type=int, default=3)
+    args = parser.parse_args()
+
+    embedding = create_embedding_function()
+    chunks, chunk_sentences, sentence_vectors = [], [], []
+    for text_file in sorted((SERVER_DIR / "static_knowledge_base").glob("*.txt")):
+        sentences = split_sentences(text_file.read_text(encoding="utf-8"))
+        if not sentences:
+            continue
+        vectors = encode_texts(embedding, sentences, args.batch_size)
+        for start, end in semantic_chunk_spans(sentences, vectors, **CHUNKING):
+            chunks.append(" ".join(sentences[start:end]))
+            chunk_sentences.append(sentences[start:end])
+            sentence_vectors.append(vectors[start:end])
+    print(f"{len(chunks)} chunks")
+
+    started = time.perf_counter()
+    encoded = encode_texts(embedding, chunks, args.batch_size)
+    encode_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    pooled = np.stack([pool_sentence_embeddings(v) for v in sentence_vectors])
+    pool_seconds = time.perf_counter() - started
+    print(f"encode chunks {encode_seconds:8.2f} s")
+    print(f"pool chunks   {pool_seconds:8.2f} s")
+
+    encoded /= np.linalg.norm(encoded, axis=1, keepdims=True)
+    similarity = np.einsum("ij,ij->i", encoded, pooled)
+    print(
+        f"cosine(encode, pooled) mean {similarity.mean():.3f}  "
+        f"p5 {np.percentile(similarity, 5):.3f}  min {similarity.min():.3f}"
+    )
+
+    # Held-out sentence queries
+    rng = np.random.default_rng(0)
+    eligible = [i for i, s in enumerate(chunk_sentences) if len(s) >= 3]
+    targets = rng.choice(eligible, min(args.queries, len(eligible)), replace=False)
+    held_out = [int(rng.integers(len(chunk_sentences[t]))) for t in targets]
+    queries = np.stack([sentence_vectors[t][h] for t, h in zip(targets, held_out)])
+    remaining = [
+        [s for j, s in enumerate(chunk_sentences[t]) if j != h]
+        for t, h in zip(targets, held_out)
+    ]
+    encoded_without = encode_texts(
+        embedding, [" ".join(s) for s in remaining], args.batch_size
+    )
+    encoded_without /= np.linalg.norm(encoded_without, axis=1, keepdims=True)
+    pooled_without = np.stack(
+        [
+            pool_sentence_embeddings(np.delete(sentence_vectors[t], h, axis=0))
+            for t, h in zip(targets, held_out)
+        ]
+    )
+
+    print(f"\nheld-out sentence as query, {len(targets)} queries:")
+    for name, vectors, without in (
+        ("encode", encoded, encoded_without),
+        ("pooled", pooled, pooled_without),
+    ):
+        rank = np.array(
+            [
+                ranks(
+                    queries[i : i + 1],
+                    np.vstack([vectors[:t], without[i : i + 1], vectors[t + 1 :]]),
+                    np.array([t]),
+                )[0]
+                for i, t in enumerate(targets)
+            ]
+        )
+        report(name, rank)
+
+    questions = encode_texts(embedding, QUESTIONS, args.batch_size)
+    questions /= np.linalg.norm(questions, axis=1, keepdims=True)
+    top_encoded = np.argsort(-(questions @ encoded.T), axis=1)[:, : args.top_k]
+    top_pooled = np.argsort(-(questions @ pooled.T), axis=1)[:, : args.top_k]
+    overlap = np.mean(
+        [len(set(a) & set(b)) / args.top_k for a, b in zip(top_encoded, top_pooled)]
+    )
+    print(f"\nfarmer questions: top-{args.top_k} overlap {overlap:.0%}")
+
+
+if __name__ == "__main__":
+    main()
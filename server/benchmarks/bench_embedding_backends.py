@@ -0,0 +1,138 @@
+# Load time, resident memory and throughput of each embedding backend, plus how
+# closely the ONNX vectors match sentence-transformers. Each backend runs in its
+# own subprocess so load time and RSS are measured from a cold interpreter.
+#
+# Run from the server directory (after python export_onnx_model.py):
+#     python benchmarks/bench_embedding_backends.py --queries 500
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVER_DIR))
+
+BACKENDS = ["sentence-transformers", "onnx", "onnx-int8"]
+
+QUERIES = [
+    "How should I adjust irrigation for corn this week?",
+    "What is the best time to sell my wheat?",
+    "My soil pH is low, what should I apply?",
+    "How do I reduce erosion on a sloped field?",
+    "Is the NDVI trend on my farm a concern?",
+    "When should I plant soybeans after this rain?",
+]
+
+
+def rss_mb():
+    """Resident set size of this process in MB (Linux)."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def measure(backend, n_queries, batch_size):
+    """Measure one backend in this process; prints a JSON result."""
+    import numpy as np
+
+    baseline = rss_mb()
+    started = time.perf_counter()
+    from embedding_backends import create_embedding_function
+
+    embedding = create_embedding_function(backend)
+    embedding(["warm up"])
+    load_seconds = time.perf_counter() - started
+
+    queries = [f"{QUERIES[i % len(QUERIES)]} (field {i})" for i in range(n_queries)]
+    started = time.perf_counter()
+    for query in queries:
+        embedding([query])
+    single_qps = n_queries / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    vectors = []
+    for i in range(0, n_queries, batch_size):
+        vectors.extend(embedding(queries[i : i + batch_size]))
+    batch_qps = n_queries / (time.perf_counter() - started)
+
+    vectors_path = SERVER_DIR / "benchmarks" / f".vectors-{backend}.npy"
+    np.save(vectors_path, np.array(vectors, dtype=np.float32))
+    print(
+        json.dumps(
+            {
+                "load_seconds": load_seconds,
+                "rss_mb": rss_mb(),
+                "rss_delta_mb": rss_mb() - baseline,
+                "single_qps": single_qps,
+                "batch_qps": batch_qps,
+                "vectors": str(vectors_path),
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding backends")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--backends", nargs="+", default=BACKENDS)
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.queries, args.batch_size)
+        return
+
+    import numpy as np
+
+    results = {}
+    for backend in args.backends:
+        output = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--measure",
+                backend,
+                "--queries",
+                str(args.queries),
+                "--batch-size",
+                str(args.batch_size),
+            ],
+            capture_output=True,
+            text=True,
+            cwd=SERVER_DIR,
+        )
+        if output.returncode != 0:
+            print(f"{backend}: failed\n{output.stderr.strip().splitlines()[-1]}")
+            continue
+        results[backend] = json.loads(output.stdout.strip().splitlines()[-1])
+
+    reference = results.get("sentence-transformers")
+    reference_vectors = np.load(reference["vectors"]) if reference else None
+    print(f"{args.queries} queries, batch size {args.batch_size}")
+    print(
+        f"{'backend':22s} {'load s':>7s} {'RSS MB':>7s} {'+RSS MB':>8s} "
+        f"{'1-by-1 q/s':>11s} {'batch q/s':>10s} {'min cos':>8s}"
+    )
+    for backend, result in results.items():
+        vectors = np.load(result["vectors"])
+        Path(result["vectors"]).unlink()
+        similarity = (
+            f"{np.sum(vectors * reference_vectors, axis=1).min():8.4f}"
+            if reference_vectors is not None
+            else f"{'-':>8s}"
+        )
+        print(
+            f"{backend:22s} {result['load_seconds']:7.2f} {result['rss_mb']:7.0f} "
+            f"{result['rss_delta_mb']:8.0f} {result['single_qps']:11.1f} "
+            f"{result['batch_qps']:10.1f} {similarity}"
+        )
+
+
+if __name__ == "__main__":
+    main()
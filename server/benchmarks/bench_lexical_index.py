@@ -0,0 +1,90 @@
+# Build, load and query cost of the BM25 index used for hybrid retrieval, over
+# the static knowledge base split into fixed-size chunks. Fusion is timed
+# against a dense ranking of the same length, as get_rag_context runs it.
+#
+# Run from the server directory:
+#     python benchmarks/bench_lexical_index.py --queries 2000
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVER_DIR))
+
+from lexical_index import BM25Index, reciprocal_rank_fusion  # noqa: E402
+
+QUERIES = [
+    "What fungicide controls Fusarium head blight in wheat?",
+    "Stripe rust resistant wheat varieties",
+    "atrazine rates for corn",
+    "How do I manage Colorado potato beetle?",
+    "late blight Phytophthora infestans symptoms",
+    "Can I sell eggs at the farmers market?",
+    "nitrogen sidedress timing for corn",
+    "organic certification transition period",
+]
+
+
+def chunk_knowledge_base(chunk_chars):
+    ids, texts = [], []
+    for text_file in sorted((SERVER_DIR / "static_knowledge_base").glob("*.txt")):
+        content = text_file.read_text(encoding="utf-8")
+        for i in range(0, len(content), chunk_chars):
+            ids.append(f"doc_{text_file.stem}_chunk_{i // chunk_chars}")
+            texts.append(content[i : i + chunk_chars])
+    return ids, texts
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the BM25 index")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--candidates", type=int, default=20)
+    parser.add_argument("--chunk-chars", type=int, default=1000)
+    args = parser.parse_args()
+
+    ids, texts = chunk_knowledge_base(args.chunk_chars)
+    started = time.perf_counter()
+    index = BM25Index.build(ids, texts)
+    build_seconds = time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as path:
+        index.save(path)
+        size = sum(f.stat().st_size for f in Path(path).iterdir())
+        started = time.perf_counter()
+        index = BM25Index.load(path)
+        load_seconds = time.perf_counter() - started
+
+        search, fusion = [], []
+        for i in range(args.queries):
+            query = QUERIES[i % len(QUERIES)]
+            dense = random.sample(ids, args.candidates)
+            started = time.perf_counter()
+            lexical = [doc_id for doc_id, _ in index.search(query, args.candidates)]
+            searched = time.perf_counter()
+            reciprocal_rank_fusion([dense, lexical])
+            search.append(searched - started)
+            fusion.append(time.perf_counter() - searched)
+
+    print(
+        f"{len(ids)} chunks, {len(index.vocabulary)} terms, "
+        f"{len(index.weights)} postings, {size / 1e6:.1f} MB on disk"
+    )
+    print(f"build {build_seconds:.2f} s, load {load_seconds * 1000:.1f} ms")
+    for name, samples in (("BM25 search", search), ("RRF fusion", fusion)):
+        print(
+            f"{name:12s} p50 {percentile(samples, 0.5) * 1e6:7.0f} us  "
+            f"p99 {percentile(samples, 0.99) * 1e6:7.0f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
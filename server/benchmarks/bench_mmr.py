@@ -0,0 +1,81 @@
+# Cost of the MMR re-ranking stage of get_rag_context: returning the stored
+# embeddings with the Chroma query, and the re-ranking itself, for a collection
+# the size of the knowledge base. Vectors are random; only cost is measured.
+#
+# Run from the server directory:
+#     python benchmarks/bench_mmr.py --queries 1000
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVER_DIR))
+
+from reranking import maximal_marginal_relevance  # noqa: E402
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def report(name, samples):
+    print(
+        f"{name:34s} p50 {percentile(samples, 0.5) * 1e6:7.0f} us  "
+        f"p95 {percentile(samples, 0.95) * 1e6:7.0f} us"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MMR re-ranking")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--chunks", type=int, default=1400)
+    parser.add_argument("--candidates", type=int, default=20)
+    parser.add_argument("--n-results", type=int, default=3)
+    args = parser.parse_args()
+
+    import chromadb
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.chunks, 384)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    collection = chromadb.EphemeralClient().create_collection("bench_mmr")
+    collection.add(
+        ids=[str(i) for i in range(args.chunks)],
+        embeddings=vectors,
+        documents=["chunk text " * 150] * args.chunks,
+    )
+
+    include = ["documents", "distances", "metadatas"]
+    without, with_embeddings = [], []
+    for _ in range(args.queries):
+        query = rng.standard_normal(384).astype(np.float32)
+        for samples, fields in (
+            (without, include),
+            (with_embeddings, include + ["embeddings"]),
+        ):
+            started = time.perf_counter()
+            collection.query(
+                query_embeddings=[query], n_results=args.candidates, include=fields
+            )
+            samples.append(time.perf_counter() - started)
+    report(f"query {args.candidates}", without)
+    report(f"query {args.candidates} + embeddings", with_embeddings)
+
+    for pool in (8, 12, 20, 40):
+        relevance = rng.random(pool)
+        candidates = vectors[:pool]
+        samples = []
+        for _ in range(args.queries):
+            started = time.perf_counter()
+            maximal_marginal_relevance(relevance, candidates, args.n_results)
+            samples.append(time.perf_counter() - started)
+        report(f"MMR {pool} -> {args.n_results}", samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# Near-duplicate chunks in the static knowledge base found by MinHash/LSH,
+# against exact Jaccard similarity over every pair of chunks, and the cost of
+# each. Files are split into fixed-size chunks of whole sentences, so no
+# embedding model is needed. --inject adds lightly edited copies of random
+# chunks, to check that near-duplicates are found when there are some; every
+# other copy is placed in a different shard, where it must be kept, since
+# chunks are only compared within their shard as at ingest.
+#
+# Run from the server directory:
+#     python benchmarks/bench_near_duplicates.py --threshold 0.8
+
+import argparse
+import random
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVER_DIR))
+
+from kb_router import SHARD_KEYWORDS, shard_for_source  # noqa: E402
+from near_duplicates import NearDuplicateIndex, minhash, shingles  # noqa: E402
+from populate_vector_db import split_sentences  # noqa: E402
+
+
+def fixed_chunks(sentences, chunk_chars):
+    chunks, current = [], []
+    for sentence in sentences:
+        current.append(sentence)
+        if sum(len(s) + 1 for s in current) >= chunk_chars:
+            chunks.append(" ".join(current))
+            current = []
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def edited_copy(text, rng, fraction):
+    """The text with a fraction of its words replaced."""
+    words = text.split()
+    for i in rng.sample(range(len(words)), max(1, int(fraction * len(words)))):
+        words[i] = "edited"
+    return " ".join(words)
+
+
+def ratio(hits, total):
+    return f"{hits / total:.1%}" if total else "n/a"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark near-duplicate detection")
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--chunk-chars", type=int, default=800)
+    parser.add_argument("--inject", type=int, default=0)
+    parser.add_argument("--edit-fraction", type=float, default=0.02)
+    args = parser.parse_args()
+
+    chunks, sources, shards = [], [], []
+    for text_file in sorted((SERVER_DIR / "static_knowledge_base").glob("*.txt")):
+        sentences = split_sentences(text_file.read_text(encoding="utf-8"))
+        for chunk in fixed_chunks(sentences, args.chunk_chars):
+            chunks.append(chunk)
+            sources.append(text_file.name)
+            shards.append(shard_for_source(text_file.name))
+    rng = random.Random(0)
+    cross_shard = set()
+    for n, i in enumerate(rng.sample(range(len(chunks)), args.inject)):
+        shard = shards[i]
+        if n % 2:
+            shard = next(s for s in SHARD_KEYWORDS if s != shards[i])
+            cross_shard.add(len(chunks))
+        chunks.append(edited_copy(chunks[i], rng, args.edit_fraction))
+        sources.append(f"copy of {sources[i]} in {shard}")
+        shards.append(shard)
+    print(
+        f"{len(chunks)} chunks of about {args.chunk_chars} characters, "
+        f"{args.inject} of them edited copies, {len(cross_shard)} in another shard"
+    )
+
+    started = time.perf_counter()
+    index = NearDuplicateIndex(args.threshold)
+    found = {}
+    for i, chunk in enumerate(chunks):
+        signature = minhash(chunk)
+        match = index.query(signature, shards[i])
+        if match is None:
+            index.add(str(i), signature, shards[i])
+        else:
+            found[i] = int(match[0])
+    lsh_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    sets = [set(shingles(chunk).tolist()) for chunk in chunks]
+    exact = set()
+    for i in range(len(chunks)):
+        for j in range(i):
+            if shards[j] != shards[i]:
+                continue
+            union = len(sets[i] | sets[j])
+            if union and len(sets[i] & sets[j]) / union >= args.threshold:
+                exact.add(i)
+                break
+    exact_seconds = time.perf_counter() - started
+
+    dropped = set(found)
+    hits = len(dropped & exact)
+    print(f"MinHash/LSH  {lsh_seconds:7.2f} s  {len(dropped)} near-duplicates")
+    print(f"exact pairs  {exact_seconds:7.2f} s  {len(exact)} near-duplicates")
+    print(f"precision {ratio(hits, len(dropped))}  recall {ratio(hits, len(exact))}")
+    if cross_shard:
+        kept = len(cross_shard - dropped)
+        print(f"copies in another shard kept {kept}/{len(cross_shard)}")
+    chars = sum(len(chunks[i]) for i in dropped)
+    print(
+        f"index reduced by {len(dropped) / len(chunks):.1%} of chunks, "
+        f"{chars / sum(map(len, chunks)):.1%} of text"
+    )
+
+    pairs = Counter((sources[i], sources[j]) for i, j in found.items())
+    for (source, original), count in pairs.most_common(10):
+        print(f"  {count:4d}  {source} ~ {original}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# Throughput of query embedding under concurrent requests: one encode call per
+# query (the previous behaviour) versus QueryEmbedder's micro-batching, with the
+# LRU cache disabled so every query reaches the model.
+#
+# Run from the server directory:
+#     python benchmarks/bench_query_embedder.py --threads 16 --queries 2000
+
+import argparse
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from chromadb.utils import embedding_functions  # noqa: E402
+
+from query_embedder import QueryEmbedder  # noqa: E402
+
+QUERIES = [
+    "How should I adjust irrigation for corn this week?",
+    "What is the best time to sell my wheat?",
+    "My soil pH is low, what should I apply?",
+    "How do I reduce erosion on a sloped field?",
+    "Is the NDVI trend on my farm a concern?",
+    "When should I plant soybeans after this rain?",
+]
+
+
+def run(embed, n_threads, n_queries):
+    """Embed n_queries unique queries from n_threads threads; returns queries/sec."""
+    counter = iter(range(n_queries))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            embed(f"{QUERIES[i % len(QUERIES)]} (field {i})")
+
+    threads = [threading.Thread(target=worker) for _ in range(n_threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return n_queries / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark query embedding")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--window-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    embedding = embedding_functions.SentenceTransformerEmbeddingFunction(
+        model_name="all-MiniLM-L6-v2"
+    )
+    embedding(["warm up"])
+
+    sizes = []
+    embedder = QueryEmbedder(
+        embedding,
+        batch_window=args.window_ms / 1000,
+        cache_size=0,
+        on_batch=sizes.append,
+    )
+
+    single = run(lambda q: embedding([q])[0], args.threads, args.queries)
+    batched = run(embedder.embed, args.threads, args.queries)
+    print(f"{args.threads} threads, {args.queries} unique queries")
+    print(f"one encode per query   {single:8.1f} queries/s")
+    print(
+        f"micro-batched          {batched:8.1f} queries/s  "
+        f"(mean batch {sum(sizes) / len(sizes):.1f})"
+    )
+    print(f"speedup: {batched / single:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# Cost of finding chunk boundaries in semantic_chunking: the former loop of
+# sklearn cosine_similarity calls, one per pair of consecutive sentences,
+# against the vectorized boundary_similarities, over the sentences of a
+# knowledge base file. Vectors are random; only cost is measured.
+#
+# Run from the server directory:
+#     python benchmarks/bench_semantic_chunking.py --file corn_production_manual.txt
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVER_DIR))
+
+from populate_vector_db import (  # noqa: E402
+    boundary_similarities,
+    semantic_chunking,
+    split_sentences,
+)
+
+
+def pairwise_loop(embeddings):
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    return [
+        cosine_similarity([embeddings[i]], [embeddings[i + 1]])[0][0]
+        for i in range(len(embeddings) - 1)
+    ]
+
+
+def best_of(repeat, fn):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return min(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chunk boundary detection")
+    parser.add_argument("--file", default="corn_production_manual.txt")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    text = (SERVER_DIR / "static_knowledge_base" / args.file).read_text(
+        encoding="utf-8"
+    )
+    sentences = split_sentences(text)
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((len(sentences), 384)).astype(np.float32)
+    print(f"{args.file}: {len(sentences)} sentences")
+
+    loop = None
+    try:
+        loop = best_of(args.repeat, lambda: pairwise_loop(embeddings))
+        print(f"{'sklearn loop':24s} {loop * 1e3:8.1f} ms")
+        assert np.allclose(
+            pairwise_loop(embeddings), boundary_similarities(embeddings), atol=1e-5
+        )
+    except ImportError:
+        print("sklearn loop             skipped, scikit-learn is not installed")
+
+    for window in (1, 3, 5):
+        seconds = best_of(
+            args.repeat, lambda: boundary_similarities(embeddings, window)
+        )
+        speedup = f"  {loop / seconds:6.0f}x" if loop else ""
+        print(
+            f"{'vectorized, window ' + str(window):24s} {seconds * 1e3:8.1f} ms{speedup}"
+        )
+
+    seconds = best_of(args.repeat, lambda: semantic_chunking(sentences, embeddings))
+    print(f"{'semantic_chunking':24s} {seconds * 1e3:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
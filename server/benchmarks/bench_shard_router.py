@@ -0,0 +1,107 @@
+# Overhead of routing queries to knowledge base shards, and the vectors and
+# Chroma query time it saves. Shards are sized from the static knowledge base
+# split into fixed-size chunks; vectors are random, since only the search
+# cost is measured.
+#
+# Run from the server directory:
+#     python benchmarks/bench_shard_router.py --queries 2000
+
+import argparse
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVER_DIR))
+
+from kb_router import route, shard_for_source  # noqa: E402
+
+QUERIES = [
+    ("What fungicide controls Fusarium head blight?", None),
+    ("When should I sell my wheat?", ["Wheat"]),
+    ("How much nitrogen should I sidedress?", ["Maize"]),
+    ("How do I control weeds without herbicides?", ["Maize", "Soybean"]),
+    ("What are the rules for organic certification?", None),
+    ("Is my soil too acidic?", None),
+    ("How do I store potatoes after harvest?", ["Maize"]),
+]
+
+
+def shard_sizes(chunk_chars):
+    sizes = Counter()
+    for text_file in (SERVER_DIR / "static_knowledge_base").glob("*.txt"):
+        length = len(text_file.read_text(encoding="utf-8"))
+        sizes[shard_for_source(text_file.name)] += -(-length // chunk_chars)
+    return sizes
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark shard routing")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--chunk-chars", type=int, default=1000)
+    parser.add_argument("--candidates", type=int, default=20)
+    args = parser.parse_args()
+
+    import chromadb
+
+    sizes = shard_sizes(args.chunk_chars)
+    total = sum(sizes.values())
+    rng = np.random.default_rng(0)
+    client = chromadb.EphemeralClient()
+    collections = {}
+    for name, size in [("all", total), *sizes.items()]:
+        vectors = rng.standard_normal((size, 384)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        collection = client.create_collection(f"bench_{name}")
+        collection.add(ids=[str(i) for i in range(size)], embeddings=vectors)
+        collections[name] = collection
+
+    print(f"{total} chunks: " + ", ".join(f"{s} {n}" for s, n in sizes.items()))
+    route_times, full_times, routed_times = [], [], []
+    for i in range(args.queries):
+        query, crops = QUERIES[i % len(QUERIES)]
+        vector = rng.standard_normal(384).astype(np.float32)
+        started = time.perf_counter()
+        routed = route(query, crops, sizes)
+        route_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        collections["all"].query(query_embeddings=[vector], n_results=args.candidates)
+        full_times.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        for shard in routed or ["all"]:
+            collections[shard].query(
+                query_embeddings=[vector], n_results=args.candidates
+            )
+        routed_times.append(time.perf_counter() - started)
+
+    print("\nrouting:")
+    for query, crops in QUERIES:
+        routed = route(query, crops, sizes)
+        searched = sum(sizes[s] for s in routed) if routed else total
+        print(
+            f"  {query[:45]:45s} {str(crops):22s} -> "
+            f"{','.join(routed) if routed else 'all':22s} {searched / total:5.0%}"
+        )
+    print()
+    for name, samples in (
+        ("router", route_times),
+        ("query, whole KB", full_times),
+        ("query, routed", routed_times),
+    ):
+        print(
+            f"{name:16s} p50 {percentile(samples, 0.5) * 1e6:7.0f} us  "
+            f"p99 {percentile(samples, 0.99) * 1e6:7.0f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# Microbenchmark for the /rag-query SSE relay: per-token CPU cost of the
+# legacy json.loads/json.dumps relay versus SSERelay, with and without batching.
+#
+# Run from the server directory:
+#     python benchmarks/bench_sse_relay.py --tokens 20000
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sse_relay import SSERelay  # noqa: E402
+
+
+def make_upstream_lines(n_tokens: int, bold_every: int = 50):
+    """Build OpenAI-style chat completion chunk lines for n_tokens tokens."""
+    lines = []
+    base = {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion.chunk",
+        "created": 1700000000,
+        "model": "gpt-4o-2024-08-06",
+        "system_fingerprint": "fp_bench",
+    }
+    first = dict(
+        base,
+        choices=[
+            {
+                "index": 0,
+                "delta": {"role": "assistant", "content": ""},
+                "logprobs": None,
+                "finish_reason": None,
+            }
+        ],
+    )
+    lines.append("data: " + json.dumps(first, separators=(",", ":")))
+    for i in range(n_tokens):
+        token = "**lime**" if bold_every and i % bold_every == 0 else " soil"
+        chunk = dict(
+            base,
+            choices=[
+                {
+                    "index": 0,
+                    "delta": {"content": token},
+                    "logprobs": None,
+                    "finish_reason": None,
+                }
+            ],
+        )
+        lines.append("data: " + json.dumps(chunk, separators=(",", ":")))
+    last = dict(
+        base,
+        choices=[{"index": 0, "delta": {}, "logprobs": None, "finish_reason": "stop"}],
+    )
+    lines.append("data: " + json.dumps(last, separators=(",", ":")))
+    lines.append("data: [DONE]")
+    return lines
+
+
+def legacy_relay(lines):
+    """The relay loop rag_query used before SSERelay, kept for comparison."""
+    for decoded_line in lines:
+        if decoded_line.startswith("data: "):
+            data_content = decoded_line[6:]
+            if data_content != "[DONE]":
+                try:
+                    parsed = json.loads(data_content)
+                    if "choices" in parsed and len(parsed["choices"]) > 0:
+                        if (
+                            "delta" in parsed["choices"][0]
+                            and "content" in parsed["choices"][0]["delta"]
+                        ):
+                            content = parsed["choices"][0]["delta"]["content"]
+                            content = content.replace("**", "")
+                            parsed["choices"][0]["delta"]["content"] = content
+                            data_content = json.dumps(parsed)
+                except Exception:
+                    pass
+            yield f"data: {data_content}\n\n"
+
+
+def sse_relay(lines, flush_interval):
+    relay = SSERelay("gpt-4o", flush_interval)
+    for line in lines:
+        frame = relay.relay(line)
+        if frame is not None:
+            yield frame
+    frame = relay.flush()
+    if frame is not None:
+        yield frame
+
+
+def measure(name, run, lines, repeats):
+    best_cpu = float("inf")
+    frames = 0
+    for _ in range(repeats):
+        start = time.process_time()
+        frames = sum(1 for _ in run(lines))
+        best_cpu = min(best_cpu, time.process_time() - start)
+    per_token_us = best_cpu / len(lines) * 1e6
+    print(f"{name:<28} {per_token_us:8.2f} us/token  {frames:7d} frames")
+    return per_token_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the SSE relay")
+    parser.add_argument("--tokens", type=int, default=20000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    lines = make_upstream_lines(args.tokens)
+
+    # Same client-visible text from both relays
+    legacy_text = []
+    for frame in legacy_relay(lines):
+        payload = frame[6:].strip()
+        if payload != "[DONE]":
+            delta = json.loads(payload)["choices"][0]["delta"]
+            legacy_text.append(delta.get("content", ""))
+    relay = SSERelay("gpt-4o")
+    for line in lines:
+        relay.relay(line)
+    assert relay.text == "".join(legacy_text)
+
+    print(f"{len(lines)} upstream lines, best of {args.repeats}")
+    baseline = measure("legacy json round trip", legacy_relay, lines, args.repeats)
+    fast = measure("SSERelay", lambda l: sse_relay(l, 0.0), lines, args.repeats)
+    # Every token arrives at once here, so a tiny interval already batches
+    batched = measure(
+        "SSERelay (flush 50ms)", lambda l: sse_relay(l, 0.05), lines, args.repeats
+    )
+    print(
+        f"speedup: {baseline / fast:.1f}x per token, {baseline / batched:.1f}x batched"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# Cold-start time and per-worker memory of the pre-forked server, with the
+# embedding model preloaded in the gunicorn master and without. Summed PSS is
+# the real memory footprint of the workers; RSS counts shared pages in every
+# worker.
+#
+# Run from the server directory (Supabase settings come from the root .env):
+#     python benchmarks/bench_startup.py --workers 4
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVER_DIR))
+
+from startup import memory_usage  # noqa: E402
+
+
+def child_pids(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(p) for p in f.read().split()]
+
+
+def poll_ready(url):
+    """Readiness of whichever worker served the request, or None."""
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        return json.load(e)
+    except OSError:
+        return None
+
+
+def run(preload, workers, port, timeout):
+    env = {
+        **os.environ,
+        "PRELOAD_MODEL": "1" if preload else "0",
+        "GUNICORN_WORKERS": str(workers),
+        "GUNICORN_BIND": f"127.0.0.1:{port}",
+    }
+    started = time.perf_counter()
+    master = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "server:app"],
+        cwd=SERVER_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}/ready"
+    first_ready = None
+    ready = {}
+    try:
+        # Requests land on arbitrary workers, so poll until each has answered ready
+        while len(ready) < workers and time.perf_counter() - started < timeout:
+            status = poll_ready(url)
+            if status is not None and status["ready"]:
+                if first_ready is None:
+                    first_ready = time.perf_counter() - started
+                ready[status["pid"]] = status
+            else:
+                time.sleep(0.05)
+        all_ready = time.perf_counter() - started if len(ready) == workers else None
+
+        memory = {pid: memory_usage(pid) for pid in child_pids(master.pid)}
+        master_memory = memory_usage(master.pid)
+    finally:
+        master.terminate()
+        master.wait()
+
+    label = "preloaded" if preload else "per worker"
+    print(f"\nmodel {label}, {workers} workers")
+    if first_ready is None:
+        print(f"  no worker ready within {timeout:.0f}s")
+        return
+    print(f"  first worker ready   {first_ready:6.2f} s after launch")
+    if all_ready is not None:
+        print(f"  all workers ready    {all_ready:6.2f} s after launch")
+    print(f"  master               RSS {master_memory['rss'] / 1e6:6.0f} MB")
+    for pid, usage in memory.items():
+        cold_start = ready.get(pid, {}).get("cold_start_seconds")
+        print(
+            f"  worker {pid:<8d}      RSS {usage['rss'] / 1e6:6.0f} MB  "
+            f"PSS {usage['pss'] / 1e6:6.0f} MB  "
+            f"private {usage['private'] / 1e6:6.0f} MB  "
+            f"cold start {f'{cold_start:.2f} s' if cold_start else '-'}"
+        )
+    total_pss = sum(u["pss"] for u in memory.values()) + master_memory["pss"]
+    print(f"  total PSS            {total_pss / 1e6:6.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark server cold start")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8091)
+    parser.add_argument("--timeout", type=float, default=180)
+    args = parser.parse_args()
+
+    for preload in (True, False):
+        run(preload, args.workers, args.port, args.timeout)
+
+
+if __name__ == "__main__":
+    main()
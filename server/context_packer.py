@@ -0,0 +1,204 @@
+import logging
+import math
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Encoding used by gpt-4o; counts are close enough for other OpenAI models
+TOKENIZER_ENCODING = "o200k_base"
+
+# Fixed per-message cost of the chat format (role and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Rough cost of one image part (a high-detail 512x512 tile plus the base cost)
+IMAGE_PART_TOKENS = 255
+
+# Characters per token assumed when no tokenizer is available
+FALLBACK_CHARS_PER_TOKEN = 4
+
+
+def _load_encoding(name):
+    """The tiktoken encoding, or None and the reason it could not be loaded."""
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(name), None
+    except Exception as e:
+        # Not installed, or the BPE file could not be downloaded
+        logger.warning(f"tiktoken unavailable ({e}), estimating tokens from length")
+        return None, str(e)
+
+
+class TokenCounter:
+    """
+    Count prompt tokens with tiktoken, or estimate them from text length.
+
+    Counts are memoized per text, so the system prompt template, realtime
+    sections and earlier conversation turns are only tokenized once. Loading
+    the encoding may download its BPE file, so the server creates the counter
+    during warm-up rather than at import.
+    """
+
+    def __init__(self, encoding_name: str = TOKENIZER_ENCODING, cache_size=8192):
+        self.encoding_name = encoding_name
+        self.encoding, self.error = _load_encoding(encoding_name)
+        self.count = lru_cache(maxsize=cache_size)(self._count)
+
+    def stats(self):
+        """Whether tokens are counted by the encoding or estimated from length."""
+        return {
+            "encoding": self.encoding_name,
+            "fallback": self.encoding is None,
+            "error": self.error,
+        }
+
+    def _count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / FALLBACK_CHARS_PER_TOKEN)
+
+    def count_content(self, content) -> int:
+        """Tokens in a message's content, either a string or multimodal parts."""
+        if isinstance(content, str):
+            return self.count(content)
+        if isinstance(content, list):
+            tokens = 0
+            for part in content:
+                if part.get("type") == "text":
+                    tokens += self.count(part.get("text", ""))
+                elif part.get("type") == "image_url":
+                    tokens += IMAGE_PART_TOKENS
+            return tokens
+        return self.count(str(content))
+
+    def count_message(self, message) -> int:
+        return MESSAGE_OVERHEAD_TOKENS + self.count_content(message["content"])
+
+
+class ContextPacker:
+    """
+    Fit conversation history, realtime data and RAG chunks into a token budget.
+
+    The system prompt template, the conversation summary (if any) and the
+    latest user turn are always sent. The rest of the budget is filled in priority order:
+
+    1. Realtime sections in their prompt order, up to realtime_max_tokens. A
+       section that does not fit whole is cut at a line boundary.
+    2. Retrieved chunks in rank order, up to rag_max_tokens. The list is cut
+       at the first chunk that does not fit, so lower-ranked chunks go first.
+    3. Earlier conversation turns, newest first, with whatever budget is left.
+       The oldest turns are dropped once a turn no longer fits.
+    """
+
+    def __init__(
+        self,
+        counter: TokenCounter,
+        budget: int = 6000,
+        realtime_max_tokens: int = 1500,
+        rag_max_tokens: int = 1500,
+    ):
+        self.counter = counter
+        self.budget = budget
+        self.realtime_max_tokens = realtime_max_tokens
+        self.rag_max_tokens = rag_max_tokens
+
+    def _fit_lines(self, text: str, max_tokens: int):
+        """Leading lines of text that fit in max_tokens, and their token count."""
+        kept = []
+        used = 0
+        for line in text.splitlines(keepends=True):
+            tokens = self.counter.count(line)
+            if used + tokens > max_tokens:
+                break
+            kept.append(line)
+            used += tokens
+        return "".join(kept), used
+
+    def pack(
+        self, template_text, realtime_sections, context_items, messages, summary=None
+    ):
+        """
+        Choose which parts of the prompt to send.
+
+        Args:
+            template_text: System prompt rendered with empty data fields
+            realtime_sections: Dictionary of formatted text per realtime section,
+                in prompt order
+            context_items: Retrieved chunks ordered by rank (best first)
+            messages: Conversation history without system messages; the last
+                message is the latest user turn
+            summary: Optional system message summarizing older turns
+
+        Returns:
+            Dictionary with the kept realtime_sections, context_items and
+            messages, the tokens used per part and counts of what was dropped
+        """
+        count = self.counter.count
+        tokens = {
+            "system": MESSAGE_OVERHEAD_TOKENS + count(template_text),
+            "summary": self.counter.count_message(summary) if summary else 0,
+            "latest_turn": self.counter.count_message(messages[-1]) if messages else 0,
+        }
+        remaining = self.budget - sum(tokens.values())
+
+        # Realtime sections, cut at a line boundary once the cap is reached
+        realtime_budget = max(0, min(self.realtime_max_tokens, remaining))
+        kept_sections = {}
+        truncated_sections = []
+        used = 0
+        for section, text in realtime_sections.items():
+            section_tokens = count(text)
+            if used + section_tokens <= realtime_budget:
+                kept_sections[section] = text
+                used += section_tokens
+                continue
+            text, section_tokens = self._fit_lines(text, realtime_budget - used)
+            truncated_sections.append(section)
+            if text:
+                kept_sections[section] = text
+                used += section_tokens
+        tokens["realtime"] = used
+        remaining -= used
+
+        # Retrieved chunks in rank order, stopping at the first that does not fit
+        rag_budget = max(0, min(self.rag_max_tokens, remaining))
+        kept_items = []
+        used = 0
+        for item in context_items:
+            item_tokens = count(
+                f"[Source: {item['metadata']['source']}]\n{item['text']}\n\n"
+            )
+            if used + item_tokens > rag_budget:
+                break
+            kept_items.append(item)
+            used += item_tokens
+        tokens["rag"] = used
+        remaining -= used
+
+        # Earlier turns, newest first, until the budget is spent
+        history = messages[:-1]
+        kept_history = []
+        used = 0
+        for message in reversed(history):
+            message_tokens = self.counter.count_message(message)
+            if used + message_tokens > remaining:
+                break
+            kept_history.append(message)
+            used += message_tokens
+        kept_history.reverse()
+        tokens["history"] = used
+        tokens["total"] = sum(tokens.values())
+
+        return {
+            "realtime_sections": kept_sections,
+            "context_items": kept_items,
+            "messages": kept_history + messages[-1:],
+            "tokens": tokens,
+            "dropped": {
+                "context_items": len(context_items) - len(kept_items),
+                "messages": len(history) - len(kept_history),
+                "truncated_sections": truncated_sections,
+            },
+        }
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a farmer and "
+    "Demeter, an agricultural assistant. Fold the new messages into the previous "
+    "summary. Keep the farmer's location, crops, field conditions, numbers, "
+    "decisions made, advice already given and open questions. Drop greetings "
+    "and repetition. Reply with the updated summary only, in at most 200 words."
+)
+
+# Prefix of the system message that carries the summary to the LLM
+SUMMARY_MESSAGE_PREFIX = "Summary of the earlier conversation:\n"
+
+
+def message_text(message) -> str:
+    """Plain text of a message, with image parts replaced by a marker."""
+    content = message["content"]
+    if isinstance(content, list):
+        parts = []
+        for item in content:
+            if item.get("type") == "text":
+                parts.append(item.get("text", ""))
+            elif item.get("type") == "image_url":
+                parts.append("[image]")
+        return " ".join(parts)
+    return str(content)
+
+
+def summary_message(summary: str):
+    """System message carrying a conversation summary to the LLM."""
+    return {"role": "system", "content": SUMMARY_MESSAGE_PREFIX + summary}
+
+
+def prefix_hashes(messages):
+    """
+    Chained hashes of every message prefix.
+
+    Returns:
+        List where element i identifies messages[: i + 1]
+    """
+    hashes = []
+    previous = b""
+    for message in messages:
+        digest = hashlib.sha1(previous)
+        digest.update(
+            json.dumps(
+                {"role": message["role"], "content": message["content"]},
+                sort_keys=True,
+                default=str,
+            ).encode("utf-8")
+        )
+        previous = digest.hexdigest().encode("ascii")
+        hashes.append(previous.decode("ascii"))
+    return hashes
+
+
+def summary_request_messages(previous_summary, messages):
+    """LLM messages asking to fold messages into previous_summary."""
+    transcript = "\n".join(
+        f"{message['role']}: {message_text(message)}" for message in messages
+    )
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {
+            "role": "user",
+            "content": (
+                f"Previous summary:\n{previous_summary or '(none)'}\n\n"
+                f"New messages:\n{transcript}"
+            ),
+        },
+    ]
+
+
+class ConversationSummarizer:
+    """
+    Fold older chat turns into a rolling summary cached by message prefix.
+
+    Once a history is longer than trigger_messages, everything before the last
+    keep_recent messages (rounded down to a multiple of fold_step) is replaced
+    by a summary. Summaries are cached under the hash of the prefix they cover,
+    and each one is built from the newest earlier summary plus the messages
+    after it, so older turns are not summarized again.
+
+    Summaries are built in the background. A request uses the newest cached
+    summary for its prefix and sends the messages after it verbatim, so the
+    turn that crosses a fold point never waits for the summarization call.
+    """
+
+    def __init__(
+        self,
+        complete,
+        executor,
+        trigger_messages: int = 12,
+        keep_recent: int = 6,
+        fold_step: int = 6,
+        max_entries: int = 1024,
+    ):
+        """
+        Args:
+            complete: Callable sending LLM messages and returning the reply text
+            executor: Executor the summarization calls run on
+        """
+        self.complete = complete
+        self.executor = executor
+        self.trigger_messages = max(trigger_messages, keep_recent + fold_step)
+        self.keep_recent = keep_recent
+        self.fold_step = fold_step
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        # prefix hash -> summary text, in LRU order
+        self._summaries = OrderedDict()
+        self._pending = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.built = 0
+        self.failures = 0
+
+    def fold_point(self, n_messages: int) -> int:
+        """Number of leading messages that should be covered by the summary."""
+        if n_messages <= self.trigger_messages:
+            return 0
+        folded = n_messages - self.keep_recent
+        return folded - folded % self.fold_step
+
+    def _get(self, key):
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is not None:
+                self._summaries.move_to_end(key)
+            return summary
+
+    def _store(self, key, summary):
+        with self._lock:
+            self._summaries[key] = summary
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > self.max_entries:
+                self._summaries.popitem(last=False)
+
+    def _build(self, key, previous_summary, messages):
+        try:
+            summary = self.complete(
+                summary_request_messages(previous_summary, messages)
+            ).strip()
+            if summary:
+                self._store(key, summary)
+                with self._lock:
+                    self.built += 1
+        except Exception as e:
+            logger.warning(f"Conversation summary failed: {e}")
+            with self._lock:
+                self.failures += 1
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def _schedule(self, key, previous_summary, messages):
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self.executor.submit(self._build, key, previous_summary, list(messages))
+
+    def compress(self, history):
+        """
+        Replace the older part of a history with its cached summary.
+
+        Args:
+            history: Conversation turns before the latest user message, without
+                system messages
+
+        Returns:
+            Tuple of (summary text or None, messages to send verbatim)
+        """
+        fold = self.fold_point(len(history))
+        if not fold:
+            return None, history
+
+        hashes = prefix_hashes(history[:fold])
+
+        # Newest cached summary at a fold point at or before this one
+        summary = None
+        covered = fold
+        while covered > 0:
+            summary = self._get(hashes[covered - 1])
+            if summary is not None:
+                break
+            covered -= self.fold_step
+
+        with self._lock:
+            if covered == fold:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        # Fold the uncovered messages into the newest summary for later turns
+        if covered < fold:
+            self._schedule(hashes[fold - 1], summary, history[covered:fold])
+
+        if summary is None:
+            return None, history
+        return summary, history[covered:]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "built": self.built,
+                "failures": self.failures,
+                "pending": len(self._pending),
+                "entries": len(self._summaries),
+                "max_entries": self.max_entries,
+            }
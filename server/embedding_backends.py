@@ -0,0 +1,228 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+# Model the static_knowledge_base collection was embedded with
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# "sentence-transformers" (PyTorch), "onnx" (fp32) or "onnx-int8"
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence-transformers")
+
+# Directory holding tokenizer.json, model.onnx and model_int8.onnx, as written
+# by export_onnx_model.py
+ONNX_MODEL_DIR = Path(
+    os.getenv(
+        "ONNX_MODEL_DIR", Path(__file__).parent / "models" / f"{EMBEDDING_MODEL}-onnx"
+    )
+)
+
+# Minimum cosine similarity between an ONNX vector and the SentenceTransformer
+# vector for the same text; export_onnx_model.py refuses models below it
+ONNX_MIN_COSINE_SIMILARITY = 0.98
+
+# sentence-transformers truncates all-MiniLM-L6-v2 inputs at 256 word pieces
+MAX_SEQ_LENGTH = 256
+
+
+class OnnxMiniLMEmbedding:
+    """
+    all-MiniLM-L6-v2 on onnxruntime, without importing PyTorch.
+
+    Mirrors the SentenceTransformer pipeline: word-piece tokenization truncated
+    at 256 tokens, mean pooling over the attention mask and L2 normalization,
+    so vectors can be compared with the ones already in the collection. Inputs
+    are padded per batch to their longest member rather than to 256.
+    """
+
+    def __init__(
+        self,
+        model_dir=ONNX_MODEL_DIR,
+        quantized: bool = True,
+        batch_size: int = 32,
+        num_threads: int = 0,
+    ):
+        from tokenizers import Tokenizer
+
+        model_dir = Path(model_dir)
+        model_path = model_dir / ("model_int8.onnx" if quantized else "model.onnx")
+        if not model_path.exists():
+            raise FileNotFoundError(
+                f"{model_path} not found, run export_onnx_model.py to create it"
+            )
+
+        self.model_dir = model_dir
+        self.quantized = quantized
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+
+        self._model_bytes = model_path.read_bytes()
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+
+    def _get_session(self):
+        # onnxruntime's thread pool does not survive fork, so a worker forked
+        # from a preloading master builds its own session from the model bytes
+        pid = os.getpid()
+        if self._session_pid == pid:
+            return self._session
+        with self._lock:
+            if self._session_pid != pid:
+                import onnxruntime
+
+                options = onnxruntime.SessionOptions()
+                options.log_severity_level = 3
+                options.graph_optimization_level = (
+                    onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+                )
+                # 0 lets onnxruntime use one thread per physical core
+                options.intra_op_num_threads = self.num_threads
+                self._session = onnxruntime.InferenceSession(
+                    self._model_bytes, options, providers=["CPUExecutionProvider"]
+                )
+                self._input_names = {i.name for i in self._session.get_inputs()}
+                self._session_pid = pid
+        return self._session
+
+    def encode(self, texts, batch_size: int = None) -> np.ndarray:
+        """Embed texts into an (n, 384) float32 array of unit vectors."""
+        batch_size = batch_size or self.batch_size
+        session = self._get_session()
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer.encode_batch(
+                list(texts[start : start + batch_size])
+            )
+            input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+            attention_mask = np.array(
+                [e.attention_mask for e in encoded], dtype=np.int64
+            )
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self._input_names:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+            hidden = session.run(None, feeds)[0]
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            batches.append((pooled / np.clip(norms, 1e-12, None)).astype(np.float32))
+
+        if not batches:
+            return np.zeros((0, 384), dtype=np.float32)
+        return np.concatenate(batches)
+
+    def __call__(self, input):
+        """Chroma embedding function interface: one vector per document."""
+        return list(self.encode(input))
+
+
+class OnnxEncodePool:
+    """
+    Several onnxruntime sessions embedding the batches of one call at once.
+
+    A single session spreads each forward pass over the cores, but a MiniLM
+    batch is too small to keep many of them busy, and tokenization and
+    pooling run on one thread in between. For bulk encoding, each of workers
+    threads instead runs its own session on an equal share of the cores, a
+    whole batch at a time. Vectors are the same as a single session's.
+    """
+
+    def __init__(self, embedding: OnnxMiniLMEmbedding, workers: int):
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        self.batch_size = embedding.batch_size
+        self._sessions = queue.Queue()
+        for _ in range(workers):
+            self._sessions.put(
+                OnnxMiniLMEmbedding(
+                    embedding.model_dir,
+                    embedding.quantized,
+                    embedding.batch_size,
+                    num_threads=threads,
+                )
+            )
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="encode")
+
+    def _encode_batch(self, texts):
+        session = self._sessions.get()
+        try:
+            return session.encode(texts, batch_size=len(texts))
+        finally:
+            self._sessions.put(session)
+
+    def encode(self, texts, batch_size: int = None) -> np.ndarray:
+        """Embed texts into an (n, 384) float32 array of unit vectors."""
+        batch_size = batch_size or self.batch_size
+        texts = list(texts)
+        batches = [
+            texts[start : start + batch_size]
+            for start in range(0, len(texts), batch_size)
+        ]
+        if not batches:
+            return np.zeros((0, 384), dtype=np.float32)
+        return np.concatenate(list(self._executor.map(self._encode_batch, batches)))
+
+    def close(self):
+        self._executor.shutdown()
+
+
+def create_embedding_function(backend: str = EMBEDDING_BACKEND):
+    """
+    Create the query/document embedding function for the configured backend.
+
+    Every backend returns a callable taking a list of texts and returning one
+    vector per text, like a Chroma embedding function.
+    """
+    if backend == "sentence-transformers":
+        from chromadb.utils import embedding_functions
+
+        return embedding_functions.SentenceTransformerEmbeddingFunction(
+            model_name=EMBEDDING_MODEL
+        )
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxMiniLMEmbedding(quantized=backend == "onnx-int8")
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend}")
+
+
+def encode_texts(embedding_function, texts, batch_size: int = 32) -> np.ndarray:
+    """
+    Embed texts into an (n, 384) float32 array, batch_size texts per forward pass.
+
+    Chroma's embedding function interface leaves the batch size to the model's
+    default, so bulk encoding at ingest goes to the model directly.
+    """
+    if isinstance(embedding_function, (OnnxMiniLMEmbedding, OnnxEncodePool)):
+        return embedding_function.encode(texts, batch_size=batch_size)
+    # The SentenceTransformer behind Chroma's embedding function
+    model = getattr(embedding_function, "_model", None)
+    if model is not None:
+        return model.encode(
+            list(texts),
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=embedding_function.normalize_embeddings,
+        ).astype(np.float32)
+    return np.array(embedding_function(list(texts)), dtype=np.float32)
+
+
+def collection_embedding_function(embedding_function):
+    """
+    Embedding function to register on the Chroma collection.
+
+    The collection records the SentenceTransformer function it was created
+    with, and Chroma refuses to open it with a differently named one. Other
+    backends open it without one and always pass precomputed embeddings.
+    """
+    from chromadb.utils import embedding_functions
+
+    if isinstance(
+        embedding_function, embedding_functions.SentenceTransformerEmbeddingFunction
+    ):
+        return embedding_function
+    return None
@@ -0,0 +1,112 @@
+# Fetch the ONNX export of all-MiniLM-L6-v2 and write an int8-quantized copy
+# for EMBEDDING_BACKEND=onnx-int8. Quantization needs the onnx package
+# (pip install onnx); serving only needs onnxruntime and tokenizers.
+#
+# Run from the server directory:
+#     python export_onnx_model.py
+#
+# When sentence-transformers is installed, both ONNX models are checked against
+# it on chunks of the knowledge base and rejected below
+# ONNX_MIN_COSINE_SIMILARITY.
+
+import argparse
+import os
+import re
+import shutil
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from embedding_backends import (
+    EMBEDDING_MODEL,
+    ONNX_MIN_COSINE_SIMILARITY,
+    ONNX_MODEL_DIR,
+    OnnxMiniLMEmbedding,
+)
+
+KNOWLEDGE_BASE_PATH = Path(__file__).parent / "static_knowledge_base"
+
+
+def fetch_onnx_model(model_dir: Path):
+    """Copy Chroma's ONNX export of the model (fp32) into model_dir."""
+    from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+
+    onnx_ef = ONNXMiniLM_L6_V2()
+    onnx_ef._download_model_if_not_exists()
+    source = Path(onnx_ef.DOWNLOAD_PATH) / onnx_ef.EXTRACTED_FOLDER_NAME
+    model_dir.mkdir(parents=True, exist_ok=True)
+    for name in ("model.onnx", "tokenizer.json"):
+        shutil.copyfile(source / name, model_dir / name)
+
+
+def quantize(model_dir: Path):
+    """Write model_int8.onnx with int8 weights and dynamic activation scales."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(
+        str(model_dir / "model.onnx"),
+        str(model_dir / "model_int8.onnx"),
+        weight_type=QuantType.QInt8,
+    )
+
+
+def sample_texts(limit: int):
+    """Sentences and paragraphs from the knowledge base to compare vectors on."""
+    texts = []
+    for text_file in sorted(KNOWLEDGE_BASE_PATH.glob("*.txt")):
+        content = text_file.read_text(encoding="utf-8")
+        texts.extend(p.strip() for p in content.split("\n\n") if p.strip())
+        texts.extend(
+            s.strip() for s in re.split(r"(?<=[.!?])\s+", content) if s.strip()
+        )
+    return texts[:limit]
+
+
+def check_tolerance(model_dir: Path, limit: int) -> bool:
+    """Compare both ONNX models with sentence-transformers; False if out of tolerance."""
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        print("sentence-transformers not installed, skipping the tolerance check")
+        return True
+
+    texts = sample_texts(limit)
+    reference = SentenceTransformer(EMBEDDING_MODEL).encode(
+        texts, normalize_embeddings=True
+    )
+    ok = True
+    for quantized in (False, True):
+        vectors = OnnxMiniLMEmbedding(model_dir, quantized=quantized).encode(texts)
+        similarity = np.sum(vectors * reference, axis=1)
+        label = "onnx-int8" if quantized else "onnx"
+        print(
+            f"{label:10s} cosine vs sentence-transformers over {len(texts)} texts: "
+            f"min {similarity.min():.4f}  mean {similarity.mean():.4f}"
+        )
+        if similarity.min() < ONNX_MIN_COSINE_SIMILARITY:
+            print(f"{label} is below the {ONNX_MIN_COSINE_SIMILARITY} tolerance")
+            ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the ONNX embedding model")
+    parser.add_argument("--model-dir", type=Path, default=ONNX_MODEL_DIR)
+    parser.add_argument("--check-texts", type=int, default=500)
+    args = parser.parse_args()
+
+    if not (args.model_dir / "model.onnx").exists():
+        fetch_onnx_model(args.model_dir)
+    quantize(args.model_dir)
+    for name in ("model.onnx", "model_int8.onnx"):
+        size = os.path.getsize(args.model_dir / name) / 1e6
+        print(f"{args.model_dir / name}: {size:.1f} MB")
+
+    if not check_tolerance(args.model_dir, args.check_texts):
+        (args.model_dir / "model_int8.onnx").unlink()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
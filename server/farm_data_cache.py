@@ -0,0 +1,195 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Realtime data sections and the Supabase tables they are read from
+REALTIME_TABLES = {
+    "weather": "weather_data",
+    "market": "market_prices",
+    "environmental": "environmental_data",
+    "satellite": "satellite_data_table",
+}
+
+
+class FarmDataCache:
+    """
+    Versioned TTL cache for realtime farm data, keyed by farm and crop filter.
+
+    Each cached section remembers the version stamp its source table had when it
+    was read. The agents bump a table's stamp (see agents/data_versions.py) after
+    every write, so a section is served from cache until either its stamp moves or
+    the TTL expires. Only the stale sections of an entry are re-read.
+    """
+
+    def __init__(
+        self,
+        fetch_sections,
+        fetch_versions,
+        ttl: float = 300.0,
+        version_poll_interval: float = 1.0,
+        max_entries: int = 256,
+    ):
+        """
+        Args:
+            fetch_sections: Callable (sections, crop_list, farm_id) -> (data, failed)
+                where data maps section name to rows and failed is a set of
+                section names that could not be read
+            fetch_versions: Callable returning {table_name: version}, or None if
+                the version stamps could not be read
+            ttl: Maximum age in seconds of a cached section
+            version_poll_interval: How long in seconds the version stamps are
+                reused before they are read again. While they cannot be read,
+                the interval doubles after each failure, up to the TTL.
+            max_entries: Maximum number of farm/crop keys kept (LRU eviction)
+        """
+        self.fetch_sections = fetch_sections
+        self.fetch_versions = fetch_versions
+        self.ttl = ttl
+        self.version_poll_interval = version_poll_interval
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        # key -> {section: (rows, table_version, generation, fetched_at)}
+        self._entries = OrderedDict()
+        self._versions = None
+        self._versions_checked_at = None
+        self._versions_failures = 0
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(farm_id=None, crop_list=None):
+        crops = (
+            tuple(sorted({crop.strip().lower() for crop in crop_list}))
+            if crop_list
+            else None
+        )
+        return (farm_id, crops)
+
+    def _poll_interval(self):
+        if not self._versions_failures:
+            return self.version_poll_interval
+        backoff = self.version_poll_interval * 2 ** min(self._versions_failures, 16)
+        return min(backoff, max(self.ttl, self.version_poll_interval))
+
+    def _current_versions(self):
+        now = time.monotonic()
+        with self._lock:
+            if (
+                self._versions_checked_at is not None
+                and now - self._versions_checked_at < self._poll_interval()
+            ):
+                return self._versions
+
+        versions = self.fetch_versions()
+
+        with self._lock:
+            self._versions = versions
+            self._versions_checked_at = now
+            self._versions_failures = (
+                0 if versions is not None else (self._versions_failures + 1)
+            )
+        return versions
+
+    def _is_fresh(self, cached, section, versions, now):
+        if cached is None:
+            return False
+        _, table_version, _, fetched_at = cached
+        if now - fetched_at > self.ttl:
+            return False
+        if versions is None:
+            # Version stamps unavailable, fall back to TTL-only expiry
+            return True
+        return versions.get(REALTIME_TABLES[section]) == table_version
+
+    def get(self, farm_id=None, crop_list=None):
+        """
+        Return realtime farm data for a farm and crop filter.
+
+        Args:
+            farm_id: Optional farm ID
+            crop_list: Optional list of crop names to filter market data
+
+        Returns:
+            Tuple (data, generations). data maps each section to its rows;
+            generations maps each section to an integer that changes whenever the
+            section is re-read, or None for a section that failed to load.
+        """
+        key = self.make_key(farm_id, crop_list)
+        versions = self._current_versions()
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key, {})
+            stale = [
+                section
+                for section in REALTIME_TABLES
+                if not self._is_fresh(entry.get(section), section, versions, now)
+            ]
+            self.hits += len(REALTIME_TABLES) - len(stale)
+            self.misses += len(stale)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+
+        fetched, failed = ({}, set())
+        if stale:
+            fetched, failed = self.fetch_sections(stale, crop_list, farm_id)
+
+        with self._lock:
+            entry = dict(self._entries.get(key, entry))
+            for section in stale:
+                if section in failed:
+                    entry.pop(section, None)
+                    continue
+                self._generation += 1
+                table_version = (
+                    versions.get(REALTIME_TABLES[section]) if versions else None
+                )
+                entry[section] = (
+                    fetched[section],
+                    table_version,
+                    self._generation,
+                    now,
+                )
+
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        data = {}
+        generations = {}
+        for section in REALTIME_TABLES:
+            if section in entry:
+                data[section] = entry[section][0]
+                generations[section] = entry[section][2]
+            else:
+                data[section] = []
+                generations[section] = None
+        return data, generations
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions = None
+            self._versions_checked_at = None
+            self._versions_failures = 0
+
+    def stats(self):
+        """Return hit/miss counters (counted per section lookup) and cache size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "evictions": self.evictions,
+                "ttl_seconds": self.ttl,
+                "versions": dict(self._versions) if self._versions else None,
+            }
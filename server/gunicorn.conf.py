@@ -0,0 +1,60 @@
+# Pre-forked serving of server.py:
+#     gunicorn -c gunicorn.conf.py server:app
+#
+# With PRELOAD_MODEL=1 (the default) the app is imported once in the master,
+# which loads the embedding model before forking, so workers share its pages
+# copy-on-write instead of each loading their own copy. The model is loaded but
+# not run in the master: inference thread pools do not survive fork. Chroma and
+# Supabase clients are opened in each worker, which reports ready on /ready once
+# warmed up.
+
+import gc
+import glob
+import os
+import sys
+import tempfile
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8081")
+workers = int(os.getenv("GUNICORN_WORKERS", "4"))
+# Lets the app split its upstream LLM call limit between the workers
+os.environ["LLM_WORKER_PROCESSES"] = str(workers)
+# Workers share their metrics through this directory, so /metrics reports the
+# whole server whichever worker answers the scrape (see metrics.py)
+if not os.getenv("METRICS_MULTIPROC_DIR"):
+    os.environ["METRICS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="demeter-metrics-")
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+# Streaming answers can take longer than gunicorn's 30 second default
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+preload_app = os.getenv("PRELOAD_MODEL", "1") == "1"
+
+
+def on_starting(arbiter):
+    # Counts left over from a previous run of the server would be added in
+    for path in glob.glob(os.path.join(os.environ["METRICS_MULTIPROC_DIR"], "*")):
+        os.remove(path)
+
+
+def when_ready(arbiter):
+    if not preload_app:
+        return
+    sys.modules["server"].preload()
+    # Keep the garbage collector from writing to (and so copying) the pages of
+    # objects that already exist when workers are forked
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    sys.modules["server"].readiness.start()
+    sys.modules["server"].registry.start_sync()
+
+
+def worker_exit(arbiter, worker):
+    # Keep the worker's last counts when it is restarted
+    sys.modules["server"].registry.write_snapshot()
+
+
+def child_exit(arbiter, worker):
+    from metrics import registry
+
+    registry.mark_process_dead(worker.pid)
@@ -0,0 +1,167 @@
+import base64
+import hashlib
+import io
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import image_bytes_in, image_bytes_saved, image_preprocess_seconds
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; images are then forwarded unchanged
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Lowest JPEG quality tried before scaling the image down further
+MIN_JPEG_QUALITY = 40
+
+
+def parse_data_url(url: str):
+    """Split a base64 data URL into (mime type, payload), or None."""
+    if not url.startswith("data:"):
+        return None
+    header, sep, payload = url.partition(",")
+    if not sep or not header.endswith(";base64"):
+        return None
+    return header[5:-7], payload
+
+
+class ImagePreprocessor:
+    """
+    Downsize and recompress chat photo uploads before they reach the LLM.
+
+    Images sent as base64 data URLs are scaled to fit max_dimension, converted
+    to JPEG and re-encoded at lower quality (then smaller size) until they fit
+    max_bytes. Results are cached by a hash of the original data URL, so a photo
+    resent with the conversation history on later turns is processed once.
+    Remote image URLs and images that would not shrink are left as they are.
+    """
+
+    def __init__(
+        self,
+        max_dimension: int = 1024,
+        jpeg_quality: int = 80,
+        max_bytes: int = 500_000,
+        max_entries: int = 64,
+    ):
+        self.max_dimension = max_dimension
+        self.jpeg_quality = jpeg_quality
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.enabled = Image is not None
+        if not self.enabled:
+            logger.warning("Pillow is not installed, chat images are not resized")
+
+        self._lock = threading.Lock()
+        # sha1 of the original data URL -> processed data URL, in LRU order
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _encode(self, image, quality):
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+        return buffer.getvalue()
+
+    def _shrink(self, raw: bytes) -> bytes:
+        image = Image.open(io.BytesIO(raw))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            # Flatten transparency onto white instead of black
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        image.thumbnail((self.max_dimension, self.max_dimension), Image.LANCZOS)
+
+        quality = self.jpeg_quality
+        data = self._encode(image, quality)
+        while len(data) > self.max_bytes:
+            if quality > MIN_JPEG_QUALITY:
+                quality = max(MIN_JPEG_QUALITY, quality - 10)
+            elif min(image.size) > 64:
+                image = image.resize(
+                    (int(image.width * 0.75), int(image.height * 0.75)),
+                    Image.LANCZOS,
+                )
+            else:
+                break
+            data = self._encode(image, quality)
+        return data
+
+    @staticmethod
+    def _record_bytes(url, processed):
+        image_bytes_in.inc(len(url))
+        image_bytes_saved.inc(len(url) - len(processed))
+
+    def process_url(self, url: str) -> str:
+        """Return a smaller data URL for an image URL, or the URL unchanged."""
+        parsed = parse_data_url(url)
+        if not self.enabled or parsed is None:
+            return url
+
+        key = hashlib.sha1(url.encode("ascii", "ignore")).hexdigest()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if cached is not None:
+            # An empty entry marks an image that is sent unchanged
+            processed = cached or url
+            self._record_bytes(url, processed)
+            return processed
+
+        started = time.perf_counter()
+        try:
+            raw = base64.b64decode(parsed[1], validate=False)
+            data = self._shrink(raw)
+        except Exception as e:
+            # Undecodable, unsupported or oversized (decompression bomb) images
+            logger.warning(f"Could not preprocess chat image: {e}")
+            data = None
+        image_preprocess_seconds.observe(time.perf_counter() - started)
+
+        if data is not None and len(data) < len(raw):
+            processed = "data:image/jpeg;base64," + base64.b64encode(data).decode()
+        else:
+            processed = url
+        self._record_bytes(url, processed)
+
+        with self._lock:
+            self._cache[key] = processed if processed is not url else ""
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return processed
+
+    def process_content(self, content):
+        """Preprocess the image parts of a multimodal message content array."""
+        if not isinstance(content, list):
+            return content
+        processed = []
+        for part in content:
+            image_url = (
+                part.get("image_url") if part.get("type") == "image_url" else None
+            )
+            if isinstance(image_url, dict) and image_url.get("url"):
+                url = self.process_url(image_url["url"])
+                if url is not image_url["url"]:
+                    part = {**part, "image_url": {**image_url, "url": url}}
+            processed.append(part)
+        return processed
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._cache),
+                "max_entries": self.max_entries,
+            }
@@ -0,0 +1,59 @@
+import re
+
+from lexical_index import tokenize
+
+# Shard collections are named after the main collection plus the shard
+SHARD_COLLECTION_PREFIX = "static_knowledge_base__"
+
+# Chunks from sources matching no shard's keywords
+GENERAL_SHARD = "general"
+
+# Words selecting each shard. Source file names are matched against them at
+# ingest; query words and the farm's crops are matched against them when
+# routing. Only shards that have chunks are ever searched.
+SHARD_KEYWORDS = {
+    "corn": {"corn", "maize"},
+    "wheat": {"wheat", "fusarium", "septoria", "rust", "scab", "bunt"},
+    "potato": {"potato", "potatoes", "tuber", "tubers"},
+    "soybean": {"soybean", "soybeans", "soy"},
+    "rice": {"rice", "paddy"},
+    "market": {"market", "markets", "marketing", "vendor", "vendors", "sell"},
+    "organic": {"organic", "certification", "certified"},
+}
+
+
+def shard_for_source(source: str) -> str:
+    """Shard of a knowledge base file, from the words in its name."""
+    words = set(re.split(r"[^a-z0-9]+", source.lower().rsplit(".", 1)[0]))
+    for shard, keywords in SHARD_KEYWORDS.items():
+        if keywords & words:
+            return shard
+    return GENERAL_SHARD
+
+
+def route(query: str, crop_list, shards):
+    """
+    Pick the shards to search for a query.
+
+    Shards named by the query text win (a wheat disease, selling, organic
+    rules); otherwise the shards of the farm's crops are searched. The general
+    shard is added to any selection.
+
+    Args:
+        query: The search query
+        crop_list: Optional crop names grown on the farm
+        shards: Names of the shards that exist
+
+    Returns:
+        Sorted list of shard names, or None to search the whole collection
+    """
+    words = set(tokenize(query))
+    selected = {s for s in shards if SHARD_KEYWORDS.get(s, set()) & words}
+    if not selected and crop_list:
+        crops = {crop.strip().lower() for crop in crop_list}
+        selected = {s for s in shards if SHARD_KEYWORDS.get(s, set()) & crops}
+    if not selected:
+        return None
+    if GENERAL_SHARD in shards:
+        selected.add(GENERAL_SHARD)
+    return sorted(selected)
@@ -0,0 +1,238 @@
+import json
+import logging
+import math
+import re
+from array import array
+from collections import Counter
+from itertools import repeat
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Hyphenated words stay whole, so "MP437", "Fusarium" or "2,4-D" (as "2" and
+# "4-d") match exactly
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+
+# Frequent English words that would otherwise dominate short queries
+STOPWORDS = frozenset("""
+    a about after all also an and any are as at be been before but by can could
+    did do does for from had has have how i if in into is it its may me more
+    most my no not of on or our should so some such than that the their them
+    then there these they this to was we were what when where which while who
+    why will with would you your
+    """.split())
+
+# Standard Okapi BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Rank constant of reciprocal rank fusion (Cormack et al.)
+RRF_K = 60
+
+
+def tokenize(text: str):
+    """Lowercased terms of a text, without stopwords."""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def reciprocal_rank_fusion(rankings, k: int = RRF_K):
+    """
+    Merge ranked id lists by summing 1 / (k + rank) over the lists.
+
+    Returns:
+        List of (id, score) tuples, best first
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index:
+    """
+    Okapi BM25 over the knowledge base chunks, stored as numpy arrays.
+
+    Postings are kept in CSR form: the chunks containing term t are
+    doc_indices[indptr[t]:indptr[t + 1]], with the term's full BM25 weight for
+    each chunk precomputed in weights. Scoring a query is then a sum of a few
+    array slices, and the arrays are saved as .npy files that load memory-mapped
+    at server start instead of being parsed.
+
+    Chunks can be labelled with a group (their knowledge base shard), so a
+    search can be limited to the groups a query was routed to.
+    """
+
+    def __init__(
+        self,
+        vocabulary,
+        doc_ids,
+        indptr,
+        doc_indices,
+        weights,
+        group_names=(),
+        doc_groups=None,
+    ):
+        self.vocabulary = vocabulary
+        self.doc_ids = doc_ids
+        self.indptr = indptr
+        self.doc_indices = doc_indices
+        self.weights = weights
+        self.group_names = list(group_names)
+        self.doc_groups = doc_groups
+
+    @classmethod
+    def build(cls, doc_ids, texts, groups=None, k1: float = BM25_K1, b: float = BM25_B):
+        """Build the index from chunk ids, their texts and optional groups."""
+        builder = BM25Builder()
+        builder.add(doc_ids, texts, groups)
+        return builder.build(k1, b)
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "indptr.npy", self.indptr)
+        np.save(path / "doc_indices.npy", self.doc_indices)
+        np.save(path / "weights.npy", self.weights)
+        if self.doc_groups is not None:
+            np.save(path / "doc_groups.npy", self.doc_groups)
+        with open(path / "terms.json", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "vocabulary": self.vocabulary,
+                    "doc_ids": self.doc_ids,
+                    "group_names": self.group_names,
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved index with its postings memory-mapped."""
+        path = Path(path)
+        with open(path / "terms.json", encoding="utf-8") as f:
+            terms = json.load(f)
+        groups_path = path / "doc_groups.npy"
+        return cls(
+            terms["vocabulary"],
+            terms["doc_ids"],
+            np.load(path / "indptr.npy", mmap_mode="r"),
+            np.load(path / "doc_indices.npy", mmap_mode="r"),
+            np.load(path / "weights.npy", mmap_mode="r"),
+            terms.get("group_names", []),
+            np.load(groups_path, mmap_mode="r") if groups_path.exists() else None,
+        )
+
+    def search(self, query: str, n_results: int, groups=None):
+        """
+        Chunks matching the query terms, best BM25 score first.
+
+        Args:
+            query: The search query
+            n_results: Maximum number of chunks to return
+            groups: Optional group names to limit the search to
+
+        Returns:
+            List of (chunk id, score) tuples
+        """
+        term_ids = {self.vocabulary[t] for t in tokenize(query) if t in self.vocabulary}
+        if not term_ids or n_results <= 0:
+            return []
+
+        slices = [slice(self.indptr[t], self.indptr[t + 1]) for t in term_ids]
+        scores = np.bincount(
+            np.concatenate([self.doc_indices[s] for s in slices]),
+            weights=np.concatenate([self.weights[s] for s in slices]),
+            minlength=len(self.doc_ids),
+        )
+        if groups is not None and self.doc_groups is not None:
+            group_ids = [i for i, name in enumerate(self.group_names) if name in groups]
+            scores[~np.isin(self.doc_groups, group_ids)] = 0
+        matched = np.flatnonzero(scores)
+        if len(matched) > n_results:
+            matched = matched[np.argpartition(-scores[matched], n_results)[:n_results]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(self.doc_ids[i], float(scores[i])) for i in matched]
+
+
+class BM25Builder:
+    """
+    Builds a BM25Index from chunks added a page at a time.
+
+    Only each term's postings (chunk index and term frequency, as compact
+    int arrays) and each chunk's length are kept, not the texts, so the
+    chunks can be streamed from the collection. BM25 weights depend on
+    corpus-wide statistics and are computed in build().
+    """
+
+    def __init__(self):
+        self.doc_ids = []
+        self.groups = []
+        self._lengths = array("i")
+        self._postings = {}
+
+    def add(self, doc_ids, texts, groups=None):
+        for doc_id, text, group in zip(
+            doc_ids, texts, groups if groups is not None else repeat(None)
+        ):
+            doc_index = len(self.doc_ids)
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                if term not in self._postings:
+                    self._postings[term] = (array("i"), array("i"))
+                docs, tfs = self._postings[term]
+                docs.append(doc_index)
+                tfs.append(tf)
+            self.doc_ids.append(doc_id)
+            self.groups.append(group)
+            self._lengths.append(sum(counts.values()))
+
+    def build(self, k1: float = BM25_K1, b: float = BM25_B):
+        lengths = np.frombuffer(self._lengths, dtype=np.int32).astype(np.float32)
+        avg_length = float(lengths.mean()) if len(lengths) else 0.0
+        n_docs = len(self.doc_ids)
+
+        vocabulary = {term: i for i, term in enumerate(sorted(self._postings))}
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        doc_indices = []
+        weights = []
+        for term, term_id in vocabulary.items():
+            docs, tfs = self._postings[term]
+            docs = np.frombuffer(docs, dtype=np.int32)
+            tf = np.frombuffer(tfs, dtype=np.int32).astype(np.float32)
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = k1 * (1 - b + b * lengths[docs] / avg_length)
+            doc_indices.append(docs)
+            weights.append((idf * tf * (k1 + 1) / (tf + norm)).astype(np.float32))
+            indptr[term_id + 1] = indptr[term_id] + len(docs)
+
+        with_groups = n_docs > 0 and self.groups[0] is not None
+        group_names = sorted(set(self.groups)) if with_groups else []
+        group_ids = {name: i for i, name in enumerate(group_names)}
+        doc_groups = (
+            np.array([group_ids[g] for g in self.groups], dtype=np.int16)
+            if with_groups
+            else None
+        )
+        return BM25Index(
+            vocabulary,
+            list(self.doc_ids),
+            indptr,
+            np.concatenate(doc_indices) if doc_indices else np.zeros(0, np.int32),
+            np.concatenate(weights) if weights else np.zeros(0, np.float32),
+            group_names,
+            doc_groups,
+        )
+
+
+def load_lexical_index(path):
+    """Load the BM25 index, or None (dense-only retrieval) if it was not built."""
+    if not (Path(path) / "terms.json").exists():
+        logger.warning(
+            f"No BM25 index at {path}, run populate_vector_db.py to build it; "
+            "retrieval is dense-only"
+        )
+        return None
+    return BM25Index.load(path)
@@ -0,0 +1,111 @@
+import base64
+import json
+import os
+
+import httpx
+import requests
+from dotenv import load_dotenv
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+
+# Load environment variables from root .env file
+load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env")
+
+# OpenAI chat completions, forwarded through Lava Payments
+LAVA_FORWARD_URL = os.getenv(
+    "LAVA_FORWARD_URL",
+    "https://api.lavapayments.com/v1/forward?u=https://api.openai.com/v1/chat/completions",
+)
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+# Model that folds older chat turns into a rolling summary
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", LLM_MODEL)
+
+# Upper bound on open upstream connections per process
+LLM_POOL_MAXSIZE = int(os.getenv("LLM_POOL_MAXSIZE", "32"))
+# Async serving holds many more concurrent streams per process
+ASYNC_LLM_MAX_CONNECTIONS = int(os.getenv("ASYNC_LLM_MAX_CONNECTIONS", "512"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+
+
+def create_http_session(pool_maxsize: int = LLM_POOL_MAXSIZE) -> requests.Session:
+    """
+    Create a keep-alive HTTP session with a bounded connection pool.
+
+    With pool_block set, callers wait for a free connection instead of opening
+    more than pool_maxsize sockets to the same host.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4, pool_maxsize=pool_maxsize, pool_block=True
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Shared session so upstream connections are reused across requests
+http_session = create_http_session()
+
+
+# Initialize Lava Payments token
+def get_lava_token():
+    return base64.b64encode(
+        json.dumps(
+            {
+                "secret_key": os.getenv("LAVA_API_KEY"),
+                "connection_secret": os.getenv("LAVA_SELF_CONNECTION_SECRET"),
+                "product_secret": os.getenv("LAVA_SELF_PRODUCT_SECRET"),
+            }
+        ).encode()
+    ).decode()
+
+
+def create_async_http_client(
+    max_connections: int = ASYNC_LLM_MAX_CONNECTIONS,
+) -> httpx.AsyncClient:
+    """Create a keep-alive async HTTP client with a bounded connection pool."""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        ),
+        timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+    )
+
+
+def chat_completion_request(messages, stream: bool = False, model: str = LLM_MODEL):
+    """Build the headers and JSON payload for a chat completion request."""
+    payload = {"model": model, "messages": messages}
+    if stream:
+        payload["stream"] = True
+
+    headers = {
+        "Authorization": f"Bearer {get_lava_token()}",
+        "Content-Type": "application/json",
+    }
+    return headers, payload
+
+
+def chat_completion(messages, stream: bool = False, model: str = LLM_MODEL):
+    """
+    Send a single chat completion request through the Lava forward URL.
+
+    Args:
+        messages: OpenAI-style messages array
+        stream: Whether to request an SSE stream from the upstream
+        model: Model name to request
+
+    Returns:
+        The requests.Response. Streaming responses must be closed by the caller
+        so the connection returns to the pool.
+    """
+    headers, payload = chat_completion_request(messages, stream, model)
+
+    return http_session.post(
+        LAVA_FORWARD_URL,
+        headers=headers,
+        json=payload,
+        stream=stream,
+        timeout=(LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT),
+    )
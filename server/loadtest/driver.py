@@ -0,0 +1,232 @@
+# Load driver for the chat and farm-data endpoints. Runs each scenario at a
+# ladder of concurrency levels and reports latency percentiles and throughput.
+#
+# Start the fakes and the server first (from the server directory):
+#     python loadtest/fake_supabase.py --port 54321 &
+#     python loadtest/fake_llm.py --port 8090 &
+#     SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_KEY=fake \
+#         LAVA_FORWARD_URL=http://127.0.0.1:8090/v1/chat/completions \
+#         LLM_MAX_QUEUED_PER_CLIENT=64 \
+#         uvicorn asgi_server:app --port 8081
+# (every request comes from this one address, so it is one client to the
+# LLM queue's per-client limit)
+# then:
+#     python loadtest/driver.py --url http://127.0.0.1:8081 --concurrency 1,4,16,64
+
+import argparse
+import json
+import random
+import threading
+import time
+
+import requests
+
+QUESTIONS = [
+    "How should I adjust irrigation for corn this week?",
+    "What is the best time to sell my wheat?",
+    "My soil pH is low, what should I apply?",
+    "How do I reduce erosion on a sloped field?",
+    "Is the NDVI trend on my farm a concern?",
+    "When should I plant soybeans after this rain?",
+    "What fertilizer schedule works for rice?",
+    "How do I tell if my tomatoes are water stressed?",
+]
+
+CROP_LISTS = ["Maize", "Wheat,Rice", "Soybean", "Maize,Soybean,Wheat", ""]
+FARM_IDS = ["FARM_001", "FARM_002", "FARM_003", ""]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return float("nan")
+    index = min(
+        len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1)))
+    )
+    return sorted_values[index]
+
+
+def chat_body(rng, stream, unique):
+    question = rng.choice(QUESTIONS)
+    if unique:
+        # Defeat the semantic answer cache
+        question = f"{question} (field {rng.randrange(1_000_000)})"
+    body = {"messages": [{"role": "user", "content": question}], "stream": stream}
+    farm_id = rng.choice(FARM_IDS)
+    if farm_id:
+        body["farm_id"] = farm_id
+    crops = rng.choice(CROP_LISTS)
+    if crops:
+        body["crops"] = crops
+    return body
+
+
+class StreamError(Exception):
+    """A /rag-query stream that returned 200 but carried no answer."""
+
+
+def run_rag(session, base_url, rng, args, stream):
+    """Send one /rag-query and return (ttfb, total) in seconds."""
+    body = chat_body(rng, stream, args.unique)
+    start = time.perf_counter()
+    response = session.post(
+        f"{base_url}/rag-query", json=body, stream=stream, timeout=args.timeout
+    )
+    response.raise_for_status()
+    if not stream:
+        response.json()
+        elapsed = time.perf_counter() - start
+        return elapsed, elapsed
+
+    ttfb = None
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data: "):
+                continue
+            data = line[6:]
+            if data == "[DONE]":
+                break
+            parsed = json.loads(data)
+            if "error" in parsed:
+                # Upstream failures and queue timeouts end a 200 stream this way
+                raise StreamError(parsed["error"])
+            if ttfb is None and parsed.get("choices"):
+                ttfb = time.perf_counter() - start
+    finally:
+        response.close()
+    if ttfb is None:
+        # Only status events (or nothing) arrived, so no answer was streamed
+        raise StreamError("stream ended without an answer")
+    return ttfb, time.perf_counter() - start
+
+
+def run_farm_data(session, base_url, rng, args):
+    params = {}
+    crops = rng.choice(CROP_LISTS)
+    if crops:
+        params["crops"] = crops
+    farm_id = rng.choice(FARM_IDS)
+    if farm_id:
+        params["farm_id"] = farm_id
+    start = time.perf_counter()
+    response = session.get(
+        f"{base_url}/api/farm-data", params=params, timeout=args.timeout
+    )
+    response.raise_for_status()
+    response.json()
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed
+
+
+SCENARIOS = {
+    "rag-stream": lambda s, u, r, a: run_rag(s, u, r, a, stream=True),
+    "rag": lambda s, u, r, a: run_rag(s, u, r, a, stream=False),
+    "farm-data": run_farm_data,
+}
+
+
+def run_level(scenario, base_url, concurrency, args):
+    """Run one scenario at a fixed concurrency for the configured duration."""
+    run = SCENARIOS[scenario]
+    results = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def worker(seed):
+        rng = random.Random(seed)
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            try:
+                sample = run(session, base_url, rng, args)
+            except Exception as e:
+                with lock:
+                    errors.append(type(e).__name__)
+                continue
+            with lock:
+                results.append(sample)
+        session.close()
+
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(target=worker, args=(args.seed + i,), daemon=True)
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    ttfbs = sorted(sample[0] for sample in results)
+    totals = sorted(sample[1] for sample in results)
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(errors),
+        "throughput": len(results) / wall if wall else 0.0,
+        "ttfb": {pct: percentile(ttfbs, pct) for pct in (50, 95, 99)},
+        "total": {pct: percentile(totals, pct) for pct in (50, 95, 99)},
+    }
+
+
+def print_row(row, streaming):
+    def ms(value):
+        return f"{value * 1000:8.1f}"
+
+    total = row["total"]
+    line = (
+        f"{row['scenario']:<11} {row['concurrency']:>5} {row['requests']:>7} "
+        f"{row['errors']:>6} {row['throughput']:>8.1f}  "
+        f"{ms(total[50])} {ms(total[95])} {ms(total[99])}"
+    )
+    if streaming:
+        ttfb = row["ttfb"]
+        line += f"   {ms(ttfb[50])} {ms(ttfb[95])} {ms(ttfb[99])}"
+    print(line, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Demeter server")
+    parser.add_argument("--url", default="http://127.0.0.1:8081")
+    parser.add_argument(
+        "--scenarios",
+        default="farm-data,rag,rag-stream",
+        help=f"Comma-separated subset of {', '.join(SCENARIOS)}",
+    )
+    parser.add_argument("--concurrency", default="1,4,16,64")
+    parser.add_argument(
+        "--duration", type=float, default=15.0, help="Seconds per concurrency level"
+    )
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument(
+        "--unique",
+        action="store_true",
+        help="Make every question unique so the answer cache never hits",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip("/")
+    levels = [int(level) for level in args.concurrency.split(",")]
+    rows = []
+
+    print(
+        f"{'scenario':<11} {'conc':>5} {'reqs':>7} {'errors':>6} {'req/s':>8}  "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}   "
+        f"{'ttfb p50':>8} {'ttfb p95':>8} {'ttfb p99':>8}"
+    )
+    for scenario in args.scenarios.split(","):
+        for concurrency in levels:
+            row = run_level(scenario, base_url, concurrency, args)
+            rows.append(row)
+            print_row(row, streaming=scenario == "rag-stream")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# Local stand-in for the OpenAI-style chat completions endpoint behind the Lava
+# forward URL. Streams SSE chunks with a configurable time to first byte and
+# token rate, or returns a single completion when "stream" is not set.
+#
+# Run from the server directory:
+#     python loadtest/fake_llm.py --port 8090 --ttfb-ms 400 --tokens-per-second 60
+# then start the server with
+#     LAVA_FORWARD_URL=http://127.0.0.1:8090/v1/chat/completions
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER_WORDS = (
+    "Apply **agricultural lime** at two tons per acre this fall, then retest "
+    "the soil pH in three months. Irrigate early in the morning while the "
+    "forecast stays dry, and watch the lower leaves for yellowing."
+).split()
+
+
+def answer_tokens(n_tokens: int):
+    return [
+        (" " if i else "") + ANSWER_WORDS[i % len(ANSWER_WORDS)]
+        for i in range(n_tokens)
+    ]
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        config = self.server.config
+        tokens = answer_tokens(config["tokens"])
+        model = body.get("model", "gpt-4o")
+
+        time.sleep(config["ttfb"])
+
+        if not body.get("stream"):
+            time.sleep(len(tokens) * config["token_interval"])
+            payload = json.dumps(
+                {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion",
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {
+                                "role": "assistant",
+                                "content": "".join(tokens),
+                            },
+                            "finish_reason": "stop",
+                        }
+                    ],
+                }
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(config["token_interval"])
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "model": model,
+                "choices": [
+                    {"index": 0, "delta": {"content": token}, "finish_reason": None}
+                ],
+            }
+            self._write_chunk(
+                f"data: {json.dumps(chunk, separators=(',', ':'))}\n\n".encode()
+            )
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+
+def serve(
+    port: int,
+    ttfb_ms: float = 400.0,
+    tokens_per_second: float = 60.0,
+    tokens: int = 150,
+):
+    """Start the fake in a background thread and return the server."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeLLMHandler)
+    server.daemon_threads = True
+    server.config = {
+        "ttfb": ttfb_ms / 1000,
+        "token_interval": 1 / tokens_per_second if tokens_per_second > 0 else 0.0,
+        "tokens": tokens,
+    }
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake chat completions server")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--ttfb-ms", type=float, default=400.0)
+    parser.add_argument("--tokens-per-second", type=float, default=60.0)
+    parser.add_argument("--tokens", type=int, default=150, help="Tokens per answer")
+    args = parser.parse_args()
+
+    server = serve(args.port, args.ttfb_ms, args.tokens_per_second, args.tokens)
+    print(f"Fake LLM listening on http://127.0.0.1:{args.port}/v1/chat/completions")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
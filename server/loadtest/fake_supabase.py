@@ -0,0 +1,228 @@
+# Local stand-in for the Supabase/PostgREST queries server.py issues, seeded
+# from backend/structured_db_interface/*.csv. Supports the subset of PostgREST
+# the server uses: select, order, limit, eq. and in. filters on
+# /rest/v1/<table>, plus the bump_data_version RPC.
+#
+# Run from the server directory:
+#     python loadtest/fake_supabase.py --port 54321 --latency-ms 20
+# then start the server with SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_KEY=fake
+
+import argparse
+import csv
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+SEED_DIR = (
+    Path(__file__).resolve().parent.parent.parent
+    / "backend"
+    / "structured_db_interface"
+)
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def load_seed_tables(seed_dir: Path = SEED_DIR):
+    """Map the starter CSVs onto the columns of the Supabase tables."""
+    tables = {
+        "weather_data": [],
+        "market_prices": [],
+        "environmental_data": [],
+        "satellite_data_table": [],
+        "data_versions": [],
+    }
+
+    with open(seed_dir / "starter_weather_data.csv", newline="") as f:
+        for row in csv.DictReader(f):
+            temperature_c = _float(row["temperature_c"])
+            rainfall_mm = _float(row["rainfall_mm"])
+            wind_kph = _float(row["wind_speed_kph"])
+            tables["weather_data"].append(
+                {
+                    "farm_id": row["farm_id"],
+                    "date": row["date"],
+                    "temperature_mean": round(temperature_c * 9 / 5 + 32, 2),
+                    "humidity_mean": _float(row["humidity_percent"]),
+                    "precipitation_sum": round(rainfall_mm / 25.4, 4),
+                    "wind_speed_max": round(wind_kph / 1.609, 2),
+                }
+            )
+
+    with open(seed_dir / "starter_market_data.csv", newline="") as f:
+        for row in csv.DictReader(f):
+            tables["market_prices"].append(
+                {
+                    "date": row["date"],
+                    "crop_name": row["crop_type"],
+                    "unit": "USD/kg",
+                    "price": _float(row["local_price_per_kg_usd"]),
+                }
+            )
+
+    with open(seed_dir / "starter_environmental_data.csv", newline="") as f:
+        for row in csv.DictReader(f):
+            tables["environmental_data"].append(
+                {
+                    "farm_id": row["farm_id"],
+                    "date": row["date"],
+                    "soil_ph": _float(row["soil_ph"]),
+                    "soil_temperature_c": _float(row["soil_temperature_c"]),
+                    "sediment_level_mg_l": _float(row["sediment_level_mg_l"]),
+                    "erosion_risk_index": _float(row["erosion_risk_index"]),
+                    "fertilizer_availability_index": _float(
+                        row["fertilizer_availability_index"]
+                    ),
+                }
+            )
+
+    # There is no starter satellite CSV, so synthesize a few recent rows
+    now = datetime(2025, 10, 15, tzinfo=timezone.utc)
+    for i in range(5):
+        tables["satellite_data_table"].append(
+            {
+                "id": i + 1,
+                "created_at": (now + timedelta(days=i)).isoformat(),
+                "latitude": 37.897,
+                "longitude": 122.25359,
+                "mean_ndvi": round(0.55 + 0.02 * i, 3),
+                "median_ndvi": round(0.56 + 0.02 * i, 3),
+                "mean_ndwi": round(0.21 - 0.01 * i, 3),
+                "median_ndwi": round(0.2 - 0.01 * i, 3),
+                "crop_advice": "Water status: moisture levels are adequate.",
+            }
+        )
+
+    return tables
+
+
+def _parse_in_list(value):
+    # in.(Corn,"Sweet Corn")
+    items = value[1:-1].split(",") if value.startswith("(") else [value]
+    return {item.strip().strip('"') for item in items}
+
+
+def run_query(rows, params):
+    """Apply PostgREST-style filters, ordering and limit to a list of rows."""
+    order = None
+    limit = None
+    filters = []
+    for key, value in params:
+        if key == "select":
+            continue
+        if key == "order":
+            order = value
+        elif key == "limit":
+            limit = int(value)
+        elif value.startswith("eq."):
+            filters.append((key, {value[3:]}))
+        elif value.startswith("in."):
+            filters.append((key, _parse_in_list(value[3:])))
+
+    result = [
+        row
+        for row in rows
+        if all(str(row.get(column)) in allowed for column, allowed in filters)
+    ]
+
+    if order:
+        for clause in reversed(order.split(",")):
+            column, _, direction = clause.partition(".")
+            result.sort(
+                key=lambda row: (row.get(column) is None, row.get(column) or ""),
+                reverse=direction.startswith("desc"),
+            )
+
+    if limit is not None:
+        result = result[:limit]
+    return result
+
+
+class FakeSupabaseHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _delay(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def do_GET(self):
+        self._delay()
+        url = urlsplit(self.path)
+        prefix = "/rest/v1/"
+        table = url.path[len(prefix) :] if url.path.startswith(prefix) else None
+        if table not in self.server.tables:
+            self._send_json(404, {"message": f"relation {table} does not exist"})
+            return
+
+        with self.server.lock:
+            rows = list(self.server.tables[table])
+        self._send_json(200, run_query(rows, parse_qsl(url.query)))
+
+    def do_POST(self):
+        self._delay()
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if urlsplit(self.path).path != "/rest/v1/rpc/bump_data_version":
+            self._send_json(404, {"message": "not supported by the fake"})
+            return
+
+        table_name = body["p_table_name"]
+        with self.server.lock:
+            versions = self.server.tables["data_versions"]
+            row = next((r for r in versions if r["table_name"] == table_name), None)
+            if row is None:
+                row = {"table_name": table_name, "version": 0}
+                versions.append(row)
+            row["version"] += 1
+            version = row["version"]
+        self._send_json(200, version)
+
+
+def serve(port: int, latency_ms: float = 0.0):
+    """Start the fake in a background thread and return the server."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeSupabaseHandler)
+    server.daemon_threads = True
+    server.tables = load_seed_tables()
+    server.lock = threading.Lock()
+    server.latency = latency_ms / 1000
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Supabase/PostgREST server")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument(
+        "--latency-ms", type=float, default=20.0, help="Delay added to each query"
+    )
+    args = parser.parse_args()
+
+    server = serve(args.port, args.latency_ms)
+    print(f"Fake Supabase listening on http://127.0.0.1:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from cache hits up to slow LLM completions
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+# Directory the worker processes of one server share their metrics through
+# (gunicorn.conf.py sets it). Each process writes a snapshot of its own metrics
+# there and /metrics adds up the snapshots of every process, so a scrape sees
+# the whole server whichever worker answers it. Unset, /metrics shows only the
+# process that serves it.
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR")
+
+# How often in seconds each process refreshes its snapshot
+METRICS_SYNC_INTERVAL = float(os.getenv("METRICS_SYNC_INTERVAL", "1"))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{value}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # sorted label tuple -> [bucket counts..., count, sum]
+        self._series = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            return {key: list(series) for key, series in self._series.items()}
+
+    @staticmethod
+    def merge(total, series):
+        return [a + b for a, b in zip(total, series)] if total else series
+
+    def render(self, samples=None):
+        if samples is None:
+            samples = self.samples()
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for key, series in sorted(samples.items()):
+            for bound, count in zip(self.buckets, series):
+                labels = _format_labels(key + (("le", bound),))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(key + (("le", "+Inf"),))
+            lines.append(f"{self.name}_bucket{labels} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-2]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter, one series per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return dict(self._series)
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+
+    def render(self, samples=None):
+        if samples is None:
+            samples = self.samples()
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for key, value in sorted(samples.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class CallbackMetric(Counter):
+    """
+    Gauge or counter read from a callback at scrape time.
+
+    Across processes, counters are added up and gauges are reported for each
+    process with a pid label.
+    """
+
+    def __init__(self, name: str, help_text: str, read, kind: str = "gauge"):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        self.kind = kind
+
+    def samples(self):
+        try:
+            return {(): self.read()}
+        except Exception:
+            return {}
+
+    def render(self, samples=None):
+        if samples is None:
+            samples = self.samples()
+        return super().render(samples) if samples else []
+
+
+class MetricsRegistry:
+    """
+    Holds the process's metrics and renders them in Prometheus text format.
+
+    With a multiprocess directory, each process writes its samples to
+    metrics_<pid>.json there (every sync_interval seconds once start_sync is
+    called, and on each render), and render adds up the files of all
+    processes. Files of exited processes are kept so counters never go
+    backwards, but their gauges are dropped by mark_process_dead.
+    """
+
+    def __init__(self, multiproc_dir=None, sync_interval: float = 1.0):
+        self.multiproc_dir = multiproc_dir
+        self.sync_interval = sync_interval
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._sync_pid = None
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, buckets))
+
+    def counter(self, name, help_text) -> Counter:
+        return self._register(Counter(name, help_text))
+
+    def gauge(self, name, help_text, read) -> CallbackMetric:
+        return self._register(CallbackMetric(name, help_text, read, "gauge"))
+
+    def counter_callback(self, name, help_text, read) -> CallbackMetric:
+        return self._register(CallbackMetric(name, help_text, read, "counter"))
+
+    def _metrics_by_name(self):
+        with self._lock:
+            return dict(self._metrics)
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.multiproc_dir, f"metrics_{pid}.json")
+
+    def _write(self, pid, snapshot):
+        path = self._snapshot_path(pid)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(snapshot, f)
+        os.replace(f"{path}.tmp", path)
+
+    def write_snapshot(self):
+        """Write this process's samples to the multiprocess directory."""
+        snapshot = {
+            name: {
+                "kind": metric.kind,
+                "samples": [[list(key), v] for key, v in metric.samples().items()],
+            }
+            for name, metric in self._metrics_by_name().items()
+        }
+        self._write(os.getpid(), snapshot)
+
+    def start_sync(self):
+        """Refresh this process's snapshot in the background, once per process."""
+        if not self.multiproc_dir or self._sync_pid == os.getpid():
+            return
+        self._sync_pid = os.getpid()
+
+        def sync():
+            while True:
+                try:
+                    self.write_snapshot()
+                except Exception as e:
+                    logger.warning(f"Could not write metrics snapshot: {e}")
+                time.sleep(self.sync_interval)
+
+        threading.Thread(target=sync, name="metrics-sync", daemon=True).start()
+
+    def mark_process_dead(self, pid: int):
+        """Drop the gauges of an exited process, keeping its counts."""
+        try:
+            with open(self._snapshot_path(pid)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._write(
+            pid,
+            {
+                name: entry
+                for name, entry in snapshot.items()
+                if entry["kind"] != "gauge"
+            },
+        )
+
+    def _combined_samples(self, metrics):
+        """Samples of every process, by metric name."""
+        self.write_snapshot()
+        combined = {name: {} for name in metrics}
+        for file_name in sorted(os.listdir(self.multiproc_dir)):
+            if not (file_name.startswith("metrics_") and file_name.endswith(".json")):
+                continue
+            pid = file_name[len("metrics_") : -len(".json")]
+            try:
+                with open(os.path.join(self.multiproc_dir, file_name)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, entry in snapshot.items():
+                if name not in metrics:
+                    continue
+                metric, merged = metrics[name], combined[name]
+                for key, value in entry["samples"]:
+                    key = tuple(tuple(pair) for pair in key)
+                    if metric.kind == "gauge":
+                        merged[key + (("pid", pid),)] = value
+                    else:
+                        merged[key] = metric.merge(merged.get(key), value)
+        return combined
+
+    def render(self) -> str:
+        metrics = self._metrics_by_name()
+        combined = self._combined_samples(metrics) if self.multiproc_dir else {}
+        lines = []
+        for name, metric in metrics.items():
+            lines.extend(metric.render(combined.get(name)))
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry scraped at /metrics
+registry = MetricsRegistry(METRICS_MULTIPROC_DIR, METRICS_SYNC_INTERVAL)
+
+# Content type for the Prometheus text exposition format
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+chat_stage_seconds = registry.histogram(
+    "demeter_chat_stage_seconds", "Latency of each /rag-query stage in seconds"
+)
+http_request_seconds = registry.histogram(
+    "demeter_http_request_seconds", "Latency of API requests in seconds by route"
+)
+
+# Prompt sizes, from a short first turn up to the full context budget
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+prompt_tokens = registry.histogram(
+    "demeter_prompt_tokens",
+    "Tokens sent to the LLM per chat request by prompt part",
+    TOKEN_BUCKETS,
+)
+
+embedding_batch_size = registry.histogram(
+    "demeter_embedding_batch_size",
+    "Queries embedded per encode call",
+    (1, 2, 4, 8, 16, 32, 64),
+)
+
+image_preprocess_seconds = registry.histogram(
+    "demeter_image_preprocess_seconds", "Time spent resizing one chat image"
+)
+image_bytes_in = registry.counter(
+    "demeter_image_bytes_in_total", "Size of chat image data URLs before preprocessing"
+)
+image_bytes_saved = registry.counter(
+    "demeter_image_bytes_saved_total",
+    "Bytes removed from chat image data URLs by preprocessing",
+)
+
+# Sub-millisecond latencies of in-memory index lookups
+FAST_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+
+rag_fusion_seconds = registry.histogram(
+    "demeter_rag_fusion_seconds",
+    "Time spent on BM25 search and rank fusion per retrieval",
+    FAST_BUCKETS,
+)
+rag_mmr_seconds = registry.histogram(
+    "demeter_rag_mmr_seconds",
+    "Time spent re-ranking retrieved chunks with maximal marginal relevance",
+    FAST_BUCKETS,
+)
+rag_route_seconds = registry.histogram(
+    "demeter_rag_route_seconds",
+    "Time spent picking the knowledge base shards to search per retrieval",
+    FAST_BUCKETS,
+)
+
+
+class RequestTimings:
+    """
+    Per-request stage timer that also feeds the chat stage histogram.
+
+    Stage durations are kept in order, so they can be returned to the client as a
+    Server-Timing header or an SSE timing event.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        chat_stage_seconds.observe(seconds, stage=name)
+
+    def as_dict(self):
+        """Stage durations in milliseconds."""
+        return {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()}
+
+    def server_timing_header(self) -> str:
+        return ", ".join(
+            f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages.items()
+        )
+
+
+# Fraction of chat requests whose retrieval and realtime data are logged
+LOG_SAMPLE_RATE = float(os.getenv("CHAT_LOG_SAMPLE_RATE", "0.01"))
+
+chat_logger = logging.getLogger("demeter.chat")
+
+
+def log_sampled(event: str, **fields):
+    """Log a structured JSON event for a sample of requests."""
+    if LOG_SAMPLE_RATE <= 0 or random.random() >= LOG_SAMPLE_RATE:
+        return
+    if not chat_logger.isEnabledFor(logging.INFO):
+        return
+    chat_logger.info(json.dumps({"event": event, **fields}, default=str))
@@ -0,0 +1,138 @@
+import re
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+# Signature length; the Jaccard estimate's standard error is about 1/sqrt(NUM_PERM)
+NUM_PERM = 128
+
+# LSH bands of NUM_PERM // LSH_BANDS rows each. With 16 bands of 8 rows, pairs
+# with Jaccard similarity 0.8 share a band 95% of the time, pairs at 0.5 6%
+# of the time and dissimilar pairs almost never.
+LSH_BANDS = 16
+
+# Chunks are compared as sets of overlapping 3-word shingles
+SHINGLE_WORDS = 3
+
+# Jaccard similarity above which a chunk counts as a near-duplicate
+NEAR_DUPLICATE_THRESHOLD = 0.8
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Multiply-shift hash functions, fixed so signatures are comparable across runs
+_rng = np.random.default_rng(20240501)
+_HASH_A = _rng.integers(1, 2**64, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_HASH_B = _rng.integers(0, 2**64, NUM_PERM, dtype=np.uint64)
+
+
+def shingles(text: str, k: int = SHINGLE_WORDS):
+    """Hashes of the overlapping k-word shingles of a text, lowercased."""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < k:
+        words = words + [""] * (k - len(words))
+    return np.array(
+        [
+            zlib.crc32(" ".join(words[i : i + k]).encode("utf-8"))
+            for i in range(len(words) - k + 1)
+        ],
+        dtype=np.uint64,
+    )
+
+
+def minhash(text: str):
+    """MinHash signature of a text's shingle set, NUM_PERM uint32 values."""
+    x = shingles(text)
+    with np.errstate(over="ignore"):
+        hashes = (_HASH_A[:, None] * x[None, :] + _HASH_B[:, None]) >> np.uint64(32)
+    return hashes.min(axis=1).astype(np.uint32)
+
+
+class NearDuplicateIndex:
+    """
+    Locality-sensitive hashing index over MinHash signatures.
+
+    Each signature is cut into LSH_BANDS bands, and chunks sharing any band
+    are candidates; a candidate is a near-duplicate if the fraction of equal
+    signature values (the Jaccard similarity estimate) reaches the
+    threshold. Finding a chunk's near-duplicates costs a few dictionary
+    lookups, however many chunks are indexed.
+
+    Chunks can be labelled with a group (their knowledge base shard), and
+    only chunks in the same group are compared, so a chunk is never dropped
+    in favour of a copy that searches of its own shard cannot reach.
+    """
+
+    def __init__(self, threshold: float = NEAR_DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self.signatures = {}
+        self.groups = {}
+        self._buckets = [{} for _ in range(LSH_BANDS)]
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def _bands(self, signature, group):
+        return [(group, band.tobytes()) for band in np.split(signature, LSH_BANDS)]
+
+    def add(self, key: str, signature, group: str = ""):
+        self.remove(key)
+        self.signatures[key] = signature
+        self.groups[key] = group
+        for bucket, band in zip(self._buckets, self._bands(signature, group)):
+            bucket.setdefault(band, set()).add(key)
+
+    def remove(self, key: str):
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        group = self.groups.pop(key)
+        for bucket, band in zip(self._buckets, self._bands(signature, group)):
+            keys = bucket[band]
+            keys.discard(key)
+            if not keys:
+                del bucket[band]
+
+    def query(self, signature, group: str = ""):
+        """
+        The most similar indexed chunk of the group, if it is a near-duplicate.
+
+        Returns:
+            (key, estimated Jaccard similarity), or None
+        """
+        candidates = set()
+        for bucket, band in zip(self._buckets, self._bands(signature, group)):
+            candidates.update(bucket.get(band, ()))
+        best = None
+        for key in candidates:
+            similarity = float(np.mean(self.signatures[key] == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (key, similarity)
+        return best
+
+    def save(self, path):
+        keys = sorted(self.signatures)
+        signatures = (
+            np.stack([self.signatures[k] for k in keys])
+            if keys
+            else np.zeros((0, NUM_PERM), dtype=np.uint32)
+        )
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                keys=np.array(keys, dtype=str),
+                groups=np.array([self.groups[k] for k in keys], dtype=str),
+                signatures=signatures,
+            )
+
+    @classmethod
+    def load(cls, path, threshold: float = NEAR_DUPLICATE_THRESHOLD):
+        """Load a saved index, or an empty one if there is none at path."""
+        index = cls(threshold)
+        if Path(path).exists():
+            with np.load(path) as saved:
+                for key, group, signature in zip(
+                    saved["keys"], saved["groups"], saved["signatures"]
+                ):
+                    index.add(str(key), signature, str(group))
+        return index
@@ -1,61 +1,260 @@
+# Chunk, embed and index the static knowledge base into Chroma and the BM25
+# index. New and changed files stream through three stages: a process pool
+# reads, hashes and sentence-splits files (--workers); the main thread embeds
+# and chunks them one file at a time; and a writer thread upserts the chunks.
+# Embedding is the expensive stage. On the ONNX backends its batches run on
+# --encode-workers sessions at once, each with a share of the cores. With
+# sentence-transformers one PyTorch model embeds each batch, spreading it over
+# every core itself.
+#
+# Run from the server directory:
+#     python populate_vector_db.py [--full]
+
+import argparse
 import chromadb
-from chromadb.utils import embedding_functions
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+from embedding_backends import EMBEDDING_BACKEND, EMBEDDING_MODEL, OnnxEncodePool, OnnxMiniLMEmbedding, collection_embedding_function, create_embedding_function, encode_texts
+from kb_router import SHARD_COLLECTION_PREFIX, shard_for_source
+from lexical_index import BM25Builder
+from near_duplicates import NEAR_DUPLICATE_THRESHOLD, NearDuplicateIndex, minhash
+import hashlib
+import json
 import numpy as np
+import os
+import queue
 import re
+import threading
+import time
+
+# BM25 index over the same chunks, loaded by the server for hybrid retrieval
+LEXICAL_INDEX_PATH = Path(os.getenv("LEXICAL_INDEX_PATH", "./bm25_index"))
+
+# Texts per forward pass of the embedding model
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+
+# ONNX sessions embedding batches concurrently (default: one per two cores)
+INGEST_ENCODE_WORKERS = int(os.getenv("INGEST_ENCODE_WORKERS", str(max(1, (os.cpu_count() or 1) // 2))))
+
+# Chunks per Chroma write, and write batches queued ahead of the writer
+INGEST_WRITE_BATCH_SIZE = int(os.getenv("INGEST_WRITE_BATCH_SIZE", "256"))
+WRITE_QUEUE_BATCHES = 4
+
+# Files read and split ahead of the embedding stage
+SPLIT_AHEAD = 4
+
+# Content hashes of the files and chunks already indexed, so a run only
+# re-embeds what changed. Kept next to the collection it describes.
+INGEST_MANIFEST_PATH = Path(os.getenv("INGEST_MANIFEST_PATH", "./chroma_db/ingest_manifest.json"))
+
+# Chunking parameters; changing them (or the embedding model) invalidates the manifest.
+# SEMANTIC_CHUNK_WINDOW > 1 compares the sentences on either side of a boundary
+# in windows of that many, so a single off-topic sentence does not split a chunk.
+CHUNKING = {
+    "similarity_threshold": 0.5, "min_chunk_size": 100, "max_chunk_size": 1500,
+    "window": int(os.getenv("SEMANTIC_CHUNK_WINDOW", "1"))
+}
+
+# How chunk vectors are made: "encode" embeds each chunk's text in a second
+# batched pass; "pooled" averages the sentence embeddings already computed for
+# chunking, skipping that pass. Also part of the manifest's settings.
+CHUNK_VECTORS = os.getenv("INGEST_CHUNK_VECTORS", "encode")
+
+# Chunks whose word shingles overlap an indexed chunk's of the same shard at
+# least this much (MinHash estimate of Jaccard similarity) are dropped before
+# embedding, so overlapping manuals do not fill results with the same text;
+# 0 disables. Only the same shard counts, since routed queries search only
+# their shards. Also part of the manifest's settings.
+DEDUP_THRESHOLD = float(os.getenv("INGEST_DEDUP_THRESHOLD", str(NEAR_DUPLICATE_THRESHOLD)))
+
+# MinHash signatures of the indexed chunks, kept next to the manifest
+SIGNATURES_PATH = INGEST_MANIFEST_PATH.with_name("ingest_minhash.npz")
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_id(source: str, idx: int) -> str:
+    return f"doc_{Path(source).stem}_chunk_{idx}"
+
+
+def index_settings():
+    """Settings that determine the chunks and their vectors."""
+    return {
+        "embedding_model": EMBEDDING_MODEL, "embedding_backend": EMBEDDING_BACKEND,
+        "chunk_vectors": CHUNK_VECTORS, "dedup_threshold": DEDUP_THRESHOLD,
+        "dedup_scope": "shard", **CHUNKING
+    }
+
+
+def indexed_chunks(entry):
+    """Indices of a manifest entry's chunks that are in the collection, not dropped as near-duplicates."""
+    duplicates = entry.get("duplicates", {})
+    return [idx for idx in range(len(entry["chunks"])) if str(idx) not in duplicates]
+
+
+def load_manifest(path: Path):
+    """
+    Read the manifest written by the last run.
+
+    Returns:
+        Dict of file name -> {"sha256", "stat": [size, mtime_ns], "shard",
+        "chunks": [chunk hash, ...], "duplicates"}, or None if there is no
+        usable manifest and everything must be re-indexed
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable manifest {path}: {e}")
+        return None
+
+    if manifest.get("settings") != index_settings():
+        print("Embedding or chunking settings changed since the last run")
+        return None
+    return manifest["files"]
+
+
+def save_manifest(path: Path, files):
+    """Write the manifest atomically, so an interrupted run leaves the old one."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"settings": index_settings(), "files": files}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
 
-client = chromadb.PersistentClient(path="./chroma_db")
 
-embedding = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name="all-MiniLM-L6-v2"
-)
+def split_sentences(text: str):
+    """Split text into sentences at ., ! and ? followed by whitespace."""
+    sentences = re.split(r'(?<=[.!?])\s+', text)
+    return [s.strip() for s in sentences if s.strip()]
+
+
+def file_stat(path):
+    """Size and modification time of a file, recorded to skip unchanged files."""
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def read_content(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+
+def file_hash(path):
+    """Content hash of one file; runs in the worker processes."""
+    return content_hash(read_content(path))
+
+
+def read_sentences(path):
+    """Read, hash and split one file; runs in the split worker processes."""
+    content = read_content(path)
+    return content_hash(content), split_sentences(content)
+
+
+def split_files(paths, workers: int):
+    """
+    Read and split files in a process pool.
+
+    Yields (path, content hash, sentences) in the order of paths. At most
+    SPLIT_AHEAD files are in flight, so memory does not grow with the
+    number of files.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for path in paths:
+            pending.append((path, pool.submit(read_sentences, path)))
+            if len(pending) >= SPLIT_AHEAD:
+                path, future = pending.popleft()
+                yield (path, *future.result())
+        while pending:
+            path, future = pending.popleft()
+            yield (path, *future.result())
 
-collection = client.get_or_create_collection(
-    name="static_knowledge_base",
-    embedding_function=embedding,
-    metadata={"description": "A collection using all-MiniLM-L6-v2 embeddings"}
-)
 
-print(f"Collection created: {collection.name}")
-print(f"Collection count before: {collection.count()}")
+def encode_by_length(embedding, texts, batch_size: int):
+    """
+    Embed texts in batches, longest first, so each batch holds texts of
+    similar length and little of every forward pass is spent on padding.
+
+    Returns:
+        Array of embeddings in the order of texts
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    vectors = encode_texts(embedding, [texts[i] for i in order], batch_size)
+    result = np.empty_like(vectors)
+    result[order] = vectors
+    return result
+
+
+def boundary_similarities(embeddings, window: int = 1):
+    """
+    Cosine similarity across each boundary between consecutive sentences.
 
-def semantic_chunking(text: str, similarity_threshold: float = 0.5, min_chunk_size: int = 100, max_chunk_size: int = 1500):
+    Boundary i lies between sentences i and i + 1. With window 1 it is the
+    similarity of those two sentences; with a larger window, of the sum of
+    up to `window` sentences on each side. All boundaries are computed at
+    once as a row-wise dot product of normalized matrices; a larger window
+    adds one vectorized addition per extra sentence, not a Python loop.
+
+    Returns:
+        Array of len(embeddings) - 1 similarities
     """
-    Split text into semantically coherent chunks based on sentence similarity.
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    n, dim = vectors.shape
+    if window > 1:
+        # sums[j] is the sum of `window` sentences ending at sentence j,
+        # counting the padding before the first and after the last as zeros
+        padding = np.zeros((window - 1, dim), dtype=np.float32)
+        padded = np.concatenate([padding, vectors, padding])
+        sums = padded[:n + window - 1].copy()
+        for k in range(1, window):
+            sums += padded[k:n + window - 1 + k]
+        left, right = sums[:n - 1], sums[window:n + window - 1]
+        left = left / np.clip(np.linalg.norm(left, axis=1, keepdims=True), 1e-12, None)
+        right = right / np.clip(np.linalg.norm(right, axis=1, keepdims=True), 1e-12, None)
+    else:
+        left, right = vectors[:-1], vectors[1:]
+    return np.einsum("ij,ij->i", left, right)
+
+
+def pool_sentence_embeddings(embeddings):
+    """Chunk vector from its sentences: the normalized mean of their normalized embeddings."""
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    pooled = vectors.mean(axis=0)
+    return pooled / max(float(np.linalg.norm(pooled)), 1e-12)
+
+
+def semantic_chunk_spans(sentences, embeddings, similarity_threshold: float = 0.5, min_chunk_size: int = 100, max_chunk_size: int = 1500, window: int = 1):
+    """
+    Group sentences into semantically coherent chunks based on sentence similarity.
 
     Args:
-        text: Input text to chunk
+        sentences: Sentences of one document, in order
+        embeddings: Embedding of each sentence
         similarity_threshold: Threshold for semantic similarity (0-1). Lower = more chunks
         min_chunk_size: Minimum characters per chunk
         max_chunk_size: Maximum characters per chunk
+        window: Sentences compared on each side of a boundary
 
     Returns:
-        List of text chunks
+        List of (start, end) sentence index ranges, one per chunk
     """
-    # Initialize sentence transformer model
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-
-    # Split into sentences
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    sentences = [s.strip() for s in sentences if s.strip()]
-
     if len(sentences) <= 1:
-        return [text]
-
-    # Get embeddings for each sentence
-    embeddings = model.encode(sentences)
+        return [(0, len(sentences))] if sentences else []
 
     # Calculate similarity between consecutive sentences
-    similarities = []
-    for i in range(len(embeddings) - 1):
-        sim = cosine_similarity([embeddings[i]], [embeddings[i + 1]])[0][0]
-        similarities.append(sim)
+    similarities = boundary_similarities(embeddings, window).tolist()
 
     # Find split points where similarity drops below threshold
-    chunks = []
-    current_chunk = [sentences[0]]
+    spans = []
+    start = 0
     current_length = len(sentences[0])
 
     for i, sentence in enumerate(sentences[1:]):
@@ -73,57 +272,410 @@ def semantic_chunking(text: str, similarity_threshold: float = 0.5, min_chunk_si
 
         if should_split:
             # Save current chunk and start new one
-            chunks.append(' '.join(current_chunk))
-            current_chunk = [sentence]
+            spans.append((start, i + 1))
+            start = i + 1
             current_length = sentence_length
         else:
             # Add to current chunk
-            current_chunk.append(sentence)
             current_length += sentence_length + 1  # +1 for space
 
     # Add the last chunk
-    if current_chunk:
-        chunks.append(' '.join(current_chunk))
+    spans.append((start, len(sentences)))
+
+    return spans
+
+
+def semantic_chunking(sentences, embeddings, **kwargs):
+    """Text of each chunk found by semantic_chunk_spans."""
+    return [' '.join(sentences[start:end]) for start, end in semantic_chunk_spans(sentences, embeddings, **kwargs)]
+
+
+class ChunkWriter:
+    """
+    Writes chunks to the collection and their shard collections.
+
+    Chunks are written from a background thread in batches of batch_size,
+    behind a queue of at most WRITE_QUEUE_BATCHES batches, so the embedding
+    stage keeps running while Chroma writes and blocks rather than
+    buffering the library when Chroma falls behind.
+    """
+
+    def __init__(self, client, collection, embedding, batch_size: int):
+        self.client = client
+        self.collection = collection
+        self.embedding = embedding
+        self.batch_size = min(batch_size, client.get_max_batch_size())
+        self.written = 0
+        self._batch = []
+        self._shards = {}
+        self._error = None
+        self._queue = queue.Queue(maxsize=WRITE_QUEUE_BATCHES)
+        self._thread = threading.Thread(target=self._run, name="chunk-writer", daemon=True)
+        self._thread.start()
 
-    return chunks
+    def add(self, chunk_id, document, embedding, metadata):
+        self._batch.append((chunk_id, document, embedding, metadata))
+        if len(self._batch) >= self.batch_size:
+            self._flush()
 
-knowledge_base_path = Path("./static_knowledge_base")
-documents = []
-ids = []
-metadatas = []
+    def close(self):
+        """Write the remaining chunks and wait for the writer to finish."""
+        if self._batch:
+            self._flush()
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
 
-if knowledge_base_path.exists() and knowledge_base_path.is_dir():
-    for text_file in knowledge_base_path.glob("*.txt"):
-        with open(text_file, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-            if content:
-                # Chunk the content using semantic chunking
-                chunks = semantic_chunking(content, similarity_threshold=0.5)
+    def shard_collection(self, shard: str):
+        if shard not in self._shards:
+            self._shards[shard] = self.client.get_or_create_collection(
+                name=f"{SHARD_COLLECTION_PREFIX}{shard}",
+                embedding_function=collection_embedding_function(self.embedding),
+                metadata={"description": f"Knowledge base shard: {shard}"}
+            )
+        return self._shards[shard]
+
+    def _flush(self):
+        self._raise_error()
+        self._queue.put(self._batch)
+        self._batch = []
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise RuntimeError("Writing chunks to Chroma failed") from self._error
+
+    def _run(self):
+        while (batch := self._queue.get()) is not None:
+            # After a failure, keep draining so the embedding stage never blocks
+            if self._error is not None:
+                continue
+            try:
+                self._write(batch)
+            except Exception as e:
+                self._error = e
+
+    def _write(self, batch):
+        ids, documents, embeddings, metadatas = (list(column) for column in zip(*batch))
+        self.collection.upsert(ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
+
+        # Each shard collection holds a copy of its chunks, so routed queries
+        # search only the vectors of the shards they need
+        shards = [m["shard"] for m in metadatas]
+        for shard in sorted(set(shards)):
+            members = [i for i, s in enumerate(shards) if s == shard]
+            self.shard_collection(shard).upsert(
+                ids=[ids[i] for i in members],
+                documents=[documents[i] for i in members],
+                embeddings=[embeddings[i] for i in members],
+                metadatas=[metadatas[i] for i in members]
+            )
+        self.written += len(ids)
+
+
+def collection_pages(collection, page_size: int, include):
+    """Yield the collection's records a page at a time, so no step holds them all."""
+    offset = 0
+    while True:
+        page = collection.get(include=include, limit=page_size, offset=offset)
+        if not page["ids"]:
+            return
+        yield page
+        offset += len(page["ids"])
+
+
+def build_lexical_index(collection, page_size: int):
+    """Rebuild the BM25 index over every chunk in the collection, a page at a time."""
+    builder = BM25Builder()
+    for page in collection_pages(collection, page_size, ["documents", "metadatas"]):
+        shards = [m.get("shard") or shard_for_source(m["source"]) for m in page["metadatas"]]
+        builder.add(page["ids"], page["documents"], groups=shards)
+    lexical_index = builder.build()
+    lexical_index.save(LEXICAL_INDEX_PATH)
+    print(f"Built BM25 index of {len(lexical_index.doc_ids)} chunks "
+          f"({len(lexical_index.vocabulary)} terms) in {LEXICAL_INDEX_PATH}")
+
+
+def stored_vectors(collection, stored_ids, hashes):
+    """
+    Stored vectors for chunk texts already in the collection, by chunk hash.
+
+    The manifest says which id held each text when it was written; a text
+    is only reused if that id still holds it, since this run may have
+    rewritten the id since.
+    """
+    wanted = {h: stored_ids[h] for h in hashes if h in stored_ids}
+    if not wanted:
+        return {}
+    stored = collection.get(ids=sorted(set(wanted.values())), include=["documents", "embeddings"])
+    by_hash = {
+        content_hash(document): vector
+        for document, vector in zip(stored["documents"], stored["embeddings"])
+    }
+    return {h: by_hash[h] for h in wanted if h in by_hash}
 
-                # Add each chunk as a separate document
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunk, embed and index the static knowledge base")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE,
+                        help="Texts per forward pass of the embedding model")
+    parser.add_argument("--write-batch-size", type=int, default=INGEST_WRITE_BATCH_SIZE,
+                        help="Chunks per Chroma write")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Processes reading and splitting files")
+    parser.add_argument("--encode-workers", type=int, default=INGEST_ENCODE_WORKERS,
+                        help="ONNX sessions embedding batches concurrently")
+    parser.add_argument("--full", action="store_true",
+                        help="Ignore the manifest and re-index every file")
+    args = parser.parse_args()
+    if CHUNK_VECTORS not in ("encode", "pooled"):
+        raise ValueError(f"Unknown INGEST_CHUNK_VECTORS: {CHUNK_VECTORS}")
+    started = time.perf_counter()
+
+    client = chromadb.PersistentClient(path="./chroma_db")
+
+    # Same model and backend (EMBEDDING_BACKEND) the server queries with,
+    # loaded once for every file
+    embedding = create_embedding_function()
+
+    collection = client.get_or_create_collection(
+        name="static_knowledge_base",
+        embedding_function=collection_embedding_function(embedding),
+        metadata={"description": f"A collection using {EMBEDDING_MODEL} embeddings"}
+    )
+
+    print(f"Collection: {collection.name}")
+    print(f"Collection count before: {collection.count()}")
+
+    knowledge_base_path = Path("./static_knowledge_base")
+    if not (knowledge_base_path.exists() and knowledge_base_path.is_dir()):
+        print(f"Directory {knowledge_base_path} does not exist")
+        return
+
+    # Without a manifest nothing is known about the collection, so every
+    # file is re-indexed and chunks no file produced any more are dropped
+    indexed = None if args.full else load_manifest(INGEST_MANIFEST_PATH)
+    if indexed is not None and DEDUP_THRESHOLD > 0 and not SIGNATURES_PATH.exists():
+        print(f"No near-duplicate signatures at {SIGNATURES_PATH}")
+        indexed = None
+    rebuild = indexed is None
+    indexed = indexed or {}
+    near_duplicates = (
+        NearDuplicateIndex(DEDUP_THRESHOLD) if rebuild
+        else NearDuplicateIndex.load(SIGNATURES_PATH, DEDUP_THRESHOLD)
+    )
+
+    # A file whose size and modification time match the manifest is taken as
+    # unchanged without being read. Any other file is read once, by a split
+    # worker, which hashes the text it splits. Entries from before the stats
+    # were recorded are compared by hash instead, read in the worker pool.
+    current = {}
+    for text_file in sorted(knowledge_base_path.glob("*.txt")):
+        stat = file_stat(text_file)
+        if stat[0]:
+            current[text_file.name] = (text_file, stat)
+    unstated = [
+        name for name in current if not rebuild and name in indexed and "stat" not in indexed[name]
+    ]
+    if unstated:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            hashes = dict(zip(unstated, pool.map(file_hash, [current[name][0] for name in unstated])))
+        for name in unstated:
+            if hashes[name] == indexed[name]["sha256"]:
+                indexed[name]["stat"] = current[name][1]
+
+    changed = [
+        name for name, (_, stat) in current.items()
+        if rebuild or name not in indexed or indexed[name].get("stat") != stat
+        or indexed[name]["shard"] != shard_for_source(name)
+    ]
+    removed = [name for name in indexed if name not in current]
+
+    # A chunk dropped as a near-duplicate of one that is about to be rewritten
+    # or removed may now be the only copy, so its file is re-indexed too
+    affected = set(changed) | set(removed)
+    while True:
+        affected_ids = {
+            chunk_id(name, idx) for name in affected if name in indexed
+            for idx in range(len(indexed[name]["chunks"]))
+        }
+        dependents = {
+            name for name in current if name not in affected and name in indexed
+            and any(kept in affected_ids for kept in indexed[name].get("duplicates", {}).values())
+        }
+        if not dependents:
+            break
+        affected |= dependents
+    changed = [name for name in current if name in affected]
+    for name in affected:
+        for idx in range(len(indexed.get(name, {"chunks": []})["chunks"])):
+            near_duplicates.remove(chunk_id(name, idx))
+
+    print(f"Found {len(current)} text files in {knowledge_base_path}: "
+          f"{len(changed)} new or changed, {len(removed)} removed")
+
+    manifest = {name: entry for name, entry in indexed.items() if name in current}
+    if not changed and not removed:
+        if not LEXICAL_INDEX_PATH.exists():
+            build_lexical_index(collection, args.write_batch_size)
+        if unstated:
+            save_manifest(INGEST_MANIFEST_PATH, manifest)
+        print(f"Index is up to date ({time.perf_counter() - started:.1f}s)")
+        return
+
+    if rebuild:
+        for c in client.list_collections():
+            name = c.name if hasattr(c, "name") else c
+            if name.startswith(SHARD_COLLECTION_PREFIX):
+                client.delete_collection(name)
+
+    # Chunks to delete once everything is written, by shard. Deleting last
+    # keeps the stored vectors of removed files available for reuse.
+    deleted = {}
+    for name in removed:
+        old = indexed[name]
+        deleted.setdefault(old["shard"], set()).update(chunk_id(name, idx) for idx in indexed_chunks(old))
+
+    # A chunk whose text is already stored (under this id or another) keeps
+    # its stored vector; only new text is embedded
+    stored_ids = {}
+    for name, entry in indexed.items():
+        for idx in indexed_chunks(entry):
+            stored_ids.setdefault(entry["chunks"][idx], chunk_id(name, idx))
+
+    # Read and split files in worker processes, embed and chunk them here
+    # (spread over several ONNX sessions), and write their chunks from the
+    # writer thread
+    encoder = (
+        OnnxEncodePool(embedding, args.encode_workers)
+        if isinstance(embedding, OnnxMiniLMEmbedding) and args.encode_workers > 1 else embedding
+    )
+    writer = ChunkWriter(client, collection, embedding, args.write_batch_size)
+    n_sentences = n_reused = n_embedded = n_duplicates = 0
+    encode_seconds = 0.0
+    paths = [current[name][0] for name in changed]
+    try:
+        for done, (text_file, sha, sentences) in enumerate(split_files(paths, args.workers), 1):
+            name = text_file.name
+            shard = shard_for_source(name)
+            # A file of only whitespace has no sentences, and so no chunks
+            sentence_embeddings = encode_by_length(encoder, sentences, args.batch_size) if sentences else None
+            spans = semantic_chunk_spans(sentences, sentence_embeddings, **CHUNKING)
+            chunks = [' '.join(sentences[start:end]) for start, end in spans]
+            chunk_hashes = [content_hash(chunk) for chunk in chunks]
+
+            # Drop near-duplicates of chunks already indexed, before they are embedded
+            duplicates = {}
+            if DEDUP_THRESHOLD > 0:
                 for idx, chunk in enumerate(chunks):
-                    documents.append(chunk)
-                    ids.append(f"doc_{text_file.stem}_chunk_{idx}")
-                    metadatas.append({
-                        "source": str(text_file.name),
-                        "path": str(text_file),
-                        "chunk_index": idx,
-                        "total_chunks": len(chunks)
-                    })
-
-    print(f"Found {len(set([m['source'] for m in metadatas]))} text files in {knowledge_base_path}")
-    print(f"Created {len(documents)} chunks from all files")
-
-    # Add documents to the collection
-    if documents:
-        collection.add(
-            documents=documents,
-            ids=ids,
-            metadatas=metadatas
-        )
-        print(f"Added {len(documents)} documents to the collection")
-        print(f"Collection count after: {collection.count()}")
-    else:
-        print("No documents found to add")
-else:
-    print(f"Directory {knowledge_base_path} does not exist")
\ No newline at end of file
+                    signature = minhash(chunk)
+                    match = near_duplicates.query(signature, shard)
+                    if match is None:
+                        near_duplicates.add(chunk_id(name, idx), signature, shard)
+                    else:
+                        duplicates[str(idx)] = match[0]
+
+            # Chunk ids are positional, so a chunk is rewritten when its text or
+            # its file's chunk count (stored in every chunk's metadata) changed
+            old = indexed.get(name)
+            unchanged = (
+                old is not None and old["shard"] == shard and len(old["chunks"]) == len(chunks)
+            )
+            previously_stored = set(indexed_chunks(old)) if unchanged else set()
+            written = [
+                idx for idx in range(len(chunks))
+                if str(idx) not in duplicates and not (idx in previously_stored and old["chunks"][idx] == chunk_hashes[idx])
+            ]
+            n_duplicates += sum(
+                not (unchanged and old["chunks"][int(idx)] == chunk_hashes[int(idx)]) for idx in duplicates
+            )
+            reused = stored_vectors(collection, stored_ids, [chunk_hashes[idx] for idx in written])
+            vectors = {idx: reused[chunk_hashes[idx]] for idx in written if chunk_hashes[idx] in reused}
+            to_embed = [idx for idx in written if idx not in vectors]
+            if CHUNK_VECTORS == "pooled":
+                for idx in to_embed:
+                    start, end = spans[idx]
+                    vectors[idx] = pool_sentence_embeddings(sentence_embeddings[start:end])
+            elif to_embed:
+                encode_started = time.perf_counter()
+                encoded = encode_by_length(encoder, [chunks[idx] for idx in to_embed], args.batch_size)
+                encode_seconds += time.perf_counter() - encode_started
+                vectors.update(zip(to_embed, encoded))
+
+            for idx in written:
+                writer.add(chunk_id(name, idx), chunks[idx], vectors[idx], {
+                    "source": str(name),
+                    "path": str(text_file),
+                    "chunk_index": idx,
+                    "total_chunks": len(chunks),
+                    "shard": shard
+                })
+
+            # Only chunks the last run stored need deleting: those of the old
+            # shard if the file moved, trailing ones, and new near-duplicates
+            if old is not None:
+                old_stored = set(indexed_chunks(old))
+                if old["shard"] != shard:
+                    deleted.setdefault(old["shard"], set()).update(chunk_id(name, idx) for idx in old_stored)
+                deleted.setdefault(shard, set()).update(
+                    chunk_id(name, idx) for idx in old_stored
+                    if idx >= len(chunks) or str(idx) in duplicates
+                )
+            manifest[name] = {
+                "sha256": sha, "stat": current[name][1], "shard": shard,
+                "chunks": chunk_hashes, "duplicates": duplicates
+            }
+
+            n_sentences += len(sentences)
+            n_reused += len(written) - len(to_embed)
+            n_embedded += len(to_embed)
+            elapsed = time.perf_counter() - started
+            print(f"[{done}/{len(paths)}] {name}: {len(sentences)} sentences, "
+                  f"{len(chunks)} chunks, {len(duplicates)} near-duplicates, {len(written)} written "
+                  f"({n_sentences / elapsed:.0f} sentences/s)")
+    finally:
+        writer.close()
+        if encoder is not embedding:
+            encoder.close()
+    print(f"Wrote {writer.written} chunks: reused {n_reused} stored vectors, "
+          f"made {n_embedded} ({CHUNK_VECTORS} chunk vectors)")
+    if DEDUP_THRESHOLD > 0:
+        total = sum(len(entry["chunks"]) for entry in manifest.values())
+        dropped_total = sum(len(entry.get("duplicates", {})) for entry in manifest.values())
+        saved = ""
+        if CHUNK_VECTORS == "encode" and n_embedded and n_duplicates:
+            saved = f", saving about {n_duplicates * encode_seconds / n_embedded:.1f}s of chunk encoding"
+        print(f"Near-duplicates: {n_duplicates} new dropped before embedding{saved}; "
+              f"{dropped_total} of {total} chunks ({dropped_total / max(total, 1):.1%}) "
+              f"left out of the index")
+
+    # Drop chunks no current file produces, and move the chunks of files
+    # whose shard changed out of their old shard
+    expected = {
+        chunk_id(name, idx): entry["shard"]
+        for name, entry in manifest.items() for idx in indexed_chunks(entry)
+    }
+    for shard, ids in deleted.items():
+        ids = sorted(i for i in ids if expected.get(i) != shard)
+        for start in range(0, len(ids), writer.batch_size):
+            writer.shard_collection(shard).delete(ids=ids[start:start + writer.batch_size])
+    dropped = {i for ids in deleted.values() for i in ids if i not in expected}
+    if rebuild:
+        for page in collection_pages(collection, writer.batch_size, []):
+            dropped.update(i for i in page["ids"] if i not in expected)
+    dropped = sorted(dropped)
+    for start in range(0, len(dropped), writer.batch_size):
+        collection.delete(ids=dropped[start:start + writer.batch_size])
+    print(f"Deleted {len(dropped)} chunks")
+    print(f"Collection count after: {collection.count()}")
+
+    build_lexical_index(collection, writer.batch_size)
+
+    # Written last: if anything above fails, the next run redoes this one
+    if DEDUP_THRESHOLD > 0:
+        near_duplicates.save(SIGNATURES_PATH)
+    save_manifest(INGEST_MANIFEST_PATH, manifest)
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
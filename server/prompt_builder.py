@@ -0,0 +1,274 @@
+import os
+import threading
+from collections import OrderedDict
+from string import Formatter
+
+REALTIME_HEADER = "=== REAL-TIME PERSONALIZED FARM DATA ===\n\n"
+REALTIME_FOOTER = "\n=== END REAL-TIME DATA ===\n"
+
+
+def format_weather_section(weather):
+    """Format weather rows into the weather section of the realtime block."""
+    if not weather:
+        return "** Weather Forecast **\nNo weather data available.\n\n"
+
+    lines = ["** Weather Forecast (Next 7 Days) **\n"]
+    append = lines.append
+    for day in weather:
+        append(f"Date: {day.get('date', 'N/A')}\n")
+        append(
+            f"  - Temperature: {day.get('temperature_low', 'N/A')}°F to {day.get('temperature_high', 'N/A')}°F\n"
+        )
+        append(f"  - Mean Temperature: {day.get('temperature_mean', 'N/A')}°F\n")
+        append(f"  - Precipitation Chance: {day.get('precipitation_chance', 'N/A')}%\n")
+        append(
+            f"  - Precipitation Amount: {day.get('precipitation_sum', 'N/A')} inches\n"
+        )
+        if day.get("humidity_mean"):
+            append(f"  - Humidity: {day.get('humidity_mean')}%\n")
+        if day.get("wind_speed_max"):
+            append(
+                f"  - Max Wind Speed: {day.get('wind_speed_max')} mph from {day.get('wind_direction', 'N/A')}\n"
+            )
+        if day.get("wind_gusts_max"):
+            append(f"  - Wind Gusts: {day.get('wind_gusts_max')} mph\n")
+        if day.get("evapotranspiration"):
+            append(f"  - Evapotranspiration: {day.get('evapotranspiration')} inches\n")
+        if day.get("sunshine_duration"):
+            append(f"  - Sunshine Duration: {day.get('sunshine_duration')} seconds\n")
+        append("\n")
+    return "".join(lines)
+
+
+def format_market_section(market):
+    """Format market price rows into the market section of the realtime block."""
+    if not market:
+        return "** Market Prices **\nNo market data available.\n\n"
+
+    # Group by crop
+    crops = {}
+    for price in market:
+        crops.setdefault(price.get("crop_name", "Unknown"), []).append(price)
+
+    lines = ["** Market Prices **\n"]
+    append = lines.append
+    for crop_name, prices in crops.items():
+        append(f"\n{crop_name.title()} ({prices[0].get('unit', 'N/A')}):\n")
+        for price in prices[:10]:  # Limit to 10 most recent prices per crop
+            append(f"  - {price.get('date', 'N/A')}: ${price.get('price', 'N/A')}\n")
+    return "".join(lines)
+
+
+def format_environmental_section(environmental):
+    """Format environmental/soil rows into the soil section of the realtime block."""
+    if not environmental:
+        return "** Environmental & Soil Data **\nNo environmental data available.\n\n"
+
+    lines = ["** Environmental & Soil Data **\n"]
+    append = lines.append
+    for entry in environmental[:5]:  # Show most recent 5
+        append(f"Farm ID: {entry.get('farm_id', 'N/A')}\n")
+        append(f"Date: {entry.get('date', 'N/A')}\n")
+        if entry.get("soil_ph") is not None:
+            append(f"  - Soil pH: {entry.get('soil_ph')}\n")
+        if entry.get("soil_temperature_c") is not None:
+            append(f"  - Soil Temperature: {entry.get('soil_temperature_c')}°C\n")
+        if entry.get("sediment_level_mg_l") is not None:
+            append(f"  - Sediment Level: {entry.get('sediment_level_mg_l')} mg/L\n")
+        if entry.get("erosion_risk_index") is not None:
+            append(f"  - Erosion Risk Index: {entry.get('erosion_risk_index')}\n")
+        if entry.get("fertilizer_availability_index") is not None:
+            append(
+                f"  - Fertilizer Availability Index: {entry.get('fertilizer_availability_index')}\n"
+            )
+        if entry.get("nitrogen_levels"):
+            append(f"  - Nitrogen Levels: {entry.get('nitrogen_levels')}\n")
+        if entry.get("broad_advice"):
+            append(f"  - Advice: {entry.get('broad_advice')}\n")
+        if entry.get("task_recommendations"):
+            append(
+                f"  - Task Recommendations: {', '.join(entry.get('task_recommendations'))}\n"
+            )
+        append("\n")
+    return "".join(lines)
+
+
+def format_satellite_section(satellite):
+    """Format satellite rows into the satellite section of the realtime block."""
+    if not satellite:
+        return "** Satellite Imagery Data **\nNo satellite data available.\n\n"
+
+    lines = ["** Satellite Imagery Data **\n"]
+    append = lines.append
+    for entry in satellite:
+        append(f"Created: {entry.get('created_at', 'N/A')}\n")
+        if entry.get("latitude") is not None and entry.get("longitude") is not None:
+            append(
+                f"  - Location: ({entry.get('latitude')}, {entry.get('longitude')})\n"
+            )
+        if entry.get("mean_ndvi") is not None:
+            append(f"  - Mean NDVI (Vegetation Health): {entry.get('mean_ndvi')}\n")
+        if entry.get("median_ndvi") is not None:
+            append(f"  - Median NDVI: {entry.get('median_ndvi')}\n")
+        if entry.get("ndvi_trend") is not None:
+            append(f"  - NDVI Trend: {entry.get('ndvi_trend')}\n")
+        if entry.get("mean_ndwi") is not None:
+            append(f"  - Mean NDWI (Water Index): {entry.get('mean_ndwi')}\n")
+        if entry.get("median_ndwi") is not None:
+            append(f"  - Median NDWI: {entry.get('median_ndwi')}\n")
+        if entry.get("ndwi_trend") is not None:
+            append(f"  - NDWI Trend: {entry.get('ndwi_trend')}\n")
+        if entry.get("crop_advice"):
+            append(f"  - Crop Advice: {entry.get('crop_advice')}\n")
+        if entry.get("task_recommendations"):
+            append(
+                f"  - Task Recommendations: {', '.join(entry.get('task_recommendations'))}\n"
+            )
+        if entry.get("ndvi_url"):
+            append("  - NDVI Visualization Available: Yes\n")
+        if entry.get("ndwi_url"):
+            append("  - NDWI Visualization Available: Yes\n")
+        append("\n")
+    return "".join(lines)
+
+
+# Realtime block sections, in the order they appear in the prompt
+SECTION_FORMATTERS = {
+    "weather": format_weather_section,
+    "market": format_market_section,
+    "environmental": format_environmental_section,
+    "satellite": format_satellite_section,
+}
+
+
+def format_realtime_data(realtime_data):
+    """
+    Format real-time data into a readable text format for the LLM.
+
+    Args:
+        realtime_data: Dictionary containing weather, market, environmental,
+            and satellite data
+
+    Returns:
+        Formatted string with real-time data
+    """
+    sections = [
+        formatter(realtime_data.get(section))
+        for section, formatter in SECTION_FORMATTERS.items()
+    ]
+    return "".join([REALTIME_HEADER, *sections, REALTIME_FOOTER])
+
+
+def join_realtime_sections(sections):
+    """Wrap formatted sections in the real-time data header and footer."""
+    return "".join([REALTIME_HEADER, *sections.values(), REALTIME_FOOTER])
+
+
+class PromptTemplate:
+    """
+    System prompt template loaded once and reloaded when the file's mtime changes.
+
+    The template is split into literal text and field names up front, so rendering
+    is a single join instead of a str.format parse on every request.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._parts = None
+
+    def _compile(self, text):
+        parts = []
+        for literal, field_name, format_spec, conversion in Formatter().parse(text):
+            if format_spec or conversion:
+                raise ValueError(
+                    f"Unsupported field formatting in {self.path}: {{{field_name}}}"
+                )
+            parts.append((literal, field_name))
+        return parts
+
+    def _current_parts(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    with open(self.path, "r") as f:
+                        self._parts = self._compile(f.read())
+                    self._mtime = mtime
+        return self._parts
+
+    def render(self, **values):
+        pieces = []
+        for literal, field_name in self._current_parts():
+            pieces.append(literal)
+            if field_name is not None:
+                pieces.append(str(values[field_name]))
+        return "".join(pieces)
+
+
+class PromptAssembler:
+    """
+    Build system messages from the prompt template and cached realtime sections.
+
+    Each formatted section is cached against the generation the farm data cache
+    assigned to its rows, so a section is only re-rendered after its table was
+    re-read.
+    """
+
+    def __init__(self, template_path, max_cached_sections: int = 256):
+        self.template = PromptTemplate(template_path)
+        self.max_cached_sections = max_cached_sections
+        self._lock = threading.Lock()
+        # (section, generation) -> formatted text
+        self._sections = OrderedDict()
+
+    def _format_section(self, section, rows, generation):
+        formatter = SECTION_FORMATTERS[section]
+        if generation is None:
+            return formatter(rows)
+
+        key = (section, generation)
+        with self._lock:
+            text = self._sections.get(key)
+            if text is not None:
+                self._sections.move_to_end(key)
+                return text
+
+        text = formatter(rows)
+        with self._lock:
+            self._sections[key] = text
+            while len(self._sections) > self.max_cached_sections:
+                self._sections.popitem(last=False)
+        return text
+
+    def format_realtime_sections(self, realtime_data, generations=None):
+        """
+        Format each real-time data section, reusing cached sections.
+
+        Args:
+            realtime_data: Dictionary of rows per section
+            generations: Optional dictionary of data generations per section;
+                sections without a generation are formatted uncached
+
+        Returns:
+            Dictionary of formatted text per section, in prompt order
+        """
+        generations = generations or {}
+        return {
+            section: self._format_section(
+                section, realtime_data.get(section), generations.get(section)
+            )
+            for section in SECTION_FORMATTERS
+        }
+
+    def format_realtime_data(self, realtime_data, generations=None):
+        """Format real-time data like format_realtime_data, reusing cached sections."""
+        return join_realtime_sections(
+            self.format_realtime_sections(realtime_data, generations)
+        )
+
+    def build_system_message(self, realtime_text: str, rag_context: str) -> str:
+        return self.template.render(
+            realtime_data=realtime_text, rag_context=rag_context
+        )
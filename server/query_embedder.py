@@ -0,0 +1,148 @@
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def normalize_query(text: str) -> str:
+    """
+    Cache key for a query.
+
+    all-MiniLM-L6-v2 uses an uncased tokenizer that splits on whitespace, so
+    case and whitespace changes do not change the embedding.
+    """
+    return " ".join(text.lower().split())
+
+
+class QueryEmbedder:
+    """
+    Embed search queries with an LRU cache and micro-batched encoding.
+
+    Cache misses are queued for a single encoder thread, which waits up to
+    batch_window seconds for more queries and then embeds everything queued
+    (up to max_batch_size) in one encode call. Queries that arrive while a batch
+    is encoding are picked up together by the next one, so batches grow with
+    load. Identical queries waiting in the same window share one slot.
+    """
+
+    def __init__(
+        self,
+        encode_batch,
+        max_batch_size: int = 32,
+        batch_window: float = 0.002,
+        cache_size: int = 2048,
+        on_batch=None,
+    ):
+        """
+        Args:
+            encode_batch: Callable embedding a list of texts, returning one
+                vector per text
+            on_batch: Optional callback receiving the size of each batch
+        """
+        self.encode_batch = encode_batch
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.cache_size = cache_size
+        self.on_batch = on_batch
+
+        self._lock = threading.Lock()
+        # normalized query -> embedding, in LRU order
+        self._cache = OrderedDict()
+        # normalized query -> Future for queries waiting to be encoded
+        self._pending = {}
+        self._queue = queue.Queue()
+        self._worker_pid = None
+
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+
+    def _ensure_worker(self):
+        # Threads do not survive fork, so each worker process starts its own
+        pid = os.getpid()
+        if self._worker_pid == pid:
+            return
+        with self._lock:
+            if self._worker_pid == pid:
+                return
+            self._queue = queue.Queue()
+            self._pending = {}
+            threading.Thread(target=self._run, args=(self._queue,), daemon=True).start()
+            self._worker_pid = pid
+
+    def _collect(self, work_queue):
+        batch = [work_queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    batch.append(work_queue.get(timeout=timeout))
+                else:
+                    batch.append(work_queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, work_queue):
+        while True:
+            batch = self._collect(work_queue)
+            try:
+                vectors = self.encode_batch(batch)
+            except Exception as e:
+                with self._lock:
+                    futures = [self._pending.pop(text) for text in batch]
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            with self._lock:
+                self.batches += 1
+                futures = []
+                for text, vector in zip(batch, vectors):
+                    self._store(text, vector)
+                    futures.append(self._pending.pop(text))
+            if self.on_batch is not None:
+                self.on_batch(len(batch))
+            for future, vector in zip(futures, vectors):
+                future.set_result(vector)
+
+    def _store(self, key, vector):
+        # Called with the lock held
+        self._cache[key] = vector
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def embed(self, text: str):
+        """Embed one query, from the cache or the next encode batch."""
+        key = normalize_query(text)
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return vector
+            self.misses += 1
+
+        self._ensure_worker()
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = Future()
+                self._queue.put(key)
+        return future.result()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "batches": self.batches,
+                "entries": len(self._cache),
+                "cache_size": self.cache_size,
+            }
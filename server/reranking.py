@@ -0,0 +1,50 @@
+import numpy as np
+
+# Weight of relevance against redundancy in maximal marginal relevance
+MMR_LAMBDA = 0.7
+
+
+def maximal_marginal_relevance(relevance, vectors, n_results, lambda_=MMR_LAMBDA):
+    """
+    Pick n_results candidates that are relevant but not redundant (MMR).
+
+    Each step picks the candidate maximizing
+    lambda_ * relevance - (1 - lambda_) * (highest cosine similarity to a chunk
+    already picked), so a chunk nearly repeating a better-ranked one gives way
+    to the next distinct chunk. Similarities come from one matrix product over
+    the candidates, and each step is a vectorized update, so the cost is
+    bounded by the candidate count.
+
+    Args:
+        relevance: Relevance of each candidate, higher is better
+        vectors: Embedding of each candidate
+        n_results: Number of candidates to pick
+        lambda_: 1 ranks by relevance only, 0 by diversity only
+
+    Returns:
+        Indices of the picked candidates, in pick order
+    """
+    relevance = np.asarray(relevance, dtype=np.float32)
+    n_results = min(n_results, len(relevance))
+    if n_results <= 0:
+        return []
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors = vectors / np.clip(
+        np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None
+    )
+    similarity = vectors @ vectors.T
+
+    first = int(np.argmax(relevance))
+    picked = [first]
+    redundancy = similarity[first].copy()
+    available = np.ones(len(relevance), dtype=bool)
+    available[first] = False
+    while len(picked) < n_results:
+        scores = lambda_ * relevance - (1 - lambda_) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return picked
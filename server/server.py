@@ -1,19 +1,57 @@
-from flask import Flask, jsonify, request, Response, stream_with_context
+from flask import Flask, g, jsonify, request, Response, stream_with_context
 from flask_cors import CORS
 import chromadb
-from chromadb.utils import embedding_functions
 import os
-import requests
 import json
-import base64
+import logging
+import threading
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from dotenv import load_dotenv
 from pathlib import Path
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
+from farm_data_cache import FarmDataCache
+from llm_client import LLM_MODEL, SUMMARY_MODEL, chat_completion
+from answer_cache import SemanticAnswerCache, context_fingerprint, replay_as_sse
+from prompt_builder import (
+    REALTIME_FOOTER,
+    REALTIME_HEADER,
+    PromptAssembler,
+    join_realtime_sections,
+)
+from context_packer import ContextPacker, TokenCounter
+from conversation_summary import ConversationSummarizer, summary_message
+from image_preprocess import ImagePreprocessor
+from query_embedder import QueryEmbedder
+from reranking import MMR_LAMBDA, maximal_marginal_relevance
+from kb_router import SHARD_COLLECTION_PREFIX, route
+from lexical_index import load_lexical_index, reciprocal_rank_fusion
+from startup import LazyResource, Readiness, memory_usage
+from embedding_backends import collection_embedding_function, create_embedding_function
+from sse_relay import SSERelay
+from admission import AdmissionController, AdmissionRejected
+from metrics import (
+    METRICS_CONTENT_TYPE,
+    RequestTimings,
+    embedding_batch_size,
+    http_request_seconds,
+    log_sampled,
+    prompt_tokens,
+    rag_fusion_seconds,
+    rag_mmr_seconds,
+    rag_route_seconds,
+    registry,
+)
 
 # Load environment variables from root .env file
 root_dir = Path(__file__).parent.parent
 load_dotenv(dotenv_path=root_dir / ".env")
 
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 CORS(
     app,
@@ -23,289 +61,654 @@ CORS(
     supports_credentials=False,
 )
 
-# Initialize ChromaDB client
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
-embedding = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name="all-MiniLM-L6-v2"
-)
+# all-MiniLM-L6-v2 on the backend chosen by EMBEDDING_BACKEND. The weights are
+# read-only, so a preloading master (gunicorn.conf.py) loads them once and the
+# forked workers share them copy-on-write.
+embedding_model = LazyResource("embedding_model", create_embedding_function)
 
-# Get or create collection
-try:
-    collection = chroma_client.get_collection(
-        name="static_knowledge_base", embedding_function=embedding
-    )
-except Exception:
-    collection = chroma_client.create_collection(
-        name="static_knowledge_base",
-        embedding_function=embedding,
-        metadata={"description": "Static knowledge base for RAG"},
+
+def open_collection():
+    """Open (or create) the knowledge base collection in this process."""
+    embedding_function = collection_embedding_function(embedding_model.get())
+    try:
+        return chroma_client.get().get_collection(
+            name="static_knowledge_base", embedding_function=embedding_function
+        )
+    except Exception:
+        return chroma_client.get().create_collection(
+            name="static_knowledge_base",
+            embedding_function=embedding_function,
+            metadata={"description": "Static knowledge base for RAG"},
+        )
+
+
+def open_shards():
+    """Open the per-topic shard collections built by populate_vector_db.py."""
+    embedding_function = collection_embedding_function(embedding_model.get())
+    return {
+        c.name[len(SHARD_COLLECTION_PREFIX) :]: chroma_client.get().get_collection(
+            name=c.name, embedding_function=embedding_function
+        )
+        for c in chroma_client.get().list_collections()
+        if c.name.startswith(SHARD_COLLECTION_PREFIX)
+    }
+
+
+# Per-query timeout (seconds) for the realtime Supabase reads
+SUPABASE_QUERY_TIMEOUT = float(os.getenv("SUPABASE_QUERY_TIMEOUT", "3"))
+
+
+def create_supabase_client() -> Client:
+    return create_client(
+        os.getenv("SUPABASE_URL"),
+        os.getenv("SUPABASE_KEY"),
+        options=ClientOptions(postgrest_client_timeout=SUPABASE_QUERY_TIMEOUT),
     )
 
-# Initialize Supabase client
-supabase: Client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
 
+# Chroma and Supabase clients hold file handles, sockets and threads, so each
+# worker process opens its own on first use
+chroma_client = LazyResource(
+    "chroma_client",
+    lambda: chromadb.PersistentClient(path="./chroma_db"),
+    per_process=True,
+)
+chroma_collection = LazyResource("chroma_collection", open_collection, per_process=True)
+chroma_shards = LazyResource("chroma_shards", open_shards, per_process=True)
+supabase_client = LazyResource(
+    "supabase_client", create_supabase_client, per_process=True
+)
 
-# Initialize Lava Payments token
-def get_lava_token():
-    return base64.b64encode(
-        json.dumps(
-            {
-                "secret_key": os.getenv("LAVA_API_KEY"),
-                "connection_secret": os.getenv("LAVA_SELF_CONNECTION_SECRET"),
-                "product_secret": os.getenv("LAVA_SELF_PRODUCT_SECRET"),
-            }
-        ).encode()
-    ).decode()
+# Search only the shards a query is routed to (by its words and the farm's crops)
+RAG_SHARD_ROUTING = os.getenv("RAG_SHARD_ROUTING", "1") == "1"
+
+# BM25 index over the same chunks, built by populate_vector_db.py. Its postings
+# are memory-mapped, so workers share the pages of the file.
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "./bm25_index")
+lexical_index = LazyResource(
+    "lexical_index", lambda: load_lexical_index(LEXICAL_INDEX_PATH)
+)
+
+# Prompt token counter (tiktoken, or a length estimate if it cannot be loaded).
+# The encoding may be downloaded on first load, so it is loaded with the other
+# resources, and /ready reports whether the estimate is in use.
+token_counter = LazyResource("token_counter", TokenCounter, describe=TokenCounter.stats)
+
+# Chunks taken from each of the dense and BM25 rankings before they are fused
+RAG_FUSION_CANDIDATES = int(os.getenv("RAG_FUSION_CANDIDATES", "20"))
+
+# Maximal marginal relevance over the best fused chunks: RAG_MMR_CANDIDATES
+# are re-ranked, trading relevance against redundancy with RAG_MMR_LAMBDA
+# (1 disables re-ranking)
+RAG_MMR_CANDIDATES = int(os.getenv("RAG_MMR_CANDIDATES", "12"))
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", str(MMR_LAMBDA)))
+
+# Query embeddings, cached by normalized text and encoded in micro-batches
+query_embedder = QueryEmbedder(
+    lambda texts: embedding_model.get()(texts),
+    max_batch_size=int(os.getenv("EMBED_MAX_BATCH_SIZE", "32")),
+    batch_window=float(os.getenv("EMBED_BATCH_WINDOW_MS", "2")) / 1000,
+    cache_size=int(os.getenv("EMBED_CACHE_SIZE", "2048")),
+    on_batch=lambda size: embedding_batch_size.observe(size),
+)
+
+
+def preload():
+    """Load the read-only embedding model, before workers are forked."""
+    embedding_model.get()
+    lexical_index.get()
+    token_counter.get()
+
+
+def warm_up():
+    """Load and open everything a request needs, so no request pays for it."""
+    embedding_model.get()(["warm up"])
+    chroma_collection.get().count()
+    chroma_shards.get()
+    lexical_index.get()
+    token_counter.get()
+    supabase_client.get()
+
+
+# Readiness of this process, reported by /ready
+readiness = Readiness(
+    warm_up,
+    resources=[
+        embedding_model,
+        lexical_index,
+        token_counter,
+        chroma_collection,
+        chroma_shards,
+        supabase_client,
+    ],
+)
+
+# Shared pool used to issue the realtime table reads concurrently
+supabase_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SUPABASE_MAX_WORKERS", "16")),
+    thread_name_prefix="supabase",
+)
+
+
+# Batch streamed tokens into one SSE frame per interval (seconds, 0 = per token)
+SSE_FLUSH_INTERVAL = float(os.getenv("SSE_FLUSH_INTERVAL", "0"))
+
+# System prompt template and cached realtime data sections
+prompt_assembler = PromptAssembler(Path(__file__).parent / "system_prompt.md")
+
+# Downsized chat photos, cached by content hash across conversation turns
+image_preprocessor = ImagePreprocessor(
+    max_dimension=int(os.getenv("IMAGE_MAX_DIMENSION", "1024")),
+    jpeg_quality=int(os.getenv("IMAGE_JPEG_QUALITY", "80")),
+    max_bytes=int(os.getenv("IMAGE_MAX_BYTES", "500000")),
+    max_entries=int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "64")),
+)
+
+# Token budget for the system message and conversation history sent to the LLM
+context_packer = LazyResource(
+    "context_packer",
+    lambda: ContextPacker(
+        token_counter.get(),
+        budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "8000")),
+        realtime_max_tokens=int(os.getenv("CONTEXT_REALTIME_MAX_TOKENS", "1500")),
+        rag_max_tokens=int(os.getenv("CONTEXT_RAG_MAX_TOKENS", "2000")),
+    ),
+)
+
+# Semantic cache of LLM answers in front of the upstream call
+answer_cache = SemanticAnswerCache(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1024")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+)
+
+# Worker processes serving the app (set by gunicorn.conf.py; WEB_CONCURRENCY
+# for uvicorn). Each has its own limiter, so the default limits below are
+# split between them to keep the total sent upstream under Lava's rate limit.
+LLM_WORKER_PROCESSES = max(
+    1, int(os.getenv("LLM_WORKER_PROCESSES", os.getenv("WEB_CONCURRENCY", "1")))
+)
+
+# Bound on concurrent upstream LLM calls, with a fair wait queue.
+# LLM_MAX_CONCURRENT and LLM_MAX_QUEUED are per worker process; by default
+# 16 calls and 64 queued requests are shared between all workers.
+llm_admission = AdmissionController(
+    max_concurrent=int(
+        os.getenv("LLM_MAX_CONCURRENT", str(max(1, 16 // LLM_WORKER_PROCESSES)))
+    ),
+    max_queued=int(
+        os.getenv("LLM_MAX_QUEUED", str(max(1, 64 // LLM_WORKER_PROCESSES)))
+    ),
+    max_queued_per_client=int(os.getenv("LLM_MAX_QUEUED_PER_CLIENT", "4")),
+    queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "30")),
+)
+
+# Proxies in front of the server that append the address they saw to
+# X-Forwarded-For (1 behind ngrok); 0 keys clients on the peer address
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+
+# Seconds between "queued" status events sent to waiting streaming clients
+LLM_QUEUE_STATUS_INTERVAL = float(os.getenv("LLM_QUEUE_STATUS_INTERVAL", "2"))
+
+
+def complete_summary(llm_messages):
+    """Run a conversation summary request through the upstream limiter."""
+    ticket = llm_admission.enter("conversation-summary")
+    try:
+        if not ticket.wait(llm_admission.queue_timeout):
+            raise queue_timeout_error()
+        response = chat_completion(llm_messages, model=SUMMARY_MODEL)
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+    finally:
+        llm_admission.leave(ticket)
+
+
+# Rolling summaries of long conversations, built off the request path
+conversation_summarizer = ConversationSummarizer(
+    complete_summary,
+    ThreadPoolExecutor(
+        max_workers=int(os.getenv("SUMMARY_MAX_WORKERS", "2")),
+        thread_name_prefix="summary",
+    ),
+    trigger_messages=int(os.getenv("SUMMARY_TRIGGER_MESSAGES", "12")),
+    keep_recent=int(os.getenv("SUMMARY_KEEP_RECENT", "6")),
+    fold_step=int(os.getenv("SUMMARY_FOLD_STEP", "6")),
+    max_entries=int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "1024")),
+)
+
+
+registry.counter_callback(
+    "demeter_farm_data_cache_hits_total",
+    "Realtime farm data sections served from cache",
+    lambda: farm_data_cache.stats()["hits"],
+)
+registry.counter_callback(
+    "demeter_farm_data_cache_misses_total",
+    "Realtime farm data sections read from Supabase",
+    lambda: farm_data_cache.stats()["misses"],
+)
+registry.counter_callback(
+    "demeter_answer_cache_hits_total",
+    "Chat answers served from the semantic answer cache",
+    lambda: answer_cache.stats()["hits"],
+)
+registry.counter_callback(
+    "demeter_answer_cache_misses_total",
+    "Chat prompts not found in the semantic answer cache",
+    lambda: answer_cache.stats()["misses"],
+)
+registry.counter_callback(
+    "demeter_conversation_summary_hits_total",
+    "Long chats sent with an up-to-date cached summary",
+    lambda: conversation_summarizer.stats()["hits"],
+)
+registry.counter_callback(
+    "demeter_conversation_summary_misses_total",
+    "Long chats whose latest summary was not built yet",
+    lambda: conversation_summarizer.stats()["misses"],
+)
+registry.counter_callback(
+    "demeter_image_cache_hits_total",
+    "Chat images reused from the preprocessed image cache",
+    lambda: image_preprocessor.stats()["hits"],
+)
+registry.counter_callback(
+    "demeter_image_cache_misses_total",
+    "Chat images preprocessed on arrival",
+    lambda: image_preprocessor.stats()["misses"],
+)
+registry.counter_callback(
+    "demeter_query_embedding_cache_hits_total",
+    "Query embeddings served from the LRU cache",
+    lambda: query_embedder.stats()["hits"],
+)
+registry.counter_callback(
+    "demeter_query_embedding_cache_misses_total",
+    "Query embeddings computed by the model",
+    lambda: query_embedder.stats()["misses"],
+)
+registry.gauge(
+    "demeter_llm_active_requests",
+    "Upstream LLM calls in progress",
+    lambda: llm_admission.stats()["active"],
+)
+registry.gauge(
+    "demeter_llm_queued_requests",
+    "Chat requests waiting for an upstream LLM slot",
+    lambda: llm_admission.stats()["queued"],
+)
+registry.counter_callback(
+    "demeter_llm_admission_rejected_total",
+    "Chat requests rejected because the LLM wait queue was full",
+    lambda: llm_admission.stats()["rejected"],
+)
+registry.gauge(
+    "demeter_process_resident_memory_bytes",
+    "Resident memory of this worker, including pages shared copy-on-write",
+    lambda: memory_usage()["rss"],
+)
+registry.gauge(
+    "demeter_process_proportional_memory_bytes",
+    "Memory of this worker with shared pages split between their sharers (PSS)",
+    lambda: memory_usage()["pss"],
+)
+registry.gauge(
+    "demeter_cold_start_seconds",
+    "Seconds from process start (or fork) until this worker was ready",
+    lambda: readiness.cold_start_seconds or 0,
+)
 
 
-def get_rag_context(query: str, n_results: int = 3):
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def observe_api_request(response):
+    # /rag-query is observed when its answer (or stream) completes
+    if request.path.startswith("/api/") and request.url_rule is not None:
+        http_request_seconds.observe(
+            time.perf_counter() - g.request_started, route=request.url_rule.rule
+        )
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Metrics endpoint in the Prometheus text format.
+
+    Under gunicorn, counters and histograms are added up over all workers and
+    gauges carry a pid label (see METRICS_MULTIPROC_DIR in metrics.py).
+    """
+    return Response(registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@app.route("/ready", methods=["GET"])
+def get_readiness():
+    """
+    Readiness probe: 200 once this worker has loaded the embedding model and
+    opened its Chroma and Supabase clients, 503 while it is still warming up.
+    Also reports the worker's cold-start time and memory use, and whether the
+    prompt tokenizer loaded or token counts are estimated (token_counter).
+    """
+    readiness.start()
+    status = readiness.stats()
+    return jsonify(status), 200 if status["ready"] else 503
+
+
+def embed_query(query: str):
+    """Embed a query with the same model the collection uses."""
+    return query_embedder.embed(query)
+
+
+def get_rag_context(
+    query: str, n_results: int = 3, query_embedding=None, crop_list=None
+):
     """
     Retrieve relevant documents from the vector database.
 
+    When the knowledge base is sharded, only the shards the query is routed to
+    (by the topics it names, else the farm's crops) are searched. Dense
+    (embedding) and BM25 rankings are merged with reciprocal rank fusion, so
+    chunks naming the exact chemical, disease or variety in the query are found
+    even when their embedding is not among the nearest. Without a BM25 index
+    the dense ranking is used as is. The best candidates are then re-ranked
+    with maximal marginal relevance on their stored embeddings, so adjacent
+    chunks repeating each other do not take every slot.
+
     Args:
         query: The search query
         n_results: Number of results to return
+        query_embedding: Optional precomputed embedding of the query
+        crop_list: Optional crop names grown on the farm, used for routing
 
     Returns:
-        List of dictionaries containing document text, distance, and metadata
+        List of dictionaries containing document id, text, distance, and metadata
     """
+    collection = chroma_collection.get()
     if collection.count() == 0:
         return []
 
-    results = collection.query(
-        query_texts=[query],
-        n_results=n_results,
-        include=["documents", "distances", "metadatas"],
+    if query_embedding is None:
+        query_embedding = embed_query(query)
+
+    shards = chroma_shards.get()
+    routed = None
+    if RAG_SHARD_ROUTING and shards:
+        started = time.perf_counter()
+        routed = route(query, crop_list, shards)
+        rag_route_seconds.observe(time.perf_counter() - started)
+
+    index = lexical_index.get()
+    over_fetch = index is not None or RAG_MMR_LAMBDA < 1
+    n_candidates = max(n_results, RAG_FUSION_CANDIDATES) if over_fetch else n_results
+    dense = []
+    for target in [shards[s] for s in routed] if routed else [collection]:
+        results = target.query(
+            query_embeddings=[query_embedding],
+            n_results=n_candidates,
+            include=["documents", "distances", "metadatas", "embeddings"],
+        )
+        dense.extend(
+            zip(
+                results["ids"][0],
+                results["documents"][0],
+                results["distances"][0],
+                results["metadatas"][0],
+                results["embeddings"][0],
+            )
+        )
+    # Shards share the collection's distance, so their hits merge by distance
+    dense.sort(key=lambda hit: hit[2])
+
+    items = {}
+    # Stored chunk embeddings, used by MMR instead of re-embedding the text
+    vectors = {}
+    for doc_id, doc, distance, metadata, vector in dense[:n_candidates]:
+        items[doc_id] = {
+            "id": doc_id,
+            "text": doc,
+            "distance": distance,
+            "metadata": metadata,
+        }
+        vectors[doc_id] = vector
+
+    fused = reciprocal_rank_fusion([list(items)])
+    if index is not None:
+        started = time.perf_counter()
+        lexical = [
+            doc_id for doc_id, _ in index.search(query, n_candidates, groups=routed)
+        ]
+        fused = reciprocal_rank_fusion([list(items), lexical])
+        rag_fusion_seconds.observe(time.perf_counter() - started)
+    candidates = fused[
+        : max(n_results, RAG_MMR_CANDIDATES) if RAG_MMR_LAMBDA < 1 else n_results
+    ]
+
+    # Chunks only BM25 ranked high enough still need their text
+    missing = [doc_id for doc_id, _ in candidates if doc_id not in items]
+    if missing:
+        extra = collection.get(
+            ids=missing, include=["documents", "metadatas", "embeddings"]
+        )
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        for doc_id, doc, metadata, vector in zip(
+            extra["ids"], extra["documents"], extra["metadatas"], extra["embeddings"]
+        ):
+            # Squared L2, the collection's distance, as the dense hits report
+            distance = float(np.sum((np.asarray(vector) - query_vector) ** 2))
+            items[doc_id] = {
+                "id": doc_id,
+                "text": doc,
+                "distance": distance,
+                "metadata": metadata,
+            }
+            vectors[doc_id] = vector
+    candidates = [(doc_id, score) for doc_id, score in candidates if doc_id in items]
+
+    # Keep near-duplicate neighbouring chunks from filling every slot
+    if RAG_MMR_LAMBDA < 1 and len(candidates) > n_results:
+        started = time.perf_counter()
+        scores = np.array([score for _, score in candidates])
+        # Fused scores scaled to 0-1, comparable with cosine similarities
+        relevance = (scores - scores.min()) / (scores.max() - scores.min() or 1)
+        picked = maximal_marginal_relevance(
+            relevance,
+            [vectors[doc_id] for doc_id, _ in candidates],
+            n_results,
+            RAG_MMR_LAMBDA,
+        )
+        candidates = [candidates[i] for i in picked]
+        rag_mmr_seconds.observe(time.perf_counter() - started)
+
+    return [items[doc_id] for doc_id, _ in candidates[:n_results]]
+
+
+def fetch_weather_data(crop_list=None, farm_id=None):
+    """Fetch weather data (most recent 7 days)."""
+    weather_query = supabase_client.get().table("weather_data").select("*")
+
+    if farm_id:
+        weather_query = weather_query.eq("farm_id", farm_id)
+
+    response = weather_query.order("date", desc=False).limit(7).execute()
+    return response.data if response.data else []
+
+
+def fetch_market_data(crop_list=None, farm_id=None):
+    """Fetch market prices with optional crop filter."""
+    market_query = supabase_client.get().table("market_prices").select("*")
+
+    if crop_list:
+        # Filter by crop names (case-insensitive)
+        market_query = market_query.in_("crop_name", crop_list)
+
+    response = market_query.order("date", desc=False).execute()
+    return response.data if response.data else []
+
+
+def fetch_environmental_data(crop_list=None, farm_id=None):
+    """Fetch environmental/soil data (most recent entries)."""
+    environmental_query = supabase_client.get().table("environmental_data").select("*")
+
+    if farm_id:
+        environmental_query = environmental_query.eq("farm_id", farm_id)
+
+    response = environmental_query.order("date", desc=True).limit(10).execute()
+    return response.data if response.data else []
+
+
+def fetch_satellite_data(crop_list=None, farm_id=None):
+    """Fetch satellite imagery data (most recent entries)."""
+    response = (
+        supabase_client.get()
+        .table("satellite_data_table")
+        .select("*")
+        .order("created_at", desc=True)
+        .limit(5)
+        .execute()
     )
+    return response.data if response.data else []
 
-    context_items = []
-    for doc, distance, metadata in zip(
-        results["documents"][0], results["distances"][0], results["metadatas"][0]
-    ):
-        context_items.append({"text": doc, "distance": distance, "metadata": metadata})
 
-    return context_items
+REALTIME_FETCHERS = {
+    "weather": fetch_weather_data,
+    "market": fetch_market_data,
+    "environmental": fetch_environmental_data,
+    "satellite": fetch_satellite_data,
+}
 
 
-def get_realtime_farm_data(crop_list=None):
+def fetch_realtime_sections(sections, crop_list=None, farm_id=None):
     """
-    Fetch real-time data from Supabase tables.
+    Read realtime data sections from Supabase.
+
+    The reads are issued concurrently on a shared thread pool. Each read is
+    bounded by SUPABASE_QUERY_TIMEOUT; a read that fails or times out degrades
+    to an empty section instead of stalling the others.
 
     Args:
+        sections: Names of the sections to read (keys of REALTIME_FETCHERS)
         crop_list: Optional list of crop names to filter market data
+        farm_id: Optional farm ID to filter weather and environmental data
 
     Returns:
-        Dictionary containing weather, market, environmental, and satellite data
+        Tuple (data, failed) of the rows per section and the set of sections
+        that could not be read
     """
-    try:
-        # Fetch weather data (most recent 7 days)
-        weather_response = (
-            supabase.table("weather_data")
-            .select("*")
-            .order("date", desc=False)
-            .limit(7)
-            .execute()
-        )
-
-        # Fetch market prices with optional crop filter
-        market_query = supabase.table("market_prices").select("*")
-
-        if crop_list:
-            # Filter by crop names (case-insensitive)
-            market_query = market_query.in_("crop_name", crop_list)
-
-        market_response = market_query.order("date", desc=False).execute()
-
-        # Fetch environmental/soil data (most recent entries)
-        environmental_response = (
-            supabase.table("environmental_data")
-            .select("*")
-            .order("date", desc=True)
-            .limit(10)
-            .execute()
+    futures = {
+        section: supabase_executor.submit(
+            REALTIME_FETCHERS[section], crop_list, farm_id
         )
+        for section in sections
+    }
+
+    # All reads start together, so a shared deadline bounds each one
+    deadline = time.monotonic() + SUPABASE_QUERY_TIMEOUT
+    data = {}
+    failed = set()
+    for section, future in futures.items():
+        try:
+            data[section] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FuturesTimeoutError:
+            future.cancel()
+            print(f"Timed out fetching {section} data after {SUPABASE_QUERY_TIMEOUT}s")
+            data[section] = []
+            failed.add(section)
+        except Exception as e:
+            print(f"Error fetching {section} data: {e}")
+            data[section] = []
+            failed.add(section)
+
+    return data, failed
+
+
+# Set while the data_versions table cannot be read, so the outage is logged once
+data_versions_unavailable = threading.Event()
+
+
+def fetch_data_versions():
+    """
+    Read the per-table version stamps the agents bump after each write.
 
-        # Fetch satellite imagery data (most recent entries)
-        satellite_response = (
-            supabase.table("satellite_data_table")
-            .select("*")
-            .order("created_at", desc=True)
-            .limit(5)
+    Returns:
+        Dictionary mapping table name to version, or None if unavailable
+    """
+    try:
+        response = (
+            supabase_client.get()
+            .table("data_versions")
+            .select("table_name,version")
             .execute()
         )
-
-        return {
-            "weather": weather_response.data if weather_response.data else [],
-            "market": market_response.data if market_response.data else [],
-            "environmental": (
-                environmental_response.data if environmental_response.data else []
-            ),
-            "satellite": satellite_response.data if satellite_response.data else [],
-        }
+        versions = {row["table_name"]: row["version"] for row in response.data or []}
     except Exception as e:
-        print(f"Error fetching real-time data: {e}")
-        return {"weather": [], "market": [], "environmental": [], "satellite": []}
+        # Warn once per outage (e.g. agents/schemas/data_versions_schema.sql not
+        # applied yet); the cache backs off its polling meanwhile
+        if not data_versions_unavailable.is_set():
+            data_versions_unavailable.set()
+            logger.warning(
+                f"Data version stamps unavailable ({e}), "
+                "farm data is cached on TTL only"
+            )
+        return None
+    if data_versions_unavailable.is_set():
+        data_versions_unavailable.clear()
+        logger.info("Data version stamps available again")
+    return versions
+
+
+farm_data_cache = FarmDataCache(
+    fetch_sections=fetch_realtime_sections,
+    fetch_versions=fetch_data_versions,
+    ttl=float(os.getenv("FARM_DATA_CACHE_TTL", "300")),
+    version_poll_interval=float(os.getenv("FARM_DATA_VERSION_POLL_INTERVAL", "1")),
+    max_entries=int(os.getenv("FARM_DATA_CACHE_MAX_ENTRIES", "256")),
+)
 
 
-def format_realtime_data(realtime_data):
+def get_realtime_farm_data(crop_list=None, farm_id=None):
     """
-    Format real-time data into a readable text format for the LLM.
+    Fetch real-time data from Supabase tables, served from farm_data_cache.
 
     Args:
-        realtime_data: Dictionary containing weather and market data
+        crop_list: Optional list of crop names to filter market data
+        farm_id: Optional farm ID to filter weather and environmental data
 
     Returns:
-        Formatted string with real-time data
+        Dictionary containing weather, market, environmental, and satellite data
     """
-    formatted_text = "=== REAL-TIME PERSONALIZED FARM DATA ===\n\n"
-
-    # Format weather data
-    if realtime_data["weather"]:
-        formatted_text += "** Weather Forecast (Next 7 Days) **\n"
-        for day in realtime_data["weather"]:
-            formatted_text += f"Date: {day.get('date', 'N/A')}\n"
-            formatted_text += f"  - Temperature: {day.get('temperature_low', 'N/A')}°F to {day.get('temperature_high', 'N/A')}°F\n"
-            formatted_text += (
-                f"  - Mean Temperature: {day.get('temperature_mean', 'N/A')}°F\n"
-            )
-            formatted_text += (
-                f"  - Precipitation Chance: {day.get('precipitation_chance', 'N/A')}%\n"
-            )
-            formatted_text += f"  - Precipitation Amount: {day.get('precipitation_sum', 'N/A')} inches\n"
-            if day.get("humidity_mean"):
-                formatted_text += f"  - Humidity: {day.get('humidity_mean')}%\n"
-            if day.get("wind_speed_max"):
-                formatted_text += f"  - Max Wind Speed: {day.get('wind_speed_max')} mph from {day.get('wind_direction', 'N/A')}\n"
-            if day.get("wind_gusts_max"):
-                formatted_text += f"  - Wind Gusts: {day.get('wind_gusts_max')} mph\n"
-            if day.get("evapotranspiration"):
-                formatted_text += (
-                    f"  - Evapotranspiration: {day.get('evapotranspiration')} inches\n"
-                )
-            if day.get("sunshine_duration"):
-                formatted_text += (
-                    f"  - Sunshine Duration: {day.get('sunshine_duration')} seconds\n"
-                )
-            formatted_text += "\n"
-    else:
-        formatted_text += "** Weather Forecast **\nNo weather data available.\n\n"
-
-    # Format market data
-    if realtime_data["market"]:
-        formatted_text += "** Market Prices **\n"
-        # Group by crop
-        crops = {}
-        for price in realtime_data["market"]:
-            crop_name = price.get("crop_name", "Unknown")
-            if crop_name not in crops:
-                crops[crop_name] = []
-            crops[crop_name].append(price)
-
-        for crop_name, prices in crops.items():
-            formatted_text += (
-                f"\n{crop_name.title()} ({prices[0].get('unit', 'N/A')}):\n"
-            )
-            for price in prices[:10]:  # Limit to 10 most recent prices per crop
-                formatted_text += (
-                    f"  - {price.get('date', 'N/A')}: ${price.get('price', 'N/A')}\n"
-                )
-    else:
-        formatted_text += "** Market Prices **\nNo market data available.\n\n"
-
-    # Format environmental/soil data
-    if realtime_data.get("environmental"):
-        formatted_text += "** Environmental & Soil Data **\n"
-        for entry in realtime_data["environmental"][:5]:  # Show most recent 5
-            formatted_text += f"Farm ID: {entry.get('farm_id', 'N/A')}\n"
-            formatted_text += f"Date: {entry.get('date', 'N/A')}\n"
-            if entry.get("soil_ph") is not None:
-                formatted_text += f"  - Soil pH: {entry.get('soil_ph')}\n"
-            if entry.get("soil_temperature_c") is not None:
-                formatted_text += (
-                    f"  - Soil Temperature: {entry.get('soil_temperature_c')}°C\n"
-                )
-            if entry.get("sediment_level_mg_l") is not None:
-                formatted_text += (
-                    f"  - Sediment Level: {entry.get('sediment_level_mg_l')} mg/L\n"
-                )
-            if entry.get("erosion_risk_index") is not None:
-                formatted_text += (
-                    f"  - Erosion Risk Index: {entry.get('erosion_risk_index')}\n"
-                )
-            if entry.get("fertilizer_availability_index") is not None:
-                formatted_text += f"  - Fertilizer Availability Index: {entry.get('fertilizer_availability_index')}\n"
-            if entry.get("nitrogen_levels"):
-                formatted_text += (
-                    f"  - Nitrogen Levels: {entry.get('nitrogen_levels')}\n"
-                )
-            if entry.get("broad_advice"):
-                formatted_text += f"  - Advice: {entry.get('broad_advice')}\n"
-            if entry.get("task_recommendations"):
-                formatted_text += f"  - Task Recommendations: {', '.join(entry.get('task_recommendations'))}\n"
-            formatted_text += "\n"
-    else:
-        formatted_text += (
-            "** Environmental & Soil Data **\nNo environmental data available.\n\n"
-        )
+    realtime_data, _ = farm_data_cache.get(farm_id, crop_list)
+    return realtime_data
 
-    # Format satellite imagery data
-    if realtime_data.get("satellite"):
-        formatted_text += "** Satellite Imagery Data **\n"
-        for entry in realtime_data["satellite"]:
-            formatted_text += f"Created: {entry.get('created_at', 'N/A')}\n"
-            if entry.get("latitude") is not None and entry.get("longitude") is not None:
-                formatted_text += f"  - Location: ({entry.get('latitude')}, {entry.get('longitude')})\n"
-            if entry.get("mean_ndvi") is not None:
-                formatted_text += (
-                    f"  - Mean NDVI (Vegetation Health): {entry.get('mean_ndvi')}\n"
-                )
-            if entry.get("median_ndvi") is not None:
-                formatted_text += f"  - Median NDVI: {entry.get('median_ndvi')}\n"
-            if entry.get("ndvi_trend") is not None:
-                formatted_text += f"  - NDVI Trend: {entry.get('ndvi_trend')}\n"
-            if entry.get("mean_ndwi") is not None:
-                formatted_text += (
-                    f"  - Mean NDWI (Water Index): {entry.get('mean_ndwi')}\n"
-                )
-            if entry.get("median_ndwi") is not None:
-                formatted_text += f"  - Median NDWI: {entry.get('median_ndwi')}\n"
-            if entry.get("ndwi_trend") is not None:
-                formatted_text += f"  - NDWI Trend: {entry.get('ndwi_trend')}\n"
-            if entry.get("crop_advice"):
-                formatted_text += f"  - Crop Advice: {entry.get('crop_advice')}\n"
-            if entry.get("task_recommendations"):
-                formatted_text += f"  - Task Recommendations: {', '.join(entry.get('task_recommendations'))}\n"
-            if entry.get("ndvi_url"):
-                formatted_text += f"  - NDVI Visualization Available: Yes\n"
-            if entry.get("ndwi_url"):
-                formatted_text += f"  - NDWI Visualization Available: Yes\n"
-            formatted_text += "\n"
-    else:
-        formatted_text += (
-            "** Satellite Imagery Data **\nNo satellite data available.\n\n"
-        )
 
-    formatted_text += "\n=== END REAL-TIME DATA ===\n"
-    return formatted_text
+def parse_crop_list(crops_param):
+    """Split a comma-separated crops parameter, or return None if absent."""
+    if not crops_param:
+        return None
+
+    # Split comma-separated crops and clean up whitespace
+    return [crop.strip() for crop in crops_param.split(",")]
 
 
 @app.route("/api/farm-data", methods=["GET"])
 def get_farm_data():
     """
     API endpoint to fetch real-time farm data (weather, market prices, environmental/soil data, and satellite imagery).
-    Accepts optional 'crops' query parameter (comma-separated list).
+    Accepts optional 'crops' query parameter (comma-separated list) and 'farm_id'.
     """
     try:
         # Get crops parameter from query string
-        crops_param = request.args.get("crops")
-        crop_list = None
+        crop_list = parse_crop_list(request.args.get("crops"))
 
-        if crops_param:
-            # Split comma-separated crops and clean up whitespace
-            crop_list = [crop.strip() for crop in crops_param.split(",")]
+        # Optional farm filter for weather and environmental data
+        farm_id = request.args.get("farm_id")
 
         # Fetch real-time data
-        realtime_data = get_realtime_farm_data(crop_list)
+        realtime_data = get_realtime_farm_data(crop_list, farm_id)
 
         return jsonify(realtime_data), 200
 
@@ -325,6 +728,61 @@ def get_farm_data():
         )
 
 
+@app.route("/api/farm-data/cache-stats", methods=["GET"])
+def get_farm_data_cache_stats():
+    """
+    API endpoint reporting hit/miss counters for the realtime farm data cache.
+    """
+    return jsonify(farm_data_cache.stats()), 200
+
+
+@app.route("/api/answer-cache/stats", methods=["GET"])
+def get_answer_cache_stats():
+    """
+    API endpoint reporting hit/miss counters for the semantic answer cache.
+    """
+    return jsonify(answer_cache.stats()), 200
+
+
+@app.route("/api/llm-admission/stats", methods=["GET"])
+def get_llm_admission_stats():
+    """
+    API endpoint reporting upstream LLM slots in use, queue depth and rejections.
+    """
+    return jsonify(llm_admission.stats()), 200
+
+
+def fetch_latest_satellite_record():
+    """Fetch the most recent satellite data entry, or None if none exists."""
+    # Fetch the most recent satellite data (ordered by created_at)
+    satellite_response = (
+        supabase_client.get()
+        .table("satellite_data_table")
+        .select("*")
+        .order("created_at", desc=True)
+        .limit(1)
+        .execute()
+    )
+
+    # Return the first (most recent) record, or null if none exists
+    return satellite_response.data[0] if satellite_response.data else None
+
+
+def fetch_environmental_record(farm_id: str):
+    """Fetch the environmental data entry for a farm, or None if none exists."""
+    environmental_response = (
+        supabase_client.get()
+        .table("environmental_data")
+        .select("*")
+        .eq("farm_id", farm_id)
+        .limit(1)
+        .execute()
+    )
+
+    # Return the first record, or null if none exists
+    return environmental_response.data[0] if environmental_response.data else None
+
+
 @app.route("/api/satellite-data", methods=["GET"])
 def get_satellite_data():
     """
@@ -332,19 +790,7 @@ def get_satellite_data():
     Returns the most recent satellite data entry.
     """
     try:
-        # Fetch the most recent satellite data (ordered by created_at)
-        satellite_response = (
-            supabase.table("satellite_data_table")
-            .select("*")
-            .order("created_at", desc=True)
-            .limit(1)
-            .execute()
-        )
-
-        # Return the first (most recent) record, or null if none exists
-        satellite_data = satellite_response.data[0] if satellite_response.data else None
-
-        return jsonify(satellite_data), 200
+        return jsonify(fetch_latest_satellite_record()), 200
 
     except Exception as e:
         print(f"Error in /api/satellite-data endpoint: {e}")
@@ -361,61 +807,123 @@ def get_environmental_data():
         # Get farm_id parameter from query string (default to FARM01)
         farm_id = request.args.get("farm_id", "FARM01")
 
-        # Fetch environmental data for the specified farm
-        environmental_response = (
-            supabase.table("environmental_data")
-            .select("*")
-            .eq("farm_id", farm_id)
-            .limit(1)
-            .execute()
-        )
-
-        # Return the first record, or null if none exists
-        environmental_data = (
-            environmental_response.data[0] if environmental_response.data else None
-        )
-
-        return jsonify(environmental_data), 200
+        return jsonify(fetch_environmental_record(farm_id)), 200
 
     except Exception as e:
         print(f"Error in /api/environmental-data endpoint: {e}")
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/rag-query", methods=["POST"])
-def rag_query():
-    try:
-        data = request.get_json()
+class ChatRequestError(ValueError):
+    """Raised for a malformed /rag-query request body."""
 
-        if not data or "messages" not in data:
-            return jsonify({"error": 'Missing "messages" in request body'}), 400
-
-        messages = data["messages"]
-        n_results = data.get("n_results", 3)
-
-        # Get the latest user message for RAG context retrieval
-        user_messages = [m for m in messages if m["role"] == "user"]
-        if not user_messages:
-            return jsonify({"error": "No user messages found"}), 400
-
-        # Extract text from the latest user message (handle both string and multimodal format)
-        latest_message_content = user_messages[-1]["content"]
-        if isinstance(latest_message_content, str):
-            latest_user_prompt = latest_message_content
-        elif isinstance(latest_message_content, list):
-            # Multimodal format - extract text from the array
-            text_parts = [
-                item.get("text", "")
-                for item in latest_message_content
-                if item.get("type") == "text"
-            ]
-            latest_user_prompt = " ".join(text_parts)
-        else:
-            latest_user_prompt = str(latest_message_content)
 
-        # Get relevant context from RAG
-        context_items = get_rag_context(latest_user_prompt, n_results)
-        print(context_items)
+def prepare_chat(data):
+    """
+    Do the blocking work of a /rag-query request before the LLM call.
+
+    Retrieves RAG context and realtime farm data, builds the LLM messages and
+    looks the prompt up in the answer cache.
+
+    Args:
+        data: Parsed JSON request body
+
+    Returns:
+        Dictionary describing the chat turn (see keys below)
+
+    Raises:
+        ChatRequestError: If the request body is malformed
+    """
+    if not data or "messages" not in data:
+        raise ChatRequestError('Missing "messages" in request body')
+
+    messages = data["messages"]
+    n_results = data.get("n_results", 3)
+
+    # Crops grown on the farm ("Maize,Wheat" or a list), to route retrieval
+    crops = data.get("crops")
+    crop_list = parse_crop_list(crops) if isinstance(crops, str) else crops
+
+    # Get the latest user message for RAG context retrieval
+    user_messages = [m for m in messages if m["role"] == "user"]
+    if not user_messages:
+        raise ChatRequestError("No user messages found")
+
+    # Extract text from the latest user message (handle both string and multimodal format)
+    latest_message_content = user_messages[-1]["content"]
+    if isinstance(latest_message_content, str):
+        latest_user_prompt = latest_message_content
+    elif isinstance(latest_message_content, list):
+        # Multimodal format - extract text from the array
+        text_parts = [
+            item.get("text", "")
+            for item in latest_message_content
+            if item.get("type") == "text"
+        ]
+        latest_user_prompt = " ".join(text_parts)
+    else:
+        latest_user_prompt = str(latest_message_content)
+
+    timings = RequestTimings()
+
+    # Downsize photos; images resent with the history come from the cache
+    with timings.stage("image_preprocess"):
+        messages = [
+            (
+                {**m, "content": image_preprocessor.process_content(m["content"])}
+                if isinstance(m.get("content"), list)
+                else m
+            )
+            for m in messages
+        ]
+
+    # Embed the prompt once for both retrieval and the answer cache
+    with timings.stage("embed"):
+        prompt_embedding = (
+            embed_query(latest_user_prompt) if latest_user_prompt.strip() else None
+        )
+
+    # Get relevant context from RAG
+    with timings.stage("retrieval"):
+        context_items = get_rag_context(
+            latest_user_prompt,
+            n_results,
+            query_embedding=prompt_embedding,
+            crop_list=crop_list,
+        )
+
+    # Get real-time farm data from Supabase (cached until the agents write)
+    with timings.stage("farm_data"):
+        realtime_data, generations = farm_data_cache.get(data.get("farm_id"))
+
+    # Older turns of a long conversation are replaced by a rolling summary
+    history = [m for m in messages if m["role"] != "system"]
+    with timings.stage("summary"):
+        summary_text, recent_history = conversation_summarizer.compress(history[:-1])
+    summary = summary_message(summary_text) if summary_text else None
+
+    # Fit realtime data, retrieved chunks and history into the token budget
+    with timings.stage("context_pack"):
+        realtime_sections = prompt_assembler.format_realtime_sections(
+            realtime_data, generations
+        )
+        packed = context_packer.get().pack(
+            prompt_assembler.build_system_message(
+                REALTIME_HEADER + REALTIME_FOOTER, ""
+            ),
+            realtime_sections,
+            context_items,
+            recent_history + history[-1:],
+            summary=summary,
+        )
+        context_items = packed["context_items"]
+        history = packed["messages"]
+
+    for part, count in packed["tokens"].items():
+        prompt_tokens.observe(count, part=part)
+
+    with timings.stage("prompt_format"):
+        realtime_text = join_realtime_sections(packed["realtime_sections"])
 
         # Format context for LLM
         context_text = "\n\n".join(
@@ -425,150 +933,333 @@ def rag_query():
             ]
         )
 
-        # Get real-time farm data from Supabase
-        realtime_data = get_realtime_farm_data()
-        realtime_text = format_realtime_data(realtime_data)
-        print(realtime_text)
+        # Create system message with both RAG context and real-time data
+        system_message = prompt_assembler.build_system_message(
+            realtime_text, context_text
+        )
 
-        # Load system prompt template from file
-        system_prompt_path = Path(__file__).parent / "system_prompt.md"
-        with open(system_prompt_path, "r") as f:
-            system_prompt_template = f.read()
+    log_sampled(
+        "chat_context",
+        sources=[item["metadata"].get("source") for item in context_items],
+        chunk_ids=[item["id"] for item in context_items],
+        distances=[item["distance"] for item in context_items],
+        realtime_rows={section: len(rows) for section, rows in realtime_data.items()},
+        realtime_chars=len(realtime_text),
+        tokens=packed["tokens"],
+        dropped=packed["dropped"],
+    )
 
-        # Create system message with both RAG context and real-time data
-        system_message = system_prompt_template.format(
-            realtime_data=realtime_text, rag_context=context_text
+    # Build the messages array for the LLM with the conversation history that fit
+    llm_messages = [{"role": "system", "content": system_message}]
+    if summary is not None:
+        llm_messages.append(summary)
+    for msg in history:
+        llm_messages.append({"role": msg["role"], "content": msg["content"]})
+
+    # Answers to text-only prompts are cached per realtime data, retrieved
+    # chunks and preceding conversation
+    cache_context = None
+    cached_answer = None
+    if prompt_embedding is not None and isinstance(latest_message_content, str):
+        cache_context = context_fingerprint(
+            realtime_text,
+            [item["id"] for item in context_items],
+            ([summary] if summary is not None else []) + history[:-1],
         )
+        with timings.stage("answer_cache"):
+            cached_answer = answer_cache.lookup(prompt_embedding, cache_context)
+
+    return {
+        "stream": data.get("stream", False),
+        "context_items": context_items,
+        "llm_messages": llm_messages,
+        "prompt_embedding": prompt_embedding,
+        "cache_context": cache_context,
+        "cached_answer": cached_answer,
+        "timings": timings,
+        "prompt_tokens": packed["tokens"],
+        "include_timings": bool(data.get("include_timings", False)),
+    }
+
+
+def sources_status_event(context_items):
+    """SSE status event naming the top context sources."""
+    sources = [
+        item["metadata"].get("source", "Unknown").replace(".txt", "")
+        for item in context_items[:2]
+    ]
+    sources_text = ", ".join(sources)
+    return f"data: {json.dumps({'status': f'Analyzing {sources_text}...', 'stage': 'rag'})}\n\n"
+
+
+def chat_client_id(forwarded_for, remote_addr):
+    """
+    Key the LLM wait queue is shared fairly between: the client's address.
+
+    Nothing the client sends (farm_id, or X-Forwarded-For entries it adds
+    itself) is used, since rotating it would get around the per-client queue
+    limit. Behind TRUSTED_PROXY_HOPS trusted proxies (ngrok), the address
+    the outermost of them saw is that many entries from the end of
+    X-Forwarded-For; otherwise it is the peer address.
+    """
+    if TRUSTED_PROXY_HOPS and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(",")]
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS]
+    return remote_addr or "unknown"
+
+
+def queue_timeout_error():
+    return AdmissionRejected(
+        "Timed out waiting for a free slot, please try again shortly",
+        "queue_timeout",
+        llm_admission.retry_after(),
+    )
 
-        # Build the messages array for the LLM with conversation history
-        llm_messages = [{"role": "system", "content": system_message}]
 
-        # Add all conversation history (excluding any existing system messages from client)
-        for msg in messages:
-            if msg["role"] != "system":
-                llm_messages.append({"role": msg["role"], "content": msg["content"]})
+def queued_status_event(ticket):
+    """SSE status event telling a waiting client its place in the queue."""
+    position = ticket.position()
+    status = {
+        "status": f"Waiting in line (position {position})...",
+        "stage": "queued",
+        "position": position,
+    }
+    return f"data: {json.dumps(status)}\n\n"
 
-        # Call OpenAI via Lava Payments
-        token = get_lava_token()
 
-        lava_response = requests.post(
-            "https://api.lavapayments.com/v1/forward?u=https://api.openai.com/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json",
-            },
-            json={"model": "gpt-4o", "messages": llm_messages},
+def wait_for_admission(chat, ticket):
+    """
+    Yield "queued" status events until the ticket gets an upstream slot.
+
+    Raises:
+        AdmissionRejected: No slot became free within the queue timeout
+    """
+    deadline = ticket.enqueued_at + llm_admission.queue_timeout
+    while not ticket.admitted:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise queue_timeout_error()
+        yield queued_status_event(ticket)
+        ticket.wait(min(LLM_QUEUE_STATUS_INTERVAL, remaining))
+    chat["timings"].record("queue_wait", ticket.wait_seconds())
+
+
+def admission_rejection(e: AdmissionRejected):
+    """Body and headers of the 429 response for a rejected chat request."""
+    return {"error": str(e), "reason": e.reason}, {"Retry-After": str(e.retry_after)}
+
+
+def server_timing_headers(chat):
+    """Server-Timing header with the stages completed before the response starts."""
+    return {"Server-Timing": chat["timings"].server_timing_header()}
+
+
+def observe_chat_request(chat):
+    """Record the end-to-end latency of a /rag-query request."""
+    http_request_seconds.observe(
+        time.perf_counter() - chat["timings"].started, route="/rag-query"
+    )
+
+
+def timing_event(chat):
+    """SSE event with the request's stage timings, if the client asked for it."""
+    if not chat["include_timings"]:
+        return ""
+    event = {
+        "timing": chat["timings"].as_dict(),
+        "tokens": chat["prompt_tokens"],
+        "stage": "timing",
+    }
+    return f"data: {json.dumps(event)}\n\n"
+
+
+def replay_cached_answer(chat):
+    """Yield a cached answer as the same SSE events a live answer produces."""
+    if chat["context_items"]:
+        yield sources_status_event(chat["context_items"])
+    cached_answer = chat["cached_answer"]
+    yield from replay_as_sse(cached_answer["response"], cached_answer["model"])
+    yield timing_event(chat)
+    yield "data: [DONE]\n\n"
+
+
+def with_timings(chat, payload):
+    """Add the stage timings and prompt tokens to a response body if asked for."""
+    if chat["include_timings"]:
+        payload["timing"] = chat["timings"].as_dict()
+        payload["tokens"] = chat["prompt_tokens"]
+    return payload
+
+
+def cached_answer_payload(chat):
+    """Non-streaming response body for a cached answer."""
+    return with_timings(
+        chat,
+        {
+            "response": chat["cached_answer"]["response"],
+            "context": chat["context_items"],
+            "model": chat["cached_answer"]["model"],
+            "cached": True,
+        },
+    )
+
+
+def store_streamed_answer(chat, relay: SSERelay):
+    """Cache a streamed answer once the upstream stream completed."""
+    if chat["cache_context"] is not None and relay.done and relay.parts:
+        answer_cache.store(
+            chat["prompt_embedding"], chat["cache_context"], relay.text, relay.model
         )
 
-        # Check if streaming is requested
-        should_stream = data.get("stream", False)
 
-        if should_stream:
+def completed_answer_payload(chat, lava_data):
+    """Non-streaming response body for an upstream completion."""
+    response_text = lava_data["choices"][0]["message"]["content"]
+
+    # Remove markdown formatting symbols
+    response_text = response_text.replace("**", "")
+
+    model = lava_data.get("model", LLM_MODEL)
+    if chat["cache_context"] is not None:
+        answer_cache.store(
+            chat["prompt_embedding"], chat["cache_context"], response_text, model
+        )
+
+    return with_timings(
+        chat,
+        {
+            "response": response_text,
+            "context": chat["context_items"],
+            "model": model,
+        },
+    )
+
+
+def admission_rejected_response(chat, e: AdmissionRejected):
+    observe_chat_request(chat)
+    body, headers = admission_rejection(e)
+    return jsonify(body), 429, headers
+
+
+@app.route("/rag-query", methods=["POST"])
+def rag_query():
+    try:
+        data = request.get_json()
+        try:
+            chat = prepare_chat(data)
+        except ChatRequestError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if chat["cached_answer"] is not None:
+            observe_chat_request(chat)
+            if chat["stream"]:
+                return Response(
+                    stream_with_context(replay_cached_answer(chat)),
+                    mimetype="text/event-stream",
+                    headers=server_timing_headers(chat),
+                )
+            return (
+                jsonify(cached_answer_payload(chat)),
+                200,
+                server_timing_headers(chat),
+            )
+
+        # Take an upstream slot or join the wait queue; reject fast when full
+        try:
+            ticket = llm_admission.enter(
+                chat_client_id(
+                    request.headers.get("X-Forwarded-For"), request.remote_addr
+                )
+            )
+        except AdmissionRejected as e:
+            return admission_rejected_response(chat, e)
+
+        if chat["stream"]:
             # Return streaming response with status updates
             def generate():
+                lava_response = None
+                relay = SSERelay(LLM_MODEL, SSE_FLUSH_INTERVAL)
                 try:
                     # Send single status with context sources if available
-                    if context_items:
-                        sources = [
-                            item["metadata"]
-                            .get("source", "Unknown")
-                            .replace(".txt", "")
-                            for item in context_items[:2]
-                        ]
-                        sources_text = ", ".join(sources)
-                        yield f"data: {json.dumps({'status': f'Analyzing {sources_text}...', 'stage': 'rag'})}\n\n"
-
-                    # Now stream the actual LLM response
-                    lava_response = requests.post(
-                        "https://api.lavapayments.com/v1/forward?u=https://api.openai.com/v1/chat/completions",
-                        headers={
-                            "Authorization": f"Bearer {token}",
-                            "Content-Type": "application/json",
-                        },
-                        json={
-                            "model": "gpt-4o",
-                            "messages": llm_messages,
-                            "stream": True,
-                        },
-                        stream=True,
-                    )
+                    if chat["context_items"]:
+                        yield sources_status_event(chat["context_items"])
+
+                    yield from wait_for_admission(chat, ticket)
+
+                    # Now stream the actual LLM response (the only upstream call)
+                    llm_started = time.perf_counter()
+                    first_token = True
+                    lava_response = chat_completion(chat["llm_messages"], stream=True)
 
                     # Stream the response
                     for line in lava_response.iter_lines():
                         if line:
-                            decoded_line = line.decode("utf-8")
-                            # Forward the SSE data directly to client
-                            if decoded_line.startswith("data: "):
-                                data_content = decoded_line[
-                                    6:
-                                ]  # Remove 'data: ' prefix
-
-                                # Remove ** from content if present
-                                if data_content != "[DONE]":
-                                    try:
-                                        parsed = json.loads(data_content)
-                                        if (
-                                            "choices" in parsed
-                                            and len(parsed["choices"]) > 0
-                                        ):
-                                            if (
-                                                "delta" in parsed["choices"][0]
-                                                and "content"
-                                                in parsed["choices"][0]["delta"]
-                                            ):
-                                                content = parsed["choices"][0]["delta"][
-                                                    "content"
-                                                ]
-                                                content = content.replace("**", "")
-                                                parsed["choices"][0]["delta"][
-                                                    "content"
-                                                ] = content
-                                                data_content = json.dumps(parsed)
-                                    except:
-                                        pass
-
-                                yield f"data: {data_content}\n\n"
+                            frame = relay.relay(line.decode("utf-8"))
+                            if frame is not None:
+                                if first_token:
+                                    chat["timings"].record(
+                                        "llm_ttft", time.perf_counter() - llm_started
+                                    )
+                                    first_token = False
+                                yield frame
+
+                    chat["timings"].record(
+                        "llm_total", time.perf_counter() - llm_started
+                    )
+
+                    # Send any content still batched if the upstream ended early
+                    frame = relay.flush()
+                    if frame is not None:
+                        yield frame
+
+                    store_streamed_answer(chat, relay)
+
+                    yield timing_event(chat)
 
                     # Send completion marker
                     yield "data: [DONE]\n\n"
 
                 except Exception as e:
                     yield f"data: {json.dumps({'error': str(e)})}\n\n"
-
-            return Response(
-                stream_with_context(generate()), mimetype="text/event-stream"
+                finally:
+                    # Return the upstream connection to the shared pool
+                    if lava_response is not None:
+                        lava_response.close()
+                    llm_admission.leave(ticket)
+                    observe_chat_request(chat)
+
+            response = Response(
+                stream_with_context(generate()),
+                mimetype="text/event-stream",
+                headers=server_timing_headers(chat),
             )
-        else:
-            # Non-streaming response (legacy)
-            lava_response = requests.post(
-                "https://api.lavapayments.com/v1/forward?u=https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {token}",
-                    "Content-Type": "application/json",
-                },
-                json={"model": "gpt-4o", "messages": llm_messages},
-            )
-
-        lava_data = lava_response.json()
-        response_text = lava_data["choices"][0]["message"]["content"]
-
-        # Remove markdown formatting symbols
-        response_text = response_text.replace("**", "")
-
-        return (
-            jsonify(
-                {
-                    "response": response_text,
-                    "context": context_items,
-                    "model": lava_data.get("model", "gpt-4o"),
-                }
-            ),
-            200,
-        )
+            # Also frees the slot if the client left before the stream started
+            response.call_on_close(lambda: llm_admission.leave(ticket))
+            return response
+
+        # Non-streaming response (legacy)
+        try:
+            if not ticket.wait(llm_admission.queue_timeout):
+                raise queue_timeout_error()
+            chat["timings"].record("queue_wait", ticket.wait_seconds())
+
+            with chat["timings"].stage("llm_total"):
+                lava_response = chat_completion(chat["llm_messages"])
+                lava_data = lava_response.json()
+        except AdmissionRejected as e:
+            return admission_rejected_response(chat, e)
+        finally:
+            llm_admission.leave(ticket)
+
+        payload = completed_answer_payload(chat, lava_data)
+        observe_chat_request(chat)
+        return jsonify(payload), 200, server_timing_headers(chat)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 if __name__ == "__main__":
+    readiness.start()
     app.run(debug=True, port=8081)
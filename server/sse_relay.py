@@ -0,0 +1,140 @@
+import json
+import re
+import time
+from json.decoder import scanstring
+
+# Locates the start of the delta content string in an upstream chunk
+DELTA_CONTENT_PATTERN = re.compile(r'"delta"\s*:\s*\{[^{}]*?"content"\s*:\s*"')
+MODEL_PATTERN = re.compile(r'"model"\s*:\s*"')
+
+
+class SSERelay:
+    """
+    Relay upstream chat completion SSE lines to the client.
+
+    Content deltas have "**" stripped, and the relayed text and model are kept
+    so the full answer can be cached once the upstream stream completes.
+
+    The delta content is located with a regex and decoded with the C string
+    scanner instead of a json.loads/json.dumps round trip per token. Lines that
+    need no rewrite are forwarded unchanged; a line containing "**" only has its
+    content string re-encoded and spliced back in.
+
+    With a flush_interval above zero, content deltas are batched and sent as one
+    frame once the interval has passed since the last flush. A batch is flushed
+    when the next upstream line arrives after the interval, and always before
+    the upstream [DONE].
+    """
+
+    def __init__(self, model: str, flush_interval: float = 0.0):
+        self.model = model
+        self.flush_interval = flush_interval
+        self.parts = []
+        self.done = False
+        self._model_seen = False
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def _read_model(self, data_content):
+        match = MODEL_PATTERN.search(data_content)
+        if match:
+            self.model = scanstring(data_content, match.end())[0]
+            self._model_seen = True
+
+    def _rewrite_full(self, data_content):
+        # Fallback for chunks the fast path cannot locate content in
+        try:
+            parsed = json.loads(data_content)
+            if "choices" in parsed and len(parsed["choices"]) > 0:
+                delta = parsed["choices"][0].get("delta")
+                if delta and "content" in delta:
+                    content = delta["content"].replace("**", "")
+                    delta["content"] = content
+                    self.parts.append(content)
+                    return json.dumps(parsed), content
+        except Exception:
+            pass
+        return data_content, None
+
+    def _rewrite(self, data_content):
+        """Return the (possibly rewritten) chunk and its content, if any."""
+        match = DELTA_CONTENT_PATTERN.search(data_content)
+        if match is None:
+            if "**" in data_content:
+                return self._rewrite_full(data_content)
+            return data_content, None
+
+        start = match.end()
+        try:
+            content, end = scanstring(data_content, start)
+        except ValueError:
+            return self._rewrite_full(data_content)
+
+        # Remove ** from content if present
+        if "**" in content:
+            content = content.replace("**", "")
+            data_content = (
+                data_content[: start - 1] + json.dumps(content) + data_content[end:]
+            )
+
+        self.parts.append(content)
+        return data_content, content
+
+    def _flush(self):
+        if not self._pending:
+            return ""
+        content = "".join(self._pending)
+        self._pending = []
+        self._last_flush = time.monotonic()
+        frame = {
+            "object": "chat.completion.chunk",
+            "model": self.model,
+            "choices": [{"index": 0, "delta": {"content": content}}],
+        }
+        return f"data: {json.dumps(frame)}\n\n"
+
+    def relay(self, line: str):
+        """
+        Rewrite one upstream SSE line.
+
+        Args:
+            line: Decoded upstream line
+
+        Returns:
+            SSE frame(s) to send to the client, or None if there is nothing to send
+        """
+        # Forward the SSE data directly to client
+        if not line.startswith("data: "):
+            return None
+
+        data_content = line[6:]  # Remove 'data: ' prefix
+        if data_content == "[DONE]":
+            # The caller sends its own completion marker after any trailing events
+            self.done = True
+            return self._flush() or None
+
+        if not self._model_seen:
+            self._read_model(data_content)
+
+        data_content, content = self._rewrite(data_content)
+
+        if self.flush_interval <= 0:
+            return f"data: {data_content}\n\n"
+
+        if content is None:
+            # Non-content chunks (role, finish_reason) keep their order
+            return self._flush() + f"data: {data_content}\n\n"
+
+        if content:
+            self._pending.append(content)
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            return self._flush() or None
+        return None
+
+    def flush(self):
+        """Return any batched content as a final frame, or None."""
+        return self._flush() or None
@@ -0,0 +1,173 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# /proc/self/smaps_rollup fields reported by memory_usage()
+SMAPS_FIELDS = {
+    "Rss": "rss",
+    "Pss": "pss",
+    "Shared_Clean": "shared",
+    "Shared_Dirty": "shared",
+    "Private_Clean": "private",
+    "Private_Dirty": "private",
+}
+
+
+def memory_usage(pid="self"):
+    """
+    Memory of a process in bytes (Linux).
+
+    rss counts every resident page, including pages still shared copy-on-write
+    with the parent; pss splits shared pages between the processes sharing
+    them, so summing pss over workers gives their real footprint. private is
+    what the process would free on exit.
+    """
+    usage = {"rss": 0, "pss": 0, "shared": 0, "private": 0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in SMAPS_FIELDS:
+                    usage[SMAPS_FIELDS[key]] += int(value.split()[0]) * 1024
+    except OSError:
+        # No smaps_rollup (older kernels, other platforms): RSS only, if any
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        usage["rss"] = int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return usage
+
+
+def process_age() -> float:
+    """Seconds since this process was started or forked (Linux), else 0."""
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22, counted after the parenthesized command name
+            start_ticks = int(f.read().rpartition(")")[2].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class LazyResource:
+    """
+    A resource created on first use.
+
+    Per-process resources (network clients, database handles) are created again
+    in a forked child, since sockets, locks and threads cannot be shared between
+    processes. Other resources (read-only model weights) are created once and
+    inherited by forked workers, which share their pages copy-on-write.
+
+    describe, if given, maps the loaded value to extra details for stats().
+    """
+
+    def __init__(self, name: str, factory, per_process: bool = False, describe=None):
+        self.name = name
+        self.factory = factory
+        self.per_process = per_process
+        self.describe = describe
+        self._lock = threading.Lock()
+        self._value = None
+        self._pid = None
+        self.load_seconds = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._pid is not None and (
+            not self.per_process or self._pid == os.getpid()
+        )
+
+    def get(self):
+        if self.loaded:
+            return self._value
+        with self._lock:
+            if not self.loaded:
+                started = time.perf_counter()
+                self._value = self.factory()
+                self.load_seconds = time.perf_counter() - started
+                self._pid = os.getpid()
+                logger.info(f"Loaded {self.name} in {self.load_seconds:.2f}s")
+        return self._value
+
+    def stats(self):
+        stats = {
+            "loaded": self.loaded,
+            "load_seconds": self.load_seconds if self.loaded else None,
+            # Loaded by the parent before this process was forked
+            "inherited": self.loaded and self._pid != os.getpid(),
+        }
+        if self.describe is not None and self.loaded:
+            stats.update(self.describe(self._value))
+        return stats
+
+
+class Readiness:
+    """
+    Warm-up and readiness of one server process.
+
+    start() runs warm_up once per process on a background thread; the process
+    is ready when it returns. Cold-start time is measured from when the process
+    was started, or forked from a preloading master, to when it became ready.
+    """
+
+    def __init__(self, warm_up, resources=()):
+        self.warm_up = warm_up
+        self.resources = list(resources)
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self.pid = os.getpid()
+        self.started = time.perf_counter() - process_age()
+        self.cold_start_seconds = None
+        self.error = None
+        self._thread = None
+
+    def start(self):
+        """Start warming up this process, unless already started or ready."""
+        with self._lock:
+            if self.cold_start_seconds is not None or (
+                self._thread is not None and self._thread.is_alive()
+            ):
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            self.warm_up()
+        except Exception as e:
+            # Reported as not ready; the next start() tries again
+            self.error = str(e)
+            logger.warning(f"Warm-up of process {self.pid} failed: {e}")
+            return
+        self.error = None
+        self.cold_start_seconds = time.perf_counter() - self.started
+        memory = memory_usage()
+        logger.info(
+            f"Process {self.pid} ready in {self.cold_start_seconds:.2f}s, "
+            f"RSS {memory['rss'] / 1e6:.0f} MB, PSS {memory['pss'] / 1e6:.0f} MB"
+        )
+
+    @property
+    def ready(self) -> bool:
+        return self.cold_start_seconds is not None
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "pid": self.pid,
+            "cold_start_seconds": self.cold_start_seconds,
+            "error": self.error,
+            "memory": memory_usage(),
+            "resources": {r.name: r.stats() for r in self.resources},
+        }
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Import the server modules as the server does, from the server directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
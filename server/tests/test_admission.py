@@ -0,0 +1,37 @@
+import asyncio
+
+from admission import AdmissionController
+
+
+def test_timed_out_async_waiter_is_not_woken_when_granted():
+    controller = AdmissionController(max_concurrent=1)
+    holder = controller.enter("a")
+    waiter = controller.enter("b")
+
+    async def wait_a_few_times():
+        return [await waiter.wait_async(0.01) for _ in range(3)]
+
+    # The loop is closed once asyncio.run returns, so a leftover wake-up
+    # callback would fail when the slot is handed over
+    assert asyncio.run(wait_a_few_times()) == [False, False, False]
+    assert waiter._wakeups == []
+
+    controller.leave(holder)
+
+    assert waiter.admitted
+    assert controller.stats()["active"] == 1
+    controller.leave(waiter)
+
+
+def test_async_waiter_is_woken_when_granted():
+    controller = AdmissionController(max_concurrent=1)
+    holder = controller.enter("a")
+    waiter = controller.enter("b")
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.01, controller.leave, holder)
+        return await waiter.wait_async(5)
+
+    assert asyncio.run(main())
+    assert waiter._wakeups == []
@@ -0,0 +1,36 @@
+from context_packer import ContextPacker, TokenCounter
+
+
+class WordCounter(TokenCounter):
+    """One token per word, so budgets are easy to reason about."""
+
+    def __init__(self):
+        self.count = lambda text: len(text.split())
+
+
+def chunk(source, words):
+    return {"metadata": {"source": source}, "text": " ".join(["word"] * words)}
+
+
+def test_chunks_after_one_that_does_not_fit_are_dropped():
+    packer = ContextPacker(WordCounter(), budget=1000, rag_max_tokens=20)
+    items = [chunk("best", 50), chunk("second", 2), chunk("third", 2)]
+
+    packed = packer.pack("", {}, items, [{"role": "user", "content": "hi"}])
+
+    assert packed["context_items"] == []
+    assert packed["dropped"]["context_items"] == 3
+    assert packed["tokens"]["rag"] == 0
+
+
+def test_chunks_are_kept_in_rank_order_until_the_budget_is_spent():
+    packer = ContextPacker(WordCounter(), budget=1000, rag_max_tokens=20)
+    items = [chunk("best", 5), chunk("second", 5), chunk("third", 15), chunk("x", 1)]
+
+    packed = packer.pack("", {}, items, [{"role": "user", "content": "hi"}])
+
+    assert [item["metadata"]["source"] for item in packed["context_items"]] == [
+        "best",
+        "second",
+    ]
+    assert packed["dropped"]["context_items"] == 2
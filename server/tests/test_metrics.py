@@ -0,0 +1,57 @@
+import multiprocessing
+import os
+
+from metrics import MetricsRegistry
+
+
+def record(directory, stage_seconds, requests, queued):
+    registry = MetricsRegistry(directory)
+    stages = registry.histogram("chat_stage_seconds", "Chat stage latency")
+    served = registry.counter("requests_total", "Requests served")
+    registry.gauge("queued_requests", "Requests waiting", lambda: queued)
+    for seconds in stage_seconds:
+        stages.observe(seconds, stage="llm")
+    served.inc(requests, route="/rag-query")
+    registry.write_snapshot()
+
+
+def run_in_process(*args):
+    process = multiprocessing.get_context("spawn").Process(target=record, args=args)
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    return process.pid
+
+
+def scrape(directory):
+    registry = MetricsRegistry(directory)
+    registry.histogram("chat_stage_seconds", "Chat stage latency")
+    registry.counter("requests_total", "Requests served")
+    registry.gauge("queued_requests", "Requests waiting", lambda: 0)
+    return registry, registry.render().splitlines()
+
+
+def test_render_adds_up_every_process(tmp_path):
+    first = run_in_process(str(tmp_path), [0.25, 3.0], 2, 1)
+    second = run_in_process(str(tmp_path), [0.25], 5, 4)
+
+    _, lines = scrape(str(tmp_path))
+
+    assert 'chat_stage_seconds_count{stage="llm"} 3' in lines
+    assert 'chat_stage_seconds_bucket{stage="llm",le="0.25"} 2' in lines
+    assert 'chat_stage_seconds_sum{stage="llm"} 3.5' in lines
+    assert 'requests_total{route="/rag-query"} 7' in lines
+    assert f'queued_requests{{pid="{first}"}} 1' in lines
+    assert f'queued_requests{{pid="{second}"}} 4' in lines
+    assert f'queued_requests{{pid="{os.getpid()}"}} 0' in lines
+
+
+def test_exited_process_keeps_counts_but_not_gauges(tmp_path):
+    pid = run_in_process(str(tmp_path), [0.2], 2, 3)
+
+    registry, _ = scrape(str(tmp_path))
+    registry.mark_process_dead(pid)
+    lines = registry.render().splitlines()
+
+    assert 'requests_total{route="/rag-query"} 2' in lines
+    assert not any(f'pid="{pid}"' in line for line in lines)